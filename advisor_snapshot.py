@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import namedtuple
+
+# 檢查規則是否變更的間隔（秒）；修改規則後最晚在這段時間之後生效
+RELOAD_INTERVAL = 0.5
+
+AdvisorSnapshot = namedtuple("AdvisorSnapshot", ["version", "rules", "grade_rules", "resources", "word_flags", "topics"])
+AdvisorSnapshot.__doc__ = """建議生成所需的規則與資源（建立後不再修改，更新時整份替換）
+
+- version：建立快照時的規則版本號
+- rules：(年級, 觸發條件) → ((規則類型, 建議模板), ...)
+- grade_rules：年級 → 該年級所有規則（無觸發條件時的通用建議）
+- resources：資源類型 → 詞語
+- word_flags：詞語 → 句子成分位元遮罩
+- topics：作文題目 → 切題向量（TopicProfile）
+"""
+
+
+def install_version_triggers(cursor):
+    """建立規則版本表與觸發器：規則、資源或題目向量表有任何新增、修改、刪除時版本號加一"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS config_version (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO config_version (name, version) VALUES ('rules', 0)")
+    for table in ("writing_rules", "student_resources", "topic_profiles"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+            BEGIN UPDATE config_version SET version = version + 1 WHERE name = 'rules'; END
+            ''')
+
+
+def read_rules_version(conn, name="rules"):
+    row = conn.execute("SELECT version FROM config_version WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def index_rules(rows):
+    """把 (年級, 觸發條件, 規則類型, 建議模板) 依規則順序建成查詢表"""
+    rules, grade_rules = {}, {}
+    for grade, trigger, rule_type, template in rows:
+        rules.setdefault((grade, trigger), []).append((rule_type, template))
+        grade_rules.setdefault(grade, []).append((rule_type, template))
+    return ({key: tuple(value) for key, value in rules.items()},
+            {key: tuple(value) for key, value in grade_rules.items()})
+
+
+class SnapshotReloader:
+    """持有目前的快照，定期檢查資料庫是否變更並整份替換
+
+    讀取端只取 self.snapshot 的參考，不加鎖也不查資料庫；
+    檢查時先看 PRAGMA data_version（其他連線提交過才會變），有變才讀規則版本號，
+    版本號不同才在一個讀取交易內重建快照，再以一次指派替換。
+    同一時間只有一個執行緒做檢查，其他執行緒直接使用目前的快照。
+    connect 回傳目前執行緒可用的連線（如唯讀連線池的 connection），檢查由哪個執行緒做都可以。
+    name 為 config_version 中的版本名稱（其他資料如範例句索引也可用同樣方式熱更新）。
+    """
+
+    def __init__(self, connect, loader, interval=RELOAD_INTERVAL, name="rules"):
+        self._connect = connect
+        self._loader = loader
+        self.interval = interval
+        self.name = name
+        self._lock = threading.Lock()
+        conn = connect()
+        # 上次檢查所用的（連線, data_version）；data_version 只能與同一連線先前的值比較
+        self._checked = (conn, self._read_data_version(conn))
+        self.snapshot = self._load(conn)
+        self._next_check = time.monotonic() + interval
+
+    @staticmethod
+    def _read_data_version(conn):
+        return conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load(self, conn):
+        conn.execute("BEGIN")
+        try:
+            return self._loader(conn, read_rules_version(conn, self.name))
+        finally:
+            conn.rollback()
+
+    def _changed(self, conn):
+        """上次檢查後是否可能有其他連線提交過（換了連線時無從比較，視為可能變更）"""
+        data_version = self._read_data_version(conn)
+        (checked_conn, checked_version), self._checked = self._checked, (conn, data_version)
+        return checked_conn is not conn or checked_version != data_version
+
+    def current(self):
+        """取得目前的快照（到了檢查時間且沒有其他執行緒在檢查時，順便檢查是否需要更新）"""
+        if time.monotonic() >= self._next_check and self._lock.acquire(blocking=False):
+            try:
+                self._next_check = time.monotonic() + self.interval
+                conn = self._connect()
+                if self._changed(conn) and read_rules_version(conn, self.name) != self.snapshot.version:
+                    self.snapshot = self._load(conn)
+            finally:
+                self._lock.release()
+        return self.snapshot
+
+    def reconnect(self):
+        """保留目前快照但不再沿用舊連線的檢查結果（fork 後的子進程使用）；下次檢查時比對版本號，期間有更新才重新載入"""
+        with self._lock:
+            self._checked = (None, None)
+            self._next_check = 0.0
+
+    def reload(self):
+        """立即重建快照（如本連線自己修改了規則）"""
+        with self._lock:
+            conn = self._connect()
+            self._checked = (conn, self._read_data_version(conn))
+            self.snapshot = self._load(conn)
+            return self.snapshot
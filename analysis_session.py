@@ -0,0 +1,83 @@
+from collections import OrderedDict, deque
+
+# 連續規則的句數（如「連續3句無比喻詞」）
+STREAK_LENGTH = 3
+
+
+class AnalysisSession:
+    """編輯器持有的逐句分析狀態
+
+    - recent：最近幾句特徵的環狀緩衝區，連續規則與上下句銜接只看這幾句
+    - 特徵快取：句子 → 成分特徵，評分時直接重用，不必重新分詞
+    每加入一句只做固定量的工作，與作文長度無關。
+    """
+
+    def __init__(self, advisor, topic=None, window=STREAK_LENGTH, cache_size=1024):
+        self.advisor = advisor
+        # 作文題目（用於切題檢查，未設定時不檢查）
+        self.topic = topic
+        self.recent = deque(maxlen=window)
+        self.cache_size = cache_size
+        self._features = OrderedDict()
+        self._version = None
+        # 預先分析的句子：（句子, 題目, 規則版本, 範例句版本）→（分詞, 切題與範例句）
+        self._prepared = None
+
+    def features_for(self, sentence):
+        """取得句子特徵（已分析過的句子直接從快取讀取；規則資源更新後快取作廢）"""
+        version = self.advisor.snapshot.version
+        if version != self._version:
+            self._features.clear()
+            self._version = version
+        key = sentence.strip()
+        features = self._features.get(key)
+        if features is None:
+            features = self.advisor._sentence_features(key)
+            self._features[key] = features
+            if len(self._features) > self.cache_size:
+                self._features.popitem(last=False)
+        else:
+            self._features.move_to_end(key)
+        return features
+
+    def prepare(self, sentence, topic=None):
+        """預先分析句子但不加入最近幾句（編輯器閒置時使用），回傳（分詞, (是否偏離主題, 範例句)）
+
+        同一句、同一題目且規則與範例句沒有更新時，直接回傳上次的結果。
+        """
+        key = sentence.strip()
+        topic = topic or self.topic
+        words = self.features_for(key)["words"]
+        state = (key, topic, self.advisor.snapshot.version, self.advisor.exemplar_version)
+        if self._prepared is None or self._prepared[0] != state:
+            self._prepared = (state, self.advisor._sentence_context(key, topic, words))
+        return words, self._prepared[1]
+
+    def observe(self, sentence):
+        """加入新完成的句子，回傳與 _analyze_sentence 相同格式的分析結果"""
+        features = self.features_for(sentence)
+        prev_words = self.recent[-1]["words"] if self.recent else []
+        self.recent.append(features)
+        analysis = {key: value for key, value in features.items() if key != "words"}
+        analysis["prev_similarity"] = self.advisor._calc_similarity(features["words"], prev_words)
+        return analysis
+
+    def replace_last(self, sentence):
+        """最後一句被改寫（如採納建議）時，以新句子取代"""
+        if self.recent:
+            self.recent.pop()
+        self.recent.append(self.features_for(sentence))
+
+    def streak(self, flag):
+        """從最新一句往回數，連續缺少某成分的句數（最多到緩衝區長度）"""
+        count = 0
+        for features in reversed(self.recent):
+            if features[flag]:
+                break
+            count += 1
+        return count
+
+    def reset(self):
+        self.recent.clear()
+        self._features.clear()
+        self._prepared = None
@@ -1,8 +1,33 @@
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, Response, render_template, send_from_directory, request, jsonify, stream_with_context
 import os
+import threading
 import zipfile
 
+import jieba
+
+import class_analytics
+import record_export
+import record_sync
+from storage_router import StorageRouter
+from writing_advisor import WritingAdvisor
+
 app = Flask(__name__)
+# 練習記錄的儲存路由（同步上傳、班級分析共用）；未指定時每個執行緒依環境變數各自建立（SQLite連線不能跨執行緒）
+app.config.setdefault("STORAGE_ROUTER", None)
+_storage_local = threading.local()
+# 建議生成器（規則快照、分詞詞典、錯字模型都是唯讀的，同一進程的所有執行緒共用一個）
+app.config.setdefault("ADVISOR", None)
+_advisor_lock = threading.Lock()
+
+# 可供下載的程式檔（ZIP 與 /files/ 只提供這些；資料庫、分庫、備份與自動暫存都不對外）
+DOWNLOAD_FILES = (
+    'main.py',
+    'writing_advisor.py',
+    'db_init.py',
+    'requirements_desktop.txt',
+    'README.md',
+    '.gitignore'
+)
 
 # 创建ZIP文件的函数
 def create_zip():
@@ -10,16 +35,7 @@ def create_zip():
     if not os.path.exists(zip_filename):
         with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
             # 添加所有必要的文件
-            files_to_zip = [
-                'main.py',
-                'writing_advisor.py', 
-                'db_init.py',
-                'requirements_desktop.txt',
-                'README.md',
-                '.gitignore'
-            ]
-            
-            for file in files_to_zip:
+            for file in DOWNLOAD_FILES:
                 if os.path.exists(file):
                     zipf.write(file)
         
@@ -40,8 +56,125 @@ def download():
 
 @app.route('/files/<path:path>')
 def send_file(path):
+    if path not in DOWNLOAD_FILES:
+        return jsonify({"error": "not found"}), 404
     return send_from_directory('.', path)
 
+def get_storage_router():
+    router = app.config["STORAGE_ROUTER"]
+    if router is None:
+        router = getattr(_storage_local, "router", None)
+        if router is None:
+            router = _storage_local.router = StorageRouter.from_env()
+    return router
+
+def get_advisor():
+    advisor = app.config["ADVISOR"]
+    if advisor is None:
+        with _advisor_lock:
+            advisor = app.config["ADVISOR"]
+            if advisor is None:
+                advisor = app.config["ADVISOR"] = WritingAdvisor(StorageRouter.from_env())
+    return advisor
+
+@app.route('/healthz')
+def healthz():
+    # 工作進程狀態；warm 表示分詞詞典已載入（由主進程預先載入後 fork 繼承）
+    return jsonify({"status": "ok", "pid": os.getpid(), "warm": bool(jieba.dt.initialized)})
+
+def _invalid_text_fields(data, fields):
+    # 選填的文字欄位只能是字串或 null，回傳第一個型別錯誤的欄位名稱
+    for field in fields:
+        if not isinstance(data.get(field), (str, type(None))):
+            return field
+    return None
+
+@app.route('/api/suggestions', methods=['POST'])
+def sentence_suggestions():
+    # 單句優化建議：{"sentence": ..., "prev_sentence": ..., "grade": "3-6年級", "topic": ...}
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    sentence = data.get('sentence')
+    if not isinstance(sentence, str) or not sentence.strip():
+        return jsonify({"error": "缺少 sentence"}), 400
+    field = _invalid_text_fields(data, ('prev_sentence', 'grade', 'topic'))
+    if field:
+        return jsonify({"error": f"{field} 必須是文字"}), 400
+    suggestions = get_advisor().generate_suggestions(
+        sentence, data.get('prev_sentence') or "", data.get('grade') or "3-6年級", topic=data.get('topic'))
+    return jsonify({"suggestions": suggestions})
+
+@app.route('/api/score', methods=['POST'])
+def composition_score():
+    # 作文評分：{"text": ..., "topic": ...}，回傳總分與分項得分
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    text = data.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return jsonify({"error": "缺少 text"}), 400
+    if _invalid_text_fields(data, ('topic',)):
+        return jsonify({"error": "topic 必須是文字"}), 400
+    total, scores = get_advisor().calculate_score(text, topic=data.get('topic'))
+    return jsonify({"total": total, "scores": scores})
+
+@app.route('/api/sync/practice-records', methods=['POST'])
+def sync_practice_records():
+    # 接收桌面版上傳的練習記錄（gzip壓縮的JSON），重複上傳的記錄自動略過
+    if not record_sync.token_configured():
+        # 沒有設定權杖時不接收上傳，避免任何人都能寫入練習記錄
+        return jsonify({"error": f"伺服器未設定 {record_sync.SYNC_TOKEN_ENV}，同步功能停用"}), 403
+    if not record_sync.check_token(request.headers.get('Authorization')):
+        return jsonify({"error": "unauthorized"}), 401
+    try:
+        payload = record_sync.decode_body(request.get_data(), request.headers.get('Content-Encoding'))
+        result = record_sync.receive_batch(get_storage_router(), payload)
+    except record_sync.SyncPayloadError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@app.route('/api/analytics/scores')
+def score_analytics():
+    # 班級分數統計（只回傳彙總數字，不含作文內容）；可用 mode、school_id、class_id、topic、since、until 篩選
+    args = request.args
+    report = class_analytics.class_report(
+        get_storage_router(),
+        practice_mode=args.get('mode', '作文模式'),
+        school_id=args.get('school_id'),
+        class_id=args.get('class_id'),
+        topic=args.get('topic'),
+        since=args.get('since'),
+        until=args.get('until'),
+    )
+    return jsonify(report)
+
+@app.route('/api/export/records')
+def export_records():
+    # 串流匯出練習記錄（含作文內容，一律需要同步權杖）：format=csv|jsonl，可用 student_id、mode、topic、school_id、class_id、since、until 篩選
+    if not record_sync.token_configured():
+        # 沒有設定權杖時不開放匯出，避免預設部署把所有作文公開
+        return jsonify({"error": f"伺服器未設定 {record_sync.SYNC_TOKEN_ENV}，匯出功能停用"}), 403
+    if not record_sync.check_token(request.headers.get('Authorization')):
+        return jsonify({"error": "unauthorized"}), 401
+    args = request.args
+    fmt = args.get('format', 'csv')
+    if fmt not in record_export.TEXT_FORMATS:
+        return jsonify({"error": f"不支援的匯出格式：{fmt}"}), 400
+    records = record_export.iter_export(
+        get_storage_router(),
+        student_id=args.get('student_id'),
+        practice_mode=args.get('mode'),
+        topic=args.get('topic'),
+        school_id=args.get('school_id'),
+        class_id=args.get('class_id'),
+        since=args.get('since'),
+        until=args.get('until'),
+    )
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(record_export.TEXT_FORMATS[fmt](records)), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=practice_records.{fmt}"})
+
 if __name__ == '__main__':
     # 创建templates目录（如果不存在）
     if not os.path.exists('templates'):
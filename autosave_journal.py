@@ -0,0 +1,173 @@
+import glob
+import json
+import os
+import time
+import uuid
+
+# 自動儲存日誌存放目錄
+AUTOSAVE_DIR = "autosave"
+
+JOURNAL_VERSION = 1
+
+
+def _dump(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _fsync_write(path, content):
+    """寫入暫存檔並同步到磁碟後再原子替換，避免留下寫到一半的檔案"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class AutosaveJournal:
+    """作文編輯日誌：只追加編輯差異（位置, 刪除字數, 新增文字），批次同步到磁碟
+
+    每個練習階段有兩個檔案：
+    - <session>.snapshot：最近一次壓縮時的全文快照（JSON）
+    - <session>.journal：快照之後的編輯差異，每行一筆
+    快照與日誌都記錄世代編號（gen），重啟時只重播與快照同世代的日誌。
+    """
+
+    def __init__(self, session_id=None, meta=None, directory=AUTOSAVE_DIR,
+                 batch_size=32, flush_interval=1.0, compact_every=500, initial_text="", dirty=False):
+        self.directory = directory
+        self.session_id = session_id or time.strftime("%Y%m%d%H%M%S") + "_" + uuid.uuid4().hex[:6]
+        self.meta = meta or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.generation = 0
+        self.deltas_since_snapshot = 0
+        self.dirty = dirty
+        self._pending = []
+        self._last_sync = time.monotonic()
+        self._file = None
+        os.makedirs(self.directory, exist_ok=True)
+        self.compact(initial_text)
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, self.session_id + ".snapshot")
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.directory, self.session_id + ".journal")
+
+    @property
+    def needs_compaction(self):
+        return self.deltas_since_snapshot >= self.compact_every
+
+    @classmethod
+    def resume(cls, restored, directory=AUTOSAVE_DIR, **kwargs):
+        """以恢復的內容接續原本的練習階段（先寫入新快照再繼續記錄）"""
+        return cls(session_id=restored.session_id, meta=restored.meta, directory=directory,
+                   initial_text=restored.text, dirty=restored.dirty, **kwargs)
+
+    def append(self, position, removed, added):
+        """記錄一筆編輯差異；只放入緩衝區，達到批次大小或時間間隔才同步"""
+        self._pending.append(_dump([position, removed, added]))
+        self.deltas_since_snapshot += 1
+        self.dirty = True
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_sync >= self.flush_interval:
+            self.sync()
+
+    def mark_saved(self):
+        """標記目前內容已儲存到練習記錄，之後沒有新編輯就不需要恢復"""
+        self._pending.append(_dump({"saved": 1}))
+        self.dirty = False
+        self.sync()
+
+    def sync(self):
+        """把緩衝區的差異寫入日誌並同步到磁碟"""
+        self._last_sync = time.monotonic()
+        if not self._pending:
+            return
+        self._file.write("\n".join(self._pending) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending.clear()
+
+    def compact(self, text):
+        """把全文寫成新世代快照，並以空白日誌重新開始"""
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+        self.generation += 1
+        snapshot = {"v": JOURNAL_VERSION, "gen": self.generation, "meta": self.meta, "text": text,
+                    "saved": not self.dirty}
+        _fsync_write(self.snapshot_path, _dump(snapshot))
+        _fsync_write(self.journal_path, _dump({"v": JOURNAL_VERSION, "gen": self.generation}) + "\n")
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+        self.deltas_since_snapshot = 0
+
+    def close(self, discard=False):
+        """結束記錄；discard=True 時刪除此階段的檔案"""
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+        if discard:
+            for path in (self.snapshot_path, self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class RestoredSession:
+    """重播日誌後得到的練習階段內容"""
+
+    def __init__(self, session_id, meta, text, dirty):
+        self.session_id = session_id
+        self.meta = meta
+        self.text = text
+        self.dirty = dirty
+
+
+def restore_session(session_id, directory=AUTOSAVE_DIR):
+    """讀取快照並重播同世代日誌，還原練習階段的全文"""
+    snapshot_path = os.path.join(directory, session_id + ".snapshot")
+    journal_path = os.path.join(directory, session_id + ".journal")
+    with open(snapshot_path, encoding="utf-8") as f:
+        snapshot = json.load(f)
+    text = snapshot["text"]
+    dirty = not snapshot.get("saved", False)
+    if os.path.exists(journal_path):
+        with open(journal_path, encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = {}
+        # 日誌世代與快照不同：壓縮途中中斷，快照已包含這些差異
+        if header.get("gen") == snapshot["gen"]:
+            for line in lines[1:]:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 最後一行可能在寫入途中中斷
+                    break
+                if isinstance(record, dict):
+                    dirty = not record.get("saved")
+                    continue
+                position, removed, added = record
+                text = text[:position] + added + text[position + removed:]
+                dirty = True
+    return RestoredSession(session_id, snapshot.get("meta", {}), text, dirty)
+
+
+def pending_sessions(directory=AUTOSAVE_DIR):
+    """找出尚未儲存的練習階段（新到舊），供下次啟動時恢復"""
+    sessions = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.snapshot")), reverse=True):
+        session_id = os.path.basename(path)[:-len(".snapshot")]
+        try:
+            restored = restore_session(session_id, directory)
+        except (OSError, ValueError, KeyError):
+            continue
+        if restored.dirty and restored.text.strip():
+            sessions.append(restored)
+    return sessions
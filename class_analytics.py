@@ -0,0 +1,192 @@
+import argparse
+import json
+
+import numpy as np
+
+from db_init import SUB_SCORE_COLUMNS
+
+# 分析的指標：總分與各分項得分（名稱, 欄位, 滿分）
+METRICS = [("總分", "score", 100)] + SUB_SCORE_COLUMNS
+PERCENTILES = (10, 25, 50, 75, 90)
+# 分項得分低於滿分此比例時視為弱項
+WEAK_RATIO = 0.6
+CHUNK_SIZE = 20000
+
+# 週次以整數 年*100+週 表示，方便放進數值陣列；練習時間無法解析時為 UNKNOWN_WEEK
+# （仍計入分數統計，但不列入每週趨勢）
+UNKNOWN_WEEK = 0
+_WEEK_SQL = (f"COALESCE(CAST(strftime('%Y', COALESCE(practice_time, 'now')) AS INTEGER) * 100"
+             f" + CAST(strftime('%W', COALESCE(practice_time, 'now')) AS INTEGER), {UNKNOWN_WEEK})")
+
+
+class ScoreAccumulator:
+    """逐批累加分數統計，記憶體用量只與批次大小、學生數和週數有關，與記錄總數無關
+
+    - 每個指標以 1 分為一格累計直方圖，百分位數由直方圖推算（精確到 1 分）
+    - 平均、標準差由總和與平方和計算
+    - 各分項的弱項比例、各篇最弱的分項、每週平均以向量運算累加
+    多個分庫可餵入同一個累加器後再取結果。
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.students = set()
+        self.histograms = [np.zeros(full + 1, dtype=np.int64) for _, _, full in METRICS]
+        self.sums = np.zeros(len(METRICS))
+        self.squares = np.zeros(len(METRICS))
+        self.counts = np.zeros(len(METRICS), dtype=np.int64)
+        self.minimum = np.full(len(METRICS), np.inf)
+        self.maximum = np.full(len(METRICS), -np.inf)
+        self.below = np.zeros(len(SUB_SCORE_COLUMNS), dtype=np.int64)
+        self.weakest = np.zeros(len(SUB_SCORE_COLUMNS), dtype=np.int64)
+        self.weeks = {}
+
+    def add_chunk(self, student_ids, weeks, values):
+        """加入一批記錄：values 為 (筆數, 指標數) 的浮點陣列，未評分為 NaN"""
+        self.records += len(values)
+        self.students.update(student_ids)
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0.0)
+        self.counts += present.sum(axis=0)
+        self.sums += filled.sum(axis=0)
+        self.squares += (filled * filled).sum(axis=0)
+        self.minimum = np.fmin(self.minimum, np.where(present, values, np.inf).min(axis=0))
+        self.maximum = np.fmax(self.maximum, np.where(present, values, -np.inf).max(axis=0))
+        for i, (_, _, full) in enumerate(METRICS):
+            column = values[present[:, i], i]
+            bins = np.clip(np.floor(column), 0, full).astype(np.int64)
+            self.histograms[i] += np.bincount(bins, minlength=full + 1)
+
+        # 分項以滿分比例比較，才能看出哪一項最弱
+        fulls = np.array([full for _, _, full in SUB_SCORE_COLUMNS], dtype=float)
+        ratios = values[:, 1:] / fulls
+        self.below += (present[:, 1:] & (ratios < WEAK_RATIO)).sum(axis=0)
+        scored = present[:, 1:].all(axis=1)
+        self.weakest += np.bincount(ratios[scored].argmin(axis=1), minlength=len(SUB_SCORE_COLUMNS))
+
+        week_keys, inverse = np.unique(weeks, return_inverse=True)
+        week_counts = np.stack([np.bincount(inverse, weights=present[:, i], minlength=len(week_keys))
+                                for i in range(len(METRICS))], axis=1)
+        week_sums = np.stack([np.bincount(inverse, weights=filled[:, i], minlength=len(week_keys))
+                              for i in range(len(METRICS))], axis=1)
+        for key, count, total in zip(week_keys.tolist(), week_counts, week_sums):
+            if key in self.weeks:
+                self.weeks[key][0] += count
+                self.weeks[key][1] += total
+            else:
+                self.weeks[key] = [count, total]
+
+    def _percentiles(self, histogram):
+        total = histogram.sum()
+        if not total:
+            return {f"p{q}": None for q in PERCENTILES}
+        cumulative = np.cumsum(histogram)
+        ranks = np.ceil(np.array(PERCENTILES) / 100 * total)
+        return {f"p{q}": int(index) for q, index in zip(PERCENTILES, np.searchsorted(cumulative, ranks))}
+
+    def result(self):
+        """整理成可直接轉成JSON的統計結果"""
+        metrics = {}
+        for i, (name, _, full) in enumerate(METRICS):
+            count = int(self.counts[i])
+            mean = self.sums[i] / count if count else None
+            std = float(np.sqrt(max(self.squares[i] / count - mean * mean, 0.0))) if count else None
+            metrics[name] = {
+                "count": count,
+                "mean": round(float(mean), 2) if count else None,
+                "std": round(std, 2) if count else None,
+                "min": float(self.minimum[i]) if count else None,
+                "max": float(self.maximum[i]) if count else None,
+                **self._percentiles(self.histograms[i]),
+            }
+        # 總分分布：每 10 分一組（最後一組含 100 分）
+        histogram = self.histograms[0]
+        buckets = [int(histogram[start:start + 10].sum()) for start in range(0, 90, 10)] + [int(histogram[90:].sum())]
+        scored = int(self.weakest.sum())
+        weak_areas = {}
+        for i, (name, _, _) in enumerate(SUB_SCORE_COLUMNS):
+            count = int(self.counts[i + 1])
+            weak_areas[name] = {
+                "below_ratio": round(float(self.below[i]) / count, 4) if count else None,
+                "weakest_ratio": round(float(self.weakest[i]) / scored, 4) if scored else None,
+            }
+        trend = []
+        for key in sorted(self.weeks):
+            if key == UNKNOWN_WEEK:
+                continue
+            counts, sums = self.weeks[key]
+            trend.append({
+                "week": f"{key // 100}-W{key % 100:02d}",
+                "records": int(counts[0]),
+                "mean": {name: (round(float(sums[i] / counts[i]), 2) if counts[i] else None)
+                         for i, (name, _, _) in enumerate(METRICS)},
+            })
+        return {
+            "records": self.records,
+            "students": len(self.students),
+            "metrics": metrics,
+            "distribution": {f"{start}-{start + 9 if start < 90 else 100}": count
+                             for start, count in zip(range(0, 100, 10), buckets)},
+            "weak_areas": weak_areas,
+            "trend": trend,
+        }
+
+
+def _filter_clause(practice_mode, school_id, class_id, topic, since, until):
+    conditions, params = [], []
+    for column, value in (("practice_mode", practice_mode), ("school_id", school_id),
+                          ("class_id", class_id), ("topic", topic)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        conditions.append("practice_time >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("practice_time < ?")
+        params.append(until)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+def accumulate(conn, accumulator, practice_mode="作文模式", school_id=None, class_id=None, topic=None,
+               since=None, until=None, chunk_size=CHUNK_SIZE):
+    """以 fetchmany 逐批讀取符合條件的記錄並加入累加器，回傳讀取筆數"""
+    where, params = _filter_clause(practice_mode, school_id, class_id, topic, since, until)
+    columns = ", ".join(column for _, column, _ in METRICS)
+    cursor = conn.execute(f"SELECT student_id, {_WEEK_SQL}, {columns} FROM practice_records{where}", params)
+    count = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return count
+        student_ids, weeks, *values = zip(*rows)
+        # None（未評分）轉成 NaN
+        accumulator.add_chunk(student_ids, np.array(weeks, dtype=np.int64), np.array(values, dtype=float).T)
+        count += len(rows)
+
+
+def class_report(router, **filters):
+    """跨所有分庫計算班級（或全校、全區）的分數統計"""
+    accumulator = ScoreAccumulator()
+    for _, conn in router.iter_shards():
+        accumulate(conn, accumulator, **filters)
+    return accumulator.result()
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="統計班級作文分數（分布、百分位數、弱項、每週趨勢）")
+    parser.add_argument("--mode", default="作文模式", help="練習模式")
+    parser.add_argument("--school-id", default=None)
+    parser.add_argument("--class-id", default=None)
+    parser.add_argument("--topic", default=None)
+    parser.add_argument("--since", default=None, help="起始時間（如：2024-02-01）")
+    parser.add_argument("--until", default=None, help="結束時間（不含）")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    report = class_report(router, practice_mode=args.mode, school_id=args.school_id, class_id=args.class_id,
+                          topic=args.topic, since=args.since, until=args.until)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    router.close()
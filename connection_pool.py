@@ -0,0 +1,122 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+
+class ReadOnlyPool:
+    """每個執行緒各自一條唯讀連線（URI mode=ro），同一執行緒重複使用
+
+    SQLite連線不能跨執行緒共用游標，各執行緒各用各的連線就不必加鎖；唯讀連線也保證
+    分析流程不會意外寫入。執行緒結束後，它的連線在下次有新執行緒開連線時關閉；
+    fork 後的子進程第一次取用時重新開啟（連線不能跨進程）。
+    """
+
+    def __init__(self, path):
+        self.uri = "file:" + os.path.abspath(path) + "?mode=ro"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 執行緒 → 連線（關閉時一併關閉；只在建立與關閉時加鎖）
+        self._connections = {}
+        # 關閉後遞增，各執行緒手上的舊連線隨之作廢
+        self._generation = 0
+        self.opened = 0
+
+    def connection(self):
+        """取得目前執行緒的唯讀連線"""
+        local = self._local
+        conn = getattr(local, "conn", None)
+        owner = (os.getpid(), self._generation)
+        if conn is None or local.owner != owner:
+            # 關閉時可能由其他執行緒呼叫 close，因此不檢查建立連線的執行緒
+            conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            local.conn, local.owner = conn, owner
+            with self._lock:
+                self._prune()
+                self._connections[threading.current_thread()] = conn
+                self.opened += 1
+        return conn
+
+    def _prune(self):
+        for thread in [thread for thread in self._connections if not thread.is_alive()]:
+            self._connections.pop(thread).close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._connections)
+
+    def close(self):
+        """關閉所有連線（各執行緒之後再取用時重新開啟）"""
+        with self._lock:
+            connections, self._connections = self._connections, {}
+            self._generation += 1
+        for conn in connections.values():
+            conn.close()
+
+
+class WriterThread:
+    """唯一的寫入執行緒：寫入工作依送出順序在這個執行緒中執行，連線只在這裡開啟與使用
+
+    任何執行緒都可以送出寫入；同一時間只有一個寫入交易，不會互相等待資料庫鎖。
+    waited 累計工作在佇列中等待的秒數（衡量寫入的鎖競爭）。
+    """
+
+    def __init__(self, name="writer"):
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.jobs = 0
+        self.waited = 0.0
+
+    def _ensure_started(self):
+        # fork 後子進程沒有父進程的執行緒，需要重新啟動
+        if self._thread is None or self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, submitted, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.waited += time.perf_counter() - submitted
+            self.jobs += 1
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, func, *args, **kwargs):
+        """送出寫入工作，回傳 Future"""
+        future = Future()
+        with self._lock:
+            self._ensure_started()
+            self._queue.put((future, time.perf_counter(), func, args, kwargs))
+        return future
+
+    def call(self, func, *args, **kwargs):
+        """在寫入執行緒中執行並等待結果（在寫入執行緒內呼叫時直接執行，避免自己等自己）"""
+        if threading.current_thread() is self._thread:
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def close(self, finalizer=None):
+        """等佇列中的寫入完成後結束執行緒；finalizer 在結束前於寫入執行緒中執行（如關閉連線）"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None or self._pid != os.getpid():
+                return
+            if finalizer is not None:
+                future = Future()
+                self._queue.put((future, time.perf_counter(), finalizer, (), {}))
+            self._queue.put(None)
+        thread.join()
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+# 備份存放目錄與排程間隔（秒，0 表示不自動備份）
+BACKUP_DIR_ENV = "WRITING_BACKUP_DIR"
+BACKUP_INTERVAL_ENV = "WRITING_BACKUP_INTERVAL"
+BACKUP_DIR = "backups"
+BACKUP_INTERVAL = 24 * 60 * 60
+# 保留最近幾次備份
+KEEP_BACKUPS = 14
+
+# 每一步複製的頁數與步驟之間的暫停：每步只短暫持有讀取鎖，寫入者不會被擋住太久
+PAGES_PER_STEP = 64
+STEP_SLEEP = 0.005
+# 複製期間資料庫被其他連線修改時，備份會從頭開始；重來太多次就改為一次複製完
+MAX_RESTARTS = 5
+
+MANIFEST = "manifest.json"
+BEFORE_RESTORE_SUFFIX = ".before-restore"
+
+
+class BackupError(Exception):
+    """備份或還原失敗（如備份檔未通過完整性檢查）"""
+
+
+class _TooBusy(Exception):
+    pass
+
+
+def check_integrity(path):
+    """以 PRAGMA integrity_check 檢查資料庫檔案，未通過時拋出 BackupError"""
+    try:
+        conn = sqlite3.connect("file:" + os.path.abspath(path) + "?mode=ro", uri=True)
+        try:
+            result = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"{path} 無法讀取：{e}")
+    if result != ["ok"]:
+        raise BackupError(f"{path} 未通過完整性檢查：{'; '.join(result[:5])}")
+
+
+def _copy(source, dest, pages, step_sleep, max_restarts):
+    remaining_before = [None]
+    restarts = [0]
+
+    def progress(status, remaining, total):
+        # 剩餘頁數變多代表來源被修改、備份重新開始
+        if remaining_before[0] is not None and remaining > remaining_before[0]:
+            restarts[0] += 1
+            if restarts[0] > max_restarts:
+                raise _TooBusy()
+        remaining_before[0] = remaining
+        # 每步（含來源忙碌的重試）之後都會呼叫這裡，只在這裡暫停；backup 本身不再另外等待
+        if step_sleep:
+            time.sleep(step_sleep)
+
+    try:
+        source.backup(dest, pages=pages, progress=progress, sleep=0)
+    except _TooBusy:
+        source.backup(dest, pages=-1)
+
+
+def copy_database(source_path, dest_path, pages=PAGES_PER_STEP, step_sleep=STEP_SLEEP, max_restarts=MAX_RESTARTS):
+    """以 SQLite 線上備份 API 複製資料庫，並通過完整性檢查後才放到 dest_path
+
+    來源可同時被 APP 或伺服器寫入：每步只複製少量頁面，期間的寫入由 SQLite 處理
+    （其他連線的寫入會讓備份重新開始，重來太多次時改為一步完成）。
+    回傳備份檔位元組數。
+    """
+    tmp_path = dest_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    source = sqlite3.connect(source_path, timeout=30)
+    dest = sqlite3.connect(tmp_path)
+    try:
+        _copy(source, dest, pages, step_sleep, max_restarts)
+        # 備份檔不需要 WAL，改回單一檔案方便搬移
+        dest.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dest.close()
+        source.close()
+    try:
+        check_integrity(tmp_path)
+    except BackupError:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
+
+
+def _database_paths(router):
+    """共用庫加上所有練習記錄分庫（未分庫時兩者是同一個檔案）"""
+    paths = [router.shared_path]
+    for path in router.shard_paths():
+        if os.path.abspath(path) != os.path.abspath(router.shared_path):
+            paths.append(path)
+    return paths
+
+
+def list_backups(directory=BACKUP_DIR):
+    """列出已完成的備份（由舊到新），每項為（名稱, 清單內容）"""
+    if not os.path.isdir(directory):
+        return []
+    backups = []
+    for name in sorted(os.listdir(directory)):
+        manifest_path = os.path.join(directory, name, MANIFEST)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                backups.append((name, json.load(f)))
+    return backups
+
+
+def prune_backups(directory=BACKUP_DIR, keep=KEEP_BACKUPS):
+    """只保留最新的 keep 份備份，回傳刪除的備份名稱"""
+    removed = [name for name, _ in list_backups(directory)[:-keep]] if keep > 0 else []
+    for name in removed:
+        shutil.rmtree(os.path.join(directory, name))
+    return removed
+
+
+def backup_router(router, directory=BACKUP_DIR, keep=KEEP_BACKUPS, **copy_options):
+    """備份共用庫與所有分庫到新的時間戳記目錄，並依保留份數輪替舊備份
+
+    全部檔案複製並驗證完成後才寫入清單（manifest.json），
+    中途失敗的目錄不會被當成有效備份，也不會在輪替時擠掉舊備份。
+    回傳備份名稱。
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = base = time.strftime("%Y%m%d-%H%M%S")
+    suffix = 1
+    while os.path.exists(os.path.join(directory, name)):
+        name = f"{base}-{suffix}"
+        suffix += 1
+    target = os.path.join(directory, name)
+    os.makedirs(target)
+    files = []
+    try:
+        for path in _database_paths(router):
+            filename = os.path.basename(path)
+            size = copy_database(path, os.path.join(target, filename), **copy_options)
+            files.append({"file": filename, "source": path, "bytes": size})
+    except sqlite3.Error as e:
+        shutil.rmtree(target, ignore_errors=True)
+        raise BackupError(f"{path} 備份失敗：{e}")
+    except Exception:
+        shutil.rmtree(target, ignore_errors=True)
+        raise
+    manifest = {"created": time.time(), "created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "files": files}
+    with open(os.path.join(target, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    prune_backups(directory, keep)
+    return name
+
+
+def verify_backup(name, directory=BACKUP_DIR):
+    """重新檢查一份備份的所有檔案（例如搬到其他儲存裝置之後）"""
+    manifest = dict(list_backups(directory)).get(name)
+    if manifest is None:
+        raise BackupError(f"找不到備份：{name}")
+    for entry in manifest["files"]:
+        check_integrity(os.path.join(directory, name, entry["file"]))
+    return manifest
+
+
+def restore_backup(name=None, directory=BACKUP_DIR, keep_current=True):
+    """把備份寫回原本的資料庫位置（未指定名稱時使用最新的備份）
+
+    先驗證備份；keep_current=True 時先把目前的資料庫另存為 *.before-restore。
+    寫回同樣透過備份 API，執行中的 APP 下次讀取即看到還原後的內容。
+    回傳還原的檔案清單。
+    """
+    backups = list_backups(directory)
+    if not backups:
+        raise BackupError(f"{directory} 中沒有備份")
+    name = name or backups[-1][0]
+    manifest = verify_backup(name, directory)
+    restored = []
+    for entry in manifest["files"]:
+        target = entry["source"]
+        if keep_current and os.path.exists(target):
+            copy_database(target, target + BEFORE_RESTORE_SUFFIX, pages=-1)
+        source = sqlite3.connect("file:" + os.path.abspath(os.path.join(directory, name, entry["file"])) + "?mode=ro",
+                                 uri=True)
+        dest = sqlite3.connect(target, timeout=30)
+        try:
+            source.backup(dest)
+        finally:
+            dest.close()
+            source.close()
+        restored.append(target)
+    return restored
+
+
+class BackupScheduler:
+    """定期備份：最新一份備份超過間隔時間才執行（APP 與伺服器重啟不會重複備份）"""
+
+    def __init__(self, router, directory=BACKUP_DIR, interval=BACKUP_INTERVAL, keep=KEEP_BACKUPS):
+        self.router = router
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+
+    @classmethod
+    def from_env(cls, router):
+        """依環境變數建立排程；間隔設為 0 時回傳None（不自動備份）"""
+        interval = float(os.environ.get(BACKUP_INTERVAL_ENV, BACKUP_INTERVAL))
+        if interval <= 0:
+            return None
+        return cls(router, os.environ.get(BACKUP_DIR_ENV, BACKUP_DIR), interval)
+
+    def last_backup_time(self):
+        backups = list_backups(self.directory)
+        return backups[-1][1]["created"] if backups else None
+
+    def due(self, now=None):
+        last = self.last_backup_time()
+        return last is None or (now or time.time()) - last >= self.interval
+
+    def run_if_due(self):
+        """到期時備份，回傳備份名稱；未到期回傳None"""
+        if not self.due():
+            return None
+        return backup_router(self.router, self.directory, self.keep)
+
+    def run_forever(self, poll=60):
+        while True:
+            try:
+                name = self.run_if_due()
+                if name:
+                    print(f"✅ 已備份：{name}")
+            except (BackupError, OSError) as e:
+                print(f"❌ 備份失敗（稍後重試）：{e}")
+            time.sleep(min(poll, self.interval))
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="線上備份、驗證與還原練習資料庫")
+    parser.add_argument("--dir", default=os.environ.get(BACKUP_DIR_ENV, BACKUP_DIR), help="備份目錄")
+    parser.add_argument("--keep", type=int, default=KEEP_BACKUPS, help="保留的備份份數")
+    parser.add_argument("--every", type=float, default=None, help="常駐執行，每隔幾秒檢查是否需要備份")
+    parser.add_argument("--list", action="store_true", help="列出備份")
+    parser.add_argument("--verify", nargs="?", const="", default=None, help="驗證備份（預設最新一份）")
+    parser.add_argument("--restore", nargs="?", const="", default=None, help="還原備份（預設最新一份）")
+    args = parser.parse_args()
+
+    try:
+        if args.list:
+            for name, manifest in list_backups(args.dir):
+                size = sum(entry["bytes"] for entry in manifest["files"])
+                print(f"{name}  {manifest['created_at']}  {len(manifest['files'])} 個檔案  {size} 位元組")
+        elif args.verify is not None:
+            backups = list_backups(args.dir)
+            name = args.verify or (backups[-1][0] if backups else "")
+            verify_backup(name, args.dir)
+            print(f"✅ 備份 {name} 通過完整性檢查")
+        elif args.restore is not None:
+            for path in restore_backup(args.restore or None, args.dir):
+                print(f"✅ 已還原：{path}（原檔案另存為 {path}{BEFORE_RESTORE_SUFFIX}）")
+        else:
+            router = StorageRouter.from_env()
+            if args.every:
+                BackupScheduler(router, args.dir, args.every, args.keep).run_forever()
+            else:
+                print(f"✅ 已備份：{backup_router(router, args.dir, args.keep)}")
+            router.close()
+    except BackupError as e:
+        print(f"❌ {e}")
@@ -0,0 +1,168 @@
+import argparse
+import heapq
+import re
+from text_storage import TextCodec
+
+# 中日韓文字連續段落、英數字詞
+_TOKEN_RE = re.compile(r"[㐀-鿿豈-﫿]+|[0-9A-Za-z]+")
+
+SNIPPET_RADIUS = 20
+
+
+def cjk_bigrams(text):
+    """把文字轉成FTS索引用的詞元：中文取相鄰兩字（每段末字另外保留），英數字整詞小寫
+
+    例如「我的小狗」→「我的 的小 小狗 狗」，查詢「小狗」只需比對一個詞元，
+    單字查詢則以前綴比對（狗*）找到段末的單字詞元。
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text):
+        if run.isascii():
+            tokens.append(run.lower())
+            continue
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        tokens.append(run[-1])
+    return " ".join(tokens)
+
+
+def install_search_index(cursor):
+    """建立全文索引表與刪除同步觸發器；新建時為既有記錄建立索引"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name='practice_records_fts'")
+    existed = cursor.fetchone() is not None
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS practice_records_fts USING fts5(tokens, tokenize='unicode61')")
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS practice_records_fts_delete AFTER DELETE ON practice_records
+    BEGIN DELETE FROM practice_records_fts WHERE rowid = OLD.record_id; END
+    ''')
+    if not existed:
+        rebuild_index(cursor)
+
+
+def index_record(cursor, record_id, text):
+    """寫入練習記錄時同步建立索引（與記錄寫入在同一交易）"""
+    cursor.execute("INSERT OR REPLACE INTO practice_records_fts (rowid, tokens) VALUES (?, ?)", (record_id, cjk_bigrams(text)))
+
+
+def sync_index(cursor, batch_size=1000):
+    """補建尚未索引的記錄（如從其他管道匯入的資料），回傳補建筆數"""
+    cursor.execute("SELECT COALESCE(MAX(rowid), 0) FROM practice_records_fts")
+    (last_id,) = cursor.fetchone()
+    count = 0
+    codec = TextCodec(cursor.connection)
+    while True:
+        rows = cursor.execute(
+            "SELECT record_id, input_text FROM practice_records WHERE record_id > ? ORDER BY record_id LIMIT ?",
+            (last_id, batch_size)).fetchall()
+        if not rows:
+            return count
+        cursor.executemany("INSERT OR REPLACE INTO practice_records_fts (rowid, tokens) VALUES (?, ?)",
+                           [(record_id, cjk_bigrams(codec.decode(text))) for record_id, text in rows])
+        last_id = rows[-1][0]
+        count += len(rows)
+
+
+def rebuild_index(cursor):
+    """清空並重建全文索引"""
+    cursor.execute("DELETE FROM practice_records_fts")
+    return sync_index(cursor)
+
+
+def _match_expression(query):
+    """把查詢字串轉成FTS5條件：每個詞轉成詞元片語，多個詞以AND結合"""
+    clauses = []
+    for term in query.split():
+        tokens = cjk_bigrams(term).split()
+        if not tokens:
+            continue
+        if len(tokens) == 1:
+            clauses.append(f'"{tokens[0]}"*')
+        else:
+            # 去掉段末單字詞元，只比對連續的兩字詞元
+            clauses.append('"' + " ".join(tokens[:-1]) + '"')
+    return " AND ".join(clauses)
+
+
+def make_snippet(text, query, radius=SNIPPET_RADIUS):
+    """擷取第一個命中位置前後的文字，並以【】標示命中的詞"""
+    terms = [term for term in query.split() if term]
+    hits = [(text.find(term), term) for term in terms if term in text]
+    if not hits:
+        return text[:radius * 2]
+    position, term = min(hits)
+    start = max(0, position - radius)
+    end = min(len(text), position + len(term) + radius)
+    snippet = text[start:end]
+    for term in terms:
+        snippet = snippet.replace(term, f"【{term}】")
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+
+def search_essays(conn, query, limit=20, student_id=None, topic=None):
+    """以全文索引搜尋練習記錄，依BM25相關度排序並附上摘要"""
+    expression = _match_expression(query)
+    if not expression:
+        return []
+    sql = '''
+    SELECT r.record_id, r.student_id, r.practice_mode, r.topic, r.practice_time, r.input_text,
+           bm25(practice_records_fts) AS rank
+    FROM practice_records_fts JOIN practice_records r ON r.record_id = practice_records_fts.rowid
+    WHERE practice_records_fts MATCH ?
+    '''
+    params = [expression]
+    if student_id is not None:
+        sql += " AND r.student_id = ?"
+        params.append(student_id)
+    if topic is not None:
+        sql += " AND r.topic = ?"
+        params.append(topic)
+    sql += " ORDER BY rank LIMIT ?"
+    params.append(limit)
+    results = []
+    codec = TextCodec(conn)
+    for record_id, student, mode, record_topic, practice_time, text, rank in conn.execute(sql, params):
+        results.append({
+            "record_id": record_id,
+            "student_id": student,
+            "practice_mode": mode,
+            "topic": record_topic,
+            "practice_time": practice_time,
+            "rank": rank,
+            "snippet": make_snippet(codec.decode(text), query),
+        })
+    return results
+
+
+def search_all_shards(router, query, limit=20, **filters):
+    """在所有分庫搜尋並依相關度合併結果"""
+    per_shard = []
+    for key, conn in router.iter_shards():
+        results = search_essays(conn, query, limit, **filters)
+        for result in results:
+            result["shard"] = key
+        per_shard.append(results)
+    return list(heapq.merge(*per_shard, key=lambda result: result["rank"]))[:limit]
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="搜尋練習記錄中的作文")
+    parser.add_argument("query", nargs="?", help="搜尋詞（多個詞以空白分隔）")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--student", default=None, help="只搜尋指定學生")
+    parser.add_argument("--topic", default=None, help="只搜尋指定題目")
+    parser.add_argument("--rebuild", action="store_true", help="重建全文索引")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    if args.rebuild:
+        for path in router.shard_paths():
+            conn = router.connection_for_path(path)
+            count = rebuild_index(conn.cursor())
+            conn.commit()
+            print(f"✅ 已重建全文索引：{path}（{count} 筆）")
+    if args.query:
+        for result in search_all_shards(router, args.query, args.limit, student_id=args.student, topic=args.topic):
+            print(f"#{result['record_id']} {result['student_id']}「{result['topic']}」{result['practice_time']}")
+            print(f"   {result['snippet']}")
+    router.close()
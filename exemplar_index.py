@@ -0,0 +1,221 @@
+import argparse
+import time
+
+import jieba
+
+from sentence_segmenter import iter_sentences
+from text_storage import TextCodec
+from topic_relevance import content_words
+
+# 只從高分作文挑選範例句
+MIN_SCORE = 85
+# 範例句長度（字數，不含句末標點）
+MIN_LENGTH = 8
+MAX_LENGTH = 30
+# 每句至少要有幾個索引詞，太空泛的句子不收
+MIN_TERMS = 2
+BATCH_SIZE = 500
+
+
+def install_exemplar_index(cursor):
+    """建立範例句表、倒排索引表與各分庫的處理進度（放在共用庫，所有分庫共用一份）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS exemplar_sentences (
+        sentence_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sentence TEXT NOT NULL UNIQUE,
+        topic TEXT NOT NULL,
+        score FLOAT NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS exemplar_postings (
+        term TEXT NOT NULL,
+        sentence_id INTEGER NOT NULL,
+        PRIMARY KEY (term, sentence_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS exemplar_progress (
+        source TEXT PRIMARY KEY,
+        last_record_id INTEGER NOT NULL
+    )
+    ''')
+    # 索引更新後遞增版本號，執行中的建議生成器據此重新載入
+    cursor.execute("INSERT OR IGNORE INTO config_version (name, version) VALUES ('exemplars', 0)")
+
+
+def load_vocabulary(conn):
+    """資源詞彙（比喻詞、形容詞、感受詞等），以子字串比對，不受分詞結果影響"""
+    words = set()
+    for (content,) in conn.execute("SELECT content FROM student_resources"):
+        words.update(word for word in content.split("、") if word)
+    return tuple(sorted(words, key=len, reverse=True))
+
+
+def sentence_terms(sentence, vocabulary, words=None):
+    """句子的索引詞：出現的資源詞彙 + 分詞後的實詞"""
+    terms = {word for word in vocabulary if word in sentence}
+    terms.update(content_words(words if words is not None else jieba.lcut(sentence)))
+    return terms
+
+
+def mine_sentences(text, vocabulary, typo_checker=None):
+    """從作文中挑出適合當範例的句子：完整結尾、長度適中、用到資源詞彙、沒有常見錯別字
+
+    逐句產生（句子, 索引詞集合）。
+    """
+    for span in iter_sentences(text):
+        if not span.terminated or not MIN_LENGTH <= len(span.body) <= MAX_LENGTH:
+            continue
+        if not any(word in span.body for word in vocabulary):
+            continue
+        if typo_checker is not None and typo_checker.check(span.body):
+            continue
+        terms = sentence_terms(span.body, vocabulary)
+        if len(terms) >= MIN_TERMS:
+            yield span.text, terms
+
+
+class ExemplarIndex:
+    """記憶體中的倒排索引：索引詞 → 範例句編號集合
+
+    查詢時由最少句子的詞開始逐一取交集（會變成空集合的詞略過），
+    只需走訪最短的幾個倒排清單，與範例句總數無關。
+    """
+
+    def __init__(self, version, sentences, postings):
+        self.version = version
+        self.sentences = sentences
+        self.postings = postings
+
+    @classmethod
+    def load(cls, conn, version=0):
+        sentences = {sentence_id: (sentence, topic, score) for sentence_id, sentence, topic, score in
+                     conn.execute("SELECT sentence_id, sentence, topic, score FROM exemplar_sentences")}
+        postings = {}
+        for term, sentence_id in conn.execute("SELECT term, sentence_id FROM exemplar_postings"):
+            postings.setdefault(term, set()).add(sentence_id)
+        return cls(version, sentences, {term: frozenset(ids) for term, ids in postings.items()})
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def find(self, terms, topic=None, limit=2, exclude=()):
+        """找出與索引詞最相關的範例句（同題目、高分優先）"""
+        lists = sorted((self.postings[term] for term in set(terms) if term in self.postings), key=len)
+        if not lists:
+            return []
+        candidates = lists[0]
+        for posting in lists[1:]:
+            narrowed = {sentence_id for sentence_id in candidates if sentence_id in posting}
+            if narrowed:
+                candidates = narrowed
+        ranked = sorted(candidates, key=lambda sentence_id: (self.sentences[sentence_id][1] != topic,
+                                                             -self.sentences[sentence_id][2], sentence_id))
+        results = []
+        for sentence_id in ranked:
+            sentence = self.sentences[sentence_id][0]
+            if sentence not in exclude:
+                results.append(sentence)
+                if len(results) >= limit:
+                    break
+        return results
+
+
+def update_exemplars(router, min_score=MIN_SCORE, typo_checker=None, batch_size=BATCH_SIZE):
+    """從各分庫上次處理之後的新記錄挑選範例句並加入索引（每個分庫各自提交進度）
+
+    回傳新增的範例句數。
+    """
+    shared = router.connect_shared(read_only=False)
+    try:
+        cursor = shared.cursor()
+        install_exemplar_index(cursor)
+        vocabulary = load_vocabulary(shared)
+        added = 0
+        for key, conn in router.iter_shards():
+            source = key or ""
+            row = cursor.execute("SELECT last_record_id FROM exemplar_progress WHERE source = ?", (source,)).fetchone()
+            last_id = row[0] if row else 0
+            codec = TextCodec(conn)
+            shard_added = 0
+            while True:
+                rows = conn.execute(
+                    "SELECT record_id, topic, score, input_text FROM practice_records "
+                    "WHERE record_id > ? ORDER BY record_id LIMIT ?", (last_id, batch_size)).fetchall()
+                if not rows:
+                    break
+                for record_id, topic, score, value in rows:
+                    if score is None or score < min_score:
+                        continue
+                    for sentence, terms in mine_sentences(codec.decode(value), vocabulary, typo_checker):
+                        cursor.execute("INSERT OR IGNORE INTO exemplar_sentences (sentence, topic, score) "
+                                       "VALUES (?, ?, ?)", (sentence, topic, score))
+                        if not cursor.rowcount:
+                            continue
+                        sentence_id = cursor.lastrowid
+                        cursor.executemany("INSERT OR IGNORE INTO exemplar_postings (term, sentence_id) VALUES (?, ?)",
+                                           [(term, sentence_id) for term in terms])
+                        shard_added += 1
+                last_id = rows[-1][0]
+                cursor.execute("INSERT OR REPLACE INTO exemplar_progress (source, last_record_id) VALUES (?, ?)",
+                               (source, last_id))
+            if shard_added:
+                cursor.execute("UPDATE config_version SET version = version + 1 WHERE name = 'exemplars'")
+            shared.commit()
+            added += shard_added
+        return added
+    finally:
+        shared.close()
+
+
+def rebuild_exemplars(router, min_score=MIN_SCORE, typo_checker=None):
+    """清空索引後從頭挑選（調整挑選條件或刪除記錄之後使用）"""
+    shared = router.connect_shared(read_only=False)
+    try:
+        install_exemplar_index(shared.cursor())
+        shared.execute("DELETE FROM exemplar_postings")
+        shared.execute("DELETE FROM exemplar_sentences")
+        shared.execute("DELETE FROM exemplar_progress")
+        shared.execute("UPDATE config_version SET version = version + 1 WHERE name = 'exemplars'")
+        shared.commit()
+    finally:
+        shared.close()
+    return update_exemplars(router, min_score, typo_checker)
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+    from typo_checker import load_typo_checker
+
+    parser = argparse.ArgumentParser(description="從高分作文挑選範例句並建立倒排索引（預設只處理新記錄）")
+    parser.add_argument("--min-score", type=float, default=MIN_SCORE, help="作文納入的最低分數")
+    parser.add_argument("--rebuild", action="store_true", help="清空後從頭建立")
+    parser.add_argument("--every", type=float, default=None, help="常駐執行，每隔幾秒處理新記錄")
+    parser.add_argument("--query", default=None, help="以一個句子測試查詢")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    if args.query:
+        conn = router.connect_shared()
+        index = ExemplarIndex.load(conn)
+        started = time.perf_counter()
+        results = index.find(sentence_terms(args.query, load_vocabulary(conn)))
+        elapsed = (time.perf_counter() - started) * 1000
+        conn.close()
+        for sentence in results:
+            print(f"📌 {sentence}")
+        print(f"✅ {len(index)} 個範例句，查詢 {elapsed:.2f} 毫秒")
+    else:
+        checker = load_typo_checker()
+        while True:
+            if args.rebuild:
+                added = rebuild_exemplars(router, args.min_score, checker)
+                args.rebuild = False
+            else:
+                added = update_exemplars(router, args.min_score, checker)
+            print(f"✅ 新增 {added} 個範例句")
+            if not args.every:
+                break
+            time.sleep(args.every)
+    router.close()
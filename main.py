@@ -1,17 +1,24 @@
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QTextEdit, QPushButton, QLabel, QComboBox, QListWidget, QListWidgetItem,
                              QTabWidget, QLineEdit)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QTextCursor, QTextDocument
 import sys
 import os
 from gtts import gTTS
 import speech_recognition as sr
 from playsound import playsound
 from writing_advisor import WritingAdvisor
+from storage_router import StorageRouter
+from autosave_journal import AutosaveJournal, pending_sessions
+from session_recorder import SessionRecorder
+from record_sync import SyncClient, SyncError
+from db_backup import BackupError, BackupScheduler
+from sentence_segmenter import CLOSERS, TERMINALS, sentence_body
 import db_init  # 導入資料庫初始化模組
 
-# 初始化資料庫（首次運行自動建立）
-db_init.init_database()
+# 初始化資料庫（首次運行自動建立；有分庫設定時初始化共用庫）
+db_init.init_database(StorageRouter.from_env().shared_path)
 
 # 語音播放執行緒（避免阻塞介面）
 class TTSThread(QThread):
@@ -62,6 +69,35 @@ class SpeechRecognitionThread(QThread):
             except Exception as e:
                 self.result.emit(f"❌ 語音識別錯誤：{e}")
 
+# 練習記錄同步執行緒（背景上傳到中央伺服器，不阻塞介面）
+class SyncThread(QThread):
+    def __init__(self, client, router):
+        super().__init__()
+        self.client = client
+        self.router = router
+
+    def run(self):
+        try:
+            count = self.client.sync_router(self.router)
+            if count:
+                print(f"☁️ 已同步 {count} 筆練習記錄")
+        except SyncError as e:
+            print(f"❌ 練習記錄同步失敗（下次儲存時重試）：{e}")
+
+# 資料庫備份執行緒（線上備份，寫入不必暫停）
+class BackupThread(QThread):
+    def __init__(self, scheduler):
+        super().__init__()
+        self.scheduler = scheduler
+
+    def run(self):
+        try:
+            name = self.scheduler.run_if_due()
+            if name:
+                print(f"💾 已備份資料庫：{name}")
+        except (BackupError, OSError) as e:
+            print(f"❌ 資料庫備份失敗（稍後重試）：{e}")
+
 class WritingApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -69,7 +105,45 @@ class WritingApp(QMainWindow):
         self.setGeometry(100, 100, 1100, 750)
         self.advisor = WritingAdvisor()  # 實例化建議生成器
         self.prev_sentence = ""  # 上一句文本（用於銜接建議）
+        self.comp_session = self.advisor.new_session()  # 作文逐句分析狀態（連續規則、評分重用）
+        self.comp_suggest_span = None  # 建議對應句子在文件中的位置（起點, 終點）
+        self.comp_journal = None  # 作文自動儲存日誌
+        self.comp_recorder = None  # 打字事件記錄器（設定環境變數才開啟）
+        self.sync_client = SyncClient.from_env()  # 中央伺服器同步（設定環境變數才開啟）
+        self.sync_thread = None
+        self.backup_scheduler = BackupScheduler.from_env(self.advisor.router)  # 定期備份（間隔設為0即關閉）
+        self.backup_thread = None
+        # 打字暫停一下就先分析正在輸入的句子，打出句號時建議幾乎立即出現
+        self.speculate_timer = QTimer(self)
+        self.speculate_timer.setSingleShot(True)
+        self.speculate_timer.setInterval(300)
+        self.speculate_timer.timeout.connect(self.speculate_composition_sentence)
         self.init_ui()
+        # 定時把日誌緩衝區同步到磁碟（每次按鍵只寫入記憶體）
+        self.journal_timer = QTimer(self)
+        self.journal_timer.timeout.connect(self.sync_composition_journal)
+        self.journal_timer.start(1000)
+        self.restore_autosaved_composition()
+        self.start_record_sync()
+        # 每10分鐘檢查備份是否到期（啟動時也檢查一次）
+        self.backup_timer = QTimer(self)
+        self.backup_timer.timeout.connect(self.start_backup)
+        self.backup_timer.start(10 * 60 * 1000)
+        self.start_backup()
+
+    def start_record_sync(self):
+        """在背景上傳尚未同步的練習記錄（上一次同步還在進行時略過）"""
+        if self.sync_client is None or (self.sync_thread is not None and self.sync_thread.isRunning()):
+            return
+        self.sync_thread = SyncThread(self.sync_client, self.advisor.router)
+        self.sync_thread.start()
+
+    def start_backup(self):
+        """在背景執行到期的資料庫備份（上一次備份還在進行時略過）"""
+        if self.backup_scheduler is None or (self.backup_thread is not None and self.backup_thread.isRunning()):
+            return
+        self.backup_thread = BackupThread(self.backup_scheduler)
+        self.backup_thread.start()
 
     def init_ui(self):
         # 中心部件
@@ -110,6 +184,9 @@ class WritingApp(QMainWindow):
         self.comp_topic_label = QLabel("選擇作文題目：")
         self.comp_topic_combo = QComboBox()
         self.comp_topic_combo.addItems(["我的寵物", "一次有趣的旅行", "我的好朋友", "難忘的一天", "未來的世界", "我的學校", "中秋佳節"])
+        # 切換題目時同步更新逐句分析的題目（切題檢查與評分都以目前選擇的題目為準）
+        self.comp_topic_combo.currentTextChanged.connect(self.update_composition_topic)
+        self.update_composition_topic(self.comp_topic_combo.currentText())
         self.comp_start_btn = QPushButton("開始寫作")
         self.comp_start_btn.clicked.connect(self.start_composition)
 
@@ -125,6 +202,7 @@ class WritingApp(QMainWindow):
         self.comp_write_edit = QTextEdit()
         self.comp_write_edit.setPlaceholderText("請逐句輸入作文，每句結束按回車或句號...")
         self.comp_write_edit.textChanged.connect(self.check_composition_sentence)
+        self.comp_write_edit.document().contentsChange.connect(self.record_composition_edit)
         write_suggest_layout.addWidget(self.comp_write_edit, stretch=2)
 
         # 右側：建議列表+語音按鈕
@@ -290,27 +368,94 @@ class WritingApp(QMainWindow):
     # ------------------------------ 作文模式功能 ------------------------------
     def start_composition(self):
         """開始作文練習"""
+        if self.comp_journal is not None:
+            self.comp_journal.close(discard=True)
+            self.comp_journal = None
+        if self.comp_recorder is not None:
+            self.comp_recorder.close()
+            self.comp_recorder = None
         self.comp_write_edit.clear()
         self.comp_suggest_list.clear()
         self.comp_score_label.setText("")
         self.prev_sentence = ""
+        self.comp_session.reset()
+        self.comp_suggest_span = None
         self.comp_score_btn.setEnabled(True)
         self.comp_save_btn.setEnabled(True)
         self.comp_play_suggest_btn.setEnabled(False)
+        self.comp_journal = AutosaveJournal(meta={
+            "mode": "作文模式",
+            "topic": self.comp_topic_combo.currentText(),
+            "grade": self.grade_combo.currentText(),
+        })
+        self.comp_recorder = SessionRecorder.from_env(self.comp_journal.session_id, {
+            "topic": self.comp_topic_combo.currentText(),
+            "advisor_grade": self.grade_combo.currentText().replace("年級", "") + "-6年級",
+        })
         self.status_label.setText(f"📝 正在練習作文：{self.comp_topic_combo.currentText()}（{self.grade_combo.currentText()}）")
 
+    def record_composition_edit(self, position, removed, added):
+        """把編輯差異寫入自動儲存日誌與打字記錄（只讀取新增的文字）"""
+        if self.comp_journal is None and self.comp_recorder is None:
+            return
+        document = self.comp_write_edit.document()
+        cursor = QTextCursor(document)
+        cursor.setPosition(position)
+        cursor.setPosition(min(position + added, document.characterCount() - 1), QTextCursor.MoveMode.KeepAnchor)
+        added_text = cursor.selectedText().replace("\u2029", "\n")
+        if self.comp_recorder is not None:
+            # 訊號暫停中的編輯（如採納建議）不會觸發句子檢查，重播時也要略過
+            self.comp_recorder.record_edit(position, removed, added_text, quiet=self.comp_write_edit.signalsBlocked())
+        if self.comp_journal is not None:
+            self.comp_journal.append(position, removed, added_text)
+            if self.comp_journal.needs_compaction:
+                self.comp_journal.compact(self.comp_write_edit.toPlainText())
+
+    def sync_composition_journal(self):
+        """定時同步日誌"""
+        if self.comp_journal is not None:
+            self.comp_journal.sync()
+
+    def restore_autosaved_composition(self):
+        """啟動時恢復上次未儲存的作文"""
+        sessions = [s for s in pending_sessions() if s.meta.get("mode") == "作文模式"]
+        if not sessions:
+            return
+        restored = sessions[0]
+        self.comp_topic_combo.setCurrentText(restored.meta.get("topic", ""))
+        self.grade_combo.setCurrentText(restored.meta.get("grade", ""))
+        self.comp_write_edit.blockSignals(True)
+        self.comp_write_edit.setPlainText(restored.text)
+        self.comp_write_edit.blockSignals(False)
+        self.comp_journal = AutosaveJournal.resume(restored)
+        self.comp_score_btn.setEnabled(True)
+        self.comp_save_btn.setEnabled(True)
+        self.status_label.setText(f"♻️ 已恢復上次未儲存的作文：{restored.meta.get('topic', '')}")
+
     def check_composition_sentence(self):
         """檢查作文句子是否結束"""
-        text = self.comp_write_edit.toPlainText()
-        if text.endswith("\n") or text.endswith("。"):
-            current_sentence = text.strip().split("\n")[-1].split("。")[-2] if "。" in text else text.strip().split("\n")[-1]
-            if current_sentence and current_sentence != self.prev_sentence and len(current_sentence) >= 2:
-                # 生成建議
-                grade = self.grade_combo.currentText().replace("年級", "") + "-6年級"
-                suggestions = self.advisor.generate_suggestions(current_sentence, self.prev_sentence, grade)
-                self.show_composition_suggestions(suggestions)
-                self.prev_sentence = current_sentence
-                self.comp_play_suggest_btn.setEnabled(True)
+        grade = self.grade_combo.currentText().replace("年級", "") + "-6年級"
+        result = self.advisor.check_finished_sentence(self.comp_write_edit.toPlainText(), self.prev_sentence, grade,
+                                                      self.comp_session)
+        if result is None:
+            # 句子還沒結束：每次輸入都重新計時，閒置時才預先分析
+            self.speculate_timer.start()
+        else:
+            # 生成建議（預先分析過的句子只需填入模板）
+            self.speculate_timer.stop()
+            start, end, current_sentence, suggestions = result
+            self.show_composition_suggestions(suggestions)
+            self.prev_sentence = current_sentence
+            self.comp_suggest_span = (start, end)
+            self.comp_play_suggest_btn.setEnabled(True)
+
+    def update_composition_topic(self, topic):
+        """作文題目變更：之後的切題檢查、評分與儲存都使用新題目"""
+        self.comp_session.topic = topic or None
+
+    def speculate_composition_sentence(self):
+        """打字暫停時預先分析正在輸入的句子"""
+        self.advisor.speculate(self.comp_write_edit.toPlainText(), self.comp_session)
 
     def show_composition_suggestions(self, suggestions):
         """顯示作文建議"""
@@ -318,15 +463,48 @@ class WritingApp(QMainWindow):
         for idx, sug in enumerate(suggestions, 1):
             QListWidgetItem(f"{idx}. {sug}", self.comp_suggest_list)
 
+    def _select_suggest_span(self):
+        """選取建議對應的句子（只讀取該句範圍，與全文長度無關）"""
+        if self.comp_suggest_span is None:
+            return None
+        document = self.comp_write_edit.document()
+        start, end = self.comp_suggest_span
+        cursor = QTextCursor(document)
+        if end <= document.characterCount() - 1:
+            cursor.setPosition(start)
+            cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+            if sentence_body(cursor.selectedText()) == self.prev_sentence:
+                return cursor
+        # 句子前方已被修改：從文末往回搜尋原句
+        found = document.find(self.prev_sentence, document.characterCount() - 1, QTextDocument.FindFlag.FindBackward)
+        if found.isNull():
+            return None
+        # 連同句末標點一起取代
+        end = found.selectionEnd()
+        while document.characterAt(end) in TERMINALS + CLOSERS:
+            end += 1
+        found.setPosition(found.selectionStart())
+        found.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+        return found
+
     def adopt_composition_suggestion(self, item):
-        """採納作文建議"""
+        """採納作文建議（以游標只改寫目標句子，保留游標位置與復原記錄）"""
         suggested_text = item.text().split(". ")[1]
-        text = self.comp_write_edit.toPlainText()
-        lines = text.strip().split("\n")
-        if lines:
-            lines[-1] = suggested_text + "。"
-            new_text = "\n".join(lines)
-            self.comp_write_edit.setPlainText(new_text)
+        cursor = self._select_suggest_span()
+        if cursor is not None:
+            # 暫停訊號，避免採納後重新觸發建議生成
+            self.comp_write_edit.blockSignals(True)
+            try:
+                cursor.beginEditBlock()
+                cursor.insertText(suggested_text + "。")
+                cursor.endEditBlock()
+            finally:
+                self.comp_write_edit.blockSignals(False)
+            self.prev_sentence = suggested_text
+            self.comp_session.replace_last(suggested_text)
+            if self.comp_recorder is not None:
+                self.comp_recorder.record_adopt(suggested_text)
+        self.comp_suggest_span = None
         self.comp_suggest_list.clear()
         self.comp_play_suggest_btn.setEnabled(False)
 
@@ -349,7 +527,7 @@ class WritingApp(QMainWindow):
         if not full_text.strip():
             self.comp_score_label.setText("⚠️ 作文內容不能為空！")
             return
-        total_score, detail_scores = self.advisor.calculate_score(full_text)
+        total_score, detail_scores = self.advisor.calculate_score(full_text, self.comp_session)
         # 生成評分報告
         report = f"""
         📝 作文題目：{self.comp_topic_combo.currentText()}
@@ -376,16 +554,20 @@ class WritingApp(QMainWindow):
         if self.comp_suggest_list.count() > 0:
             suggested_text = self.comp_suggest_list.item(0).text().split(". ")[1]
         # 計算分數
-        total_score, _ = self.advisor.calculate_score(full_text)
+        total_score, detail_scores = self.advisor.calculate_score(full_text, self.comp_session)
         # 儲存到資料庫
         self.advisor.save_practice_record(
             practice_mode="作文模式",
             topic=self.comp_topic_combo.currentText(),
             input_text=full_text,
             suggested_text=suggested_text,
-            score=total_score
+            score=total_score,
+            detail_scores=detail_scores
         )
+        if self.comp_journal is not None:
+            self.comp_journal.mark_saved()
         self.status_label.setText("💾 作文練習記錄已儲存！")
+        self.start_record_sync()
 
     # ------------------------------ 造句模式功能 ------------------------------
     def start_sentence(self):
@@ -519,6 +701,7 @@ class WritingApp(QMainWindow):
             score=total_score
         )
         self.status_label.setText("💾 造句練習記錄已儲存！")
+        self.start_record_sync()
 
     # ------------------------------ 講話轉寫模式功能 ------------------------------
     def start_speech_recognition(self):
@@ -563,14 +746,9 @@ class WritingApp(QMainWindow):
         if not text:
             self.speech_status_label.setText("⚠️ 轉寫內容不能為空！")
             return
-        # 口語轉書面語規則
-        formal_text = text.replace("啦", "了").replace("喔", "哦").replace("呢", "")
-        formal_text = formal_text.replace("然後呢", "然後").replace("後來呀", "後來").replace("就是說", "也就是")
-        # 生成優化建議
+        # 口語轉書面語後生成優化建議（含書面語版本）
         grade = self.grade_combo.currentText().replace("年級", "") + "-6年級"
-        suggestions = self.advisor.generate_suggestions(formal_text, grade=grade)
-        # 補充口語轉書面語建議
-        suggestions.append(f"書面語優化：{formal_text}（刪除口語助詞，更符合作文要求）")
+        _, suggestions = self.advisor.speech_suggestions(text, grade=grade)
         self.show_speech_suggestions(suggestions[:3])
         self.speech_play_suggest_btn.setEnabled(True)
 
@@ -619,6 +797,7 @@ class WritingApp(QMainWindow):
             score=total_score
         )
         self.speech_status_label.setText("💾 講話轉寫記錄已儲存！")
+        self.start_record_sync()
 
     # ------------------------------ 通用功能 ------------------------------
     def get_improvement_suggestions(self, detail_scores):
@@ -637,7 +816,15 @@ class WritingApp(QMainWindow):
         return "\n".join(suggestions)
 
     def closeEvent(self, event):
-        """關閉視窗時關閉資料庫連接"""
+        """關閉視窗時關閉資料庫連接（未儲存的作文保留日誌供下次恢復）"""
+        if self.comp_journal is not None:
+            self.comp_journal.close(discard=not self.comp_journal.dirty)
+        if self.comp_recorder is not None:
+            self.comp_recorder.close()
+        if self.sync_thread is not None:
+            self.sync_thread.wait()
+        if self.backup_thread is not None:
+            self.backup_thread.wait()
         self.advisor.close()
         event.accept()
 
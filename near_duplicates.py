@@ -0,0 +1,257 @@
+import argparse
+import random
+import re
+import zlib
+from array import array
+
+from text_storage import TextCodec
+
+# MinHash 參數：64 個雜湊函數，分成 16 段、每段 4 個值做局部敏感雜湊（LSH）
+# 兩篇作文相似度約 0.5 時有一半機率落入同一桶，0.8 以上幾乎必定成為候選
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.5
+# 片段少於此數的短文（如造句）不計算簽章：幾個片段就能撞進同一桶，比對沒有意義
+MIN_SHINGLES = 8
+# 每個桶最多比對的記錄數：常見內容的桶可能有成千上萬筆，只取最新的這麼多筆
+MAX_BUCKET_SIZE = 200
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = 0xFFFFFFFF
+# 固定種子：所有資料庫的簽章必須用同一組雜湊函數才能互相比較
+_PERMUTATIONS = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                 for rng in [random.Random(20240601)] for _ in range(NUM_PERM)]
+
+# 比對時忽略標點與空白，只看中文字與英數字
+_CONTENT_RE = re.compile(r"[^㐀-鿿豈-﫿0-9A-Za-z]+")
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """去掉標點空白後，取連續 size 個字為一組的字串集合"""
+    content = _CONTENT_RE.sub("", text).lower()
+    return {content[i:i + size] for i in range(len(content) - size + 1)}
+
+
+def minhash_signature(text):
+    """計算作文的 MinHash 簽章（NUM_PERM 個 32 位元整數）；內容太短（不到 MIN_SHINGLES 個片段）時回傳None"""
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)]
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    return array("I", [min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+                       for a, b in _PERMUTATIONS])
+
+
+def estimate_similarity(signature1, signature2):
+    """以兩個簽章相同位置的比例估計 Jaccard 相似度"""
+    return sum(x == y for x, y in zip(signature1, signature2)) / NUM_PERM
+
+
+def band_buckets(signature):
+    """把簽章切成 BANDS 段，每段雜湊成一個桶號"""
+    return [(band, zlib.crc32(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()))
+            for band in range(BANDS)]
+
+
+def _load_signature(blob):
+    signature = array("I")
+    signature.frombytes(blob)
+    return signature
+
+
+def install_duplicate_index(cursor):
+    """建立簽章表、LSH 分桶表與刪除同步觸發器；新建時為既有記錄計算簽章"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name='essay_minhash'")
+    existed = cursor.fetchone() is not None
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS essay_minhash (
+        record_id INTEGER PRIMARY KEY,
+        signature BLOB NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS essay_lsh_bands (
+        band INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        record_id INTEGER NOT NULL,
+        PRIMARY KEY (band, bucket, record_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_essay_lsh_bands_record ON essay_lsh_bands (record_id)")
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS essay_minhash_delete AFTER DELETE ON practice_records
+    BEGIN
+        DELETE FROM essay_minhash WHERE record_id = OLD.record_id;
+        DELETE FROM essay_lsh_bands WHERE record_id = OLD.record_id;
+    END
+    ''')
+    if not existed:
+        rebuild_duplicate_index(cursor)
+
+
+def index_record(cursor, record_id, text):
+    """寫入練習記錄時計算簽章並放入 LSH 分桶（與記錄寫入在同一交易）"""
+    signature = minhash_signature(text)
+    if signature is None:
+        return
+    cursor.execute("INSERT OR REPLACE INTO essay_minhash (record_id, signature) VALUES (?, ?)",
+                   (record_id, signature.tobytes()))
+    cursor.execute("DELETE FROM essay_lsh_bands WHERE record_id = ?", (record_id,))
+    cursor.executemany("INSERT INTO essay_lsh_bands (band, bucket, record_id) VALUES (?, ?, ?)",
+                       [(band, bucket, record_id) for band, bucket in band_buckets(signature)])
+
+
+def rebuild_duplicate_index(cursor, batch_size=1000):
+    """清空並重新計算所有記錄的簽章，回傳記錄筆數"""
+    cursor.execute("DELETE FROM essay_minhash")
+    cursor.execute("DELETE FROM essay_lsh_bands")
+    last_id = 0
+    count = 0
+    codec = TextCodec(cursor.connection)
+    while True:
+        rows = cursor.execute(
+            "SELECT record_id, input_text FROM practice_records WHERE record_id > ? ORDER BY record_id LIMIT ?",
+            (last_id, batch_size)).fetchall()
+        if not rows:
+            return count
+        for record_id, text in rows:
+            index_record(cursor, record_id, codec.decode(text))
+        last_id = rows[-1][0]
+        count += len(rows)
+
+
+def find_near_duplicates(conn, text, threshold=DEFAULT_THRESHOLD, exclude_record_id=None, limit=20,
+                         max_bucket_size=MAX_BUCKET_SIZE):
+    """找出與 text 相似的既有作文
+
+    只比對與新作文至少有一段落入同一桶的候選記錄，不需逐篇比較全班作文；
+    每個桶只取最新的 max_bucket_size 筆，常見內容的大桶不會拖慢查詢。
+    回傳依相似度由高到低排序的記錄清單。
+    """
+    signature = minhash_signature(text)
+    if signature is None:
+        return []
+    seen = {exclude_record_id}
+    results = []
+    for band, bucket in band_buckets(signature):
+        rows = conn.execute('''
+        SELECT m.record_id, m.signature, r.student_id, r.practice_mode, r.topic, r.practice_time
+        FROM (SELECT record_id FROM essay_lsh_bands WHERE band = ? AND bucket = ?
+              ORDER BY record_id DESC LIMIT ?) b
+        JOIN essay_minhash m ON m.record_id = b.record_id
+        JOIN practice_records r ON r.record_id = b.record_id
+        ''', (band, bucket, max_bucket_size))
+        for record_id, blob, student_id, practice_mode, topic, practice_time in rows:
+            if record_id in seen:
+                continue
+            seen.add(record_id)
+            similarity = estimate_similarity(signature, _load_signature(blob))
+            if similarity >= threshold:
+                results.append({
+                    "record_id": record_id,
+                    "student_id": student_id,
+                    "practice_mode": practice_mode,
+                    "topic": topic,
+                    "practice_time": practice_time,
+                    "similarity": similarity,
+                })
+    results.sort(key=lambda result: (-result["similarity"], result["record_id"]))
+    return results[:limit]
+
+
+def _filter_clause(practice_mode, topic, since, until, class_id):
+    conditions, params = [], []
+    for column, value in (("practice_mode", practice_mode), ("topic", topic), ("class_id", class_id)):
+        if value is not None:
+            conditions.append(f"r.{column} = ?")
+            params.append(value)
+    if since is not None:
+        conditions.append("r.practice_time >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("r.practice_time < ?")
+        params.append(until)
+    return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+def cluster_submissions(conn, threshold=DEFAULT_THRESHOLD, practice_mode=None, topic=None,
+                        since=None, until=None, class_id=None, max_bucket_size=MAX_BUCKET_SIZE):
+    """把一段期間（如一學期）的作文分群，回傳相似作文群組（每群至少兩篇，依篇數由多到少）
+
+    只比較落入同一 LSH 桶的記錄，確認相似度達門檻後以聯集-查找合併成群。
+    同一桶內每篇只與前 max_bucket_size 篇比較，大桶的比較次數與篇數成正比而非平方；
+    大量相同的作文會經由相鄰的記錄串成同一群。
+    """
+    where, params = _filter_clause(practice_mode, topic, since, until, class_id)
+    signatures = {record_id: _load_signature(blob) for record_id, blob in conn.execute(
+        f"SELECT m.record_id, m.signature FROM essay_minhash m JOIN practice_records r ON r.record_id = m.record_id{where}",
+        params)}
+    parent = {record_id: record_id for record_id in signatures}
+
+    def find(record_id):
+        while parent[record_id] != record_id:
+            parent[record_id] = parent[parent[record_id]]
+            record_id = parent[record_id]
+        return record_id
+
+    checked = set()
+    bucket_key, members = None, []
+    rows = conn.execute(f'''
+    SELECT b.band, b.bucket, b.record_id FROM essay_lsh_bands b
+    JOIN practice_records r ON r.record_id = b.record_id{where}
+    ORDER BY b.band, b.bucket
+    ''', params)
+    for band, bucket, record_id in [*rows, (None, None, None)]:
+        if (band, bucket) == bucket_key:
+            members.append(record_id)
+            continue
+        for i, second in enumerate(members):
+            for first in members[max(0, i - max_bucket_size):i]:
+                pair = (first, second)
+                if pair in checked or find(first) == find(second):
+                    continue
+                checked.add(pair)
+                if estimate_similarity(signatures[first], signatures[second]) >= threshold:
+                    parent[find(second)] = find(first)
+        bucket_key, members = (band, bucket), [record_id]
+
+    groups = {}
+    for record_id in signatures:
+        groups.setdefault(find(record_id), []).append(record_id)
+    clusters = [sorted(group) for group in groups.values() if len(group) > 1]
+    clusters.sort(key=lambda group: (-len(group), group[0]))
+    return clusters
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="找出內容相近（疑似抄襲或重複使用）的作文")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="相似度門檻（0~1）")
+    parser.add_argument("--mode", default=None, help="只比對指定練習模式（如：作文模式）")
+    parser.add_argument("--topic", default=None, help="只比對指定題目")
+    parser.add_argument("--class-id", default=None, help="只比對指定班級")
+    parser.add_argument("--since", default=None, help="起始時間（如：2024-02-01）")
+    parser.add_argument("--until", default=None, help="結束時間（不含）")
+    parser.add_argument("--rebuild", action="store_true", help="重新計算所有記錄的簽章")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    if args.rebuild:
+        for path in router.shard_paths():
+            conn = router.connection_for_path(path)
+            count = rebuild_duplicate_index(conn.cursor())
+            conn.commit()
+            print(f"✅ 已重新計算簽章：{path}（{count} 筆）")
+    for key, conn in router.iter_shards():
+        clusters = cluster_submissions(conn, args.threshold, practice_mode=args.mode, topic=args.topic,
+                                       since=args.since, until=args.until, class_id=args.class_id)
+        for cluster in clusters:
+            print(f"⚠️ {key or '共用庫'}：{len(cluster)} 篇內容相近")
+            for record_id in cluster:
+                student_id, topic, practice_time = conn.execute(
+                    "SELECT student_id, topic, practice_time FROM practice_records WHERE record_id = ?",
+                    (record_id,)).fetchone()
+                print(f"   #{record_id} {student_id}「{topic}」{practice_time}")
+    router.close()
@@ -0,0 +1,180 @@
+import argparse
+import csv
+import io
+import json
+import os
+
+from text_storage import PracticeRecord, iter_records
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 沒有安裝 pyarrow 時不提供 Parquet 格式
+    pa = pq = None
+
+# 每次 fetchmany 的筆數、每頁（一次查詢）的筆數，以及每次寫出的筆數
+BATCH_SIZE = 1000
+PAGE_SIZE = 50000
+CHUNK_RECORDS = 1000
+# Parquet 每個 row group 的筆數（記憶體中只保留一個 row group）
+ROW_GROUP_SIZE = 50000
+
+COLUMNS = PracticeRecord.COLUMNS
+# CSV 開頭加上 BOM，Excel 開啟時中文才不會亂碼
+CSV_BOM = "\ufeff"
+
+
+def available_formats():
+    return ["csv", "jsonl"] + (["parquet"] if pq is not None else [])
+
+
+def record_filters(student_id=None, practice_mode=None, topic=None, since=None, until=None,
+                   school_id=None, class_id=None):
+    """篩選條件轉成（SQL 條件, 參數）；未指定的條件不篩選，時間為 [since, until)"""
+    conditions, params = [], []
+    for column, value in (("student_id", student_id), ("practice_mode", practice_mode), ("topic", topic),
+                          ("school_id", school_id), ("class_id", class_id)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        conditions.append("practice_time >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("practice_time < ?")
+        params.append(until)
+    return " AND ".join(conditions), params
+
+
+def iter_export(router, batch_size=BATCH_SIZE, page_size=PAGE_SIZE, **filters):
+    """逐筆產生所有分庫中符合條件的練習記錄（依分庫、record_id 順序；作文文字讀取時才解壓縮）"""
+    where, params = record_filters(**filters)
+    for _, conn in router.iter_shards():
+        yield from iter_records(conn, batch_size=batch_size, where=where, params=params, page_size=page_size)
+
+
+def _row(record):
+    return [getattr(record, column) for column in COLUMNS]
+
+
+def iter_csv(records, chunk_records=CHUNK_RECORDS):
+    """把記錄轉成 CSV 文字片段（每 chunk_records 筆一段，第一段含 BOM 與欄位名稱）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write(CSV_BOM)
+    writer.writerow(COLUMNS)
+    count = 0
+    for record in records:
+        writer.writerow(_row(record))
+        count += 1
+        if count % chunk_records == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(records, chunk_records=CHUNK_RECORDS):
+    """把記錄轉成 JSON Lines 文字片段（每行一筆）"""
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+        if len(lines) >= chunk_records:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+TEXT_FORMATS = {"csv": iter_csv, "jsonl": iter_jsonl}
+
+
+def _parquet_schema():
+    text, number = pa.string(), pa.float64()
+    types = {"record_id": pa.int64(), "score": number, "score_basics": number, "score_expression": number,
+             "score_structure": number, "score_content": number}
+    return pa.schema([(column, types.get(column, text)) for column in COLUMNS])
+
+
+def write_parquet(records, path, row_group_size=ROW_GROUP_SIZE):
+    """以 row group 為單位寫出 Parquet（需要 pyarrow），回傳筆數"""
+    if pq is None:
+        raise RuntimeError("Parquet 格式需要安裝 pyarrow")
+    schema = _parquet_schema()
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        columns = {column: [] for column in COLUMNS}
+        for record in records:
+            for column, value in zip(COLUMNS, _row(record)):
+                columns[column].append(value)
+            count += 1
+            if count % row_group_size == 0:
+                writer.write_table(pa.Table.from_pydict(columns, schema))
+                columns = {column: [] for column in COLUMNS}
+        if columns["record_id"] or not count:
+            writer.write_table(pa.Table.from_pydict(columns, schema))
+    return count
+
+
+def export_format(path, fmt=None):
+    """未指定格式時依副檔名判斷"""
+    fmt = (fmt or os.path.splitext(path)[1].lstrip(".")).lower()
+    if fmt not in available_formats():
+        raise ValueError(f"不支援的匯出格式：{fmt or path}（可用 {available_formats()}）")
+    return fmt
+
+
+def export_records(router, path, fmt=None, batch_size=BATCH_SIZE, page_size=PAGE_SIZE, **filters):
+    """把符合條件的練習記錄串流寫入檔案（先寫暫存檔，完成後才換上），回傳筆數
+
+    記錄以 fetchmany 逐批讀取、逐段寫出，記憶體用量與資料量無關。
+    """
+    fmt = export_format(path, fmt)
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    records = counted(iter_export(router, batch_size, page_size, **filters))
+    temp_path = path + ".tmp"
+    try:
+        if fmt == "parquet":
+            write_parquet(records, temp_path)
+        else:
+            with open(temp_path, "w", encoding="utf-8", newline="") as f:
+                for chunk in TEXT_FORMATS[fmt](records):
+                    f.write(chunk)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return count
+
+
+if __name__ == "__main__":
+    import time
+
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="匯出練習記錄（串流讀寫，適用於大量資料）")
+    parser.add_argument("output", help=f"輸出檔案（副檔名決定格式：{'/'.join(available_formats())}）")
+    parser.add_argument("--format", default=None, help="輸出格式（預設依副檔名）")
+    parser.add_argument("--student-id", default=None)
+    parser.add_argument("--mode", default=None, help="練習模式")
+    parser.add_argument("--topic", default=None)
+    parser.add_argument("--school-id", default=None)
+    parser.add_argument("--class-id", default=None)
+    parser.add_argument("--since", default=None, help="起始時間（如：2024-02-01）")
+    parser.add_argument("--until", default=None, help="結束時間（不含）")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    started = time.perf_counter()
+    count = export_records(router, args.output, args.format, student_id=args.student_id, practice_mode=args.mode,
+                           topic=args.topic, school_id=args.school_id, class_id=args.class_id,
+                           since=args.since, until=args.until)
+    print(f"✅ 已匯出 {count} 筆記錄到 {args.output}（{time.perf_counter() - started:.1f} 秒）")
+    router.close()
@@ -0,0 +1,328 @@
+import argparse
+import gzip
+import hmac
+import itertools
+import json
+import os
+import random
+import sqlite3
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from datetime import datetime
+
+from db_init import SUB_SCORE_COLUMNS
+from text_storage import TextCodec, iter_records
+
+# 設定中央伺服器網址即開啟同步，例如 https://writing.example.org/api/sync/practice-records
+SYNC_URL_ENV = "WRITING_SYNC_URL"
+# 選用：上傳時附帶的存取權杖（伺服器端設定同名環境變數即要求驗證）
+SYNC_TOKEN_ENV = "WRITING_SYNC_TOKEN"
+
+BATCH_SIZE = 200
+# 解壓縮後的單批上限，避免異常封包佔滿伺服器記憶體
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+# 這些狀態碼代表伺服器暫時無法處理，稍後重試（500 多半是這批資料本身的問題，重傳也不會成功）
+RETRY_STATUS = (408, 429, 502, 503, 504)
+# 上傳記錄的練習時間格式（與 SQLite CURRENT_TIMESTAMP 相同，可省略時間）
+PRACTICE_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+RECORD_FIELDS = ("record_id", "student_id", "school_id", "class_id", "practice_mode", "topic",
+                 "input_text", "suggested_text", "score", "practice_time",
+                 "score_basics", "score_expression", "score_structure", "score_content")
+
+
+class SyncError(Exception):
+    """上傳失敗（重試用盡或伺服器拒絕），高水位不前進，下次從同一批重傳"""
+
+
+class SyncPayloadError(ValueError):
+    """伺服器收到格式錯誤的上傳資料"""
+
+
+# ------------------------------ 用戶端（桌面版） ------------------------------
+def install_sync_state(cursor):
+    """建立同步狀態表：本資料庫的裝置編號與已上傳的最大記錄編號"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    ''')
+
+
+def _get_state(conn, name):
+    row = conn.execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(conn, name, value):
+    conn.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)", (name, str(value)))
+
+
+def device_id(conn):
+    """本資料庫的裝置編號（第一次同步時產生）；伺服器以（裝置編號, 記錄編號）辨識重複上傳"""
+    value = _get_state(conn, "device_id")
+    if value is None:
+        value = uuid.uuid4().hex
+        _set_state(conn, "device_id", value)
+        conn.commit()
+    return value
+
+
+def high_water_mark(conn):
+    """已確認上傳的最大記錄編號"""
+    return int(_get_state(conn, "high_water_mark") or 0)
+
+
+class HttpTransport:
+    """以 HTTP POST 上傳；傳入 (body, headers)，回傳 (狀態碼, 回應JSON)，網路錯誤時拋出 OSError"""
+
+    def __init__(self, url, token=None, timeout=30):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def __call__(self, body, headers):
+        headers = dict(headers)
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.url, data=body, headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            return e.code, {}
+
+
+class SyncClient:
+    """把本機新增的練習記錄分批推送到中央伺服器
+
+    - 只上傳高水位之後的記錄，每批成功後才推進高水位（存於 sync_state 表）
+    - 每批以 gzip 壓縮的 JSON 上傳；伺服器依（裝置編號, 記錄編號）去重，重傳不會重複寫入
+    - 網路錯誤或伺服器忙碌時以指數退避（含隨機抖動）重試
+    transport 可替換（測試時直接呼叫 Flask test_client）。
+    """
+
+    def __init__(self, transport, batch_size=BATCH_SIZE, max_retries=5, backoff=1.0, max_backoff=60.0,
+                 sleep=time.sleep):
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+
+    @classmethod
+    def from_env(cls):
+        """有設定伺服器網址時建立用戶端，否則回傳None"""
+        url = os.environ.get(SYNC_URL_ENV)
+        if not url:
+            return None
+        return cls(HttpTransport(url, os.environ.get(SYNC_TOKEN_ENV)))
+
+    def _send(self, body, headers):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, reply = self.transport(body, headers)
+            except OSError as e:
+                error = e
+            else:
+                if status == 200:
+                    return reply
+                if status not in RETRY_STATUS:
+                    raise SyncError(f"伺服器拒絕上傳（HTTP {status}）")
+                error = f"HTTP {status}"
+            if attempt < self.max_retries:
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                self.sleep(delay / 2 + random.uniform(0, delay / 2))
+        raise SyncError(f"上傳失敗，已重試 {self.max_retries} 次：{error}")
+
+    def sync_connection(self, conn):
+        """推送此資料庫高水位之後的所有記錄，回傳上傳筆數"""
+        install_sync_state(conn.cursor())
+        device = device_id(conn)
+        codec = TextCodec(conn)
+        pushed = 0
+        while True:
+            after_id = high_water_mark(conn)
+            records = list(itertools.islice(iter_records(conn, after_id, self.batch_size, codec), self.batch_size))
+            if not records:
+                return pushed
+            payload = {"device_id": device,
+                       "records": [{field: getattr(record, field) for field in RECORD_FIELDS} for record in records]}
+            body = gzip.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            last_id = records[-1].record_id
+            self._send(body, {
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+                "Idempotency-Key": f"{device}:{records[0].record_id}-{last_id}",
+            })
+            _set_state(conn, "high_water_mark", last_id)
+            conn.commit()
+            pushed += len(records)
+
+    def sync_database(self, path):
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            return self.sync_connection(conn)
+        finally:
+            conn.close()
+
+    def sync_router(self, router):
+        """推送路由下所有練習記錄庫，回傳上傳總筆數"""
+        return sum(self.sync_database(path) for path in router.shard_paths())
+
+
+# ------------------------------ 伺服器端（中央） ------------------------------
+def decode_body(body, content_encoding=None):
+    """解析上傳內容（支援 gzip），超過大小上限時拋出 SyncPayloadError"""
+    if content_encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_BATCH_BYTES)
+        except zlib.error as e:
+            raise SyncPayloadError(f"無法解壓縮：{e}")
+        if decompressor.unconsumed_tail:
+            raise SyncPayloadError("上傳內容超過大小上限")
+    elif len(body) > MAX_BATCH_BYTES:
+        raise SyncPayloadError("上傳內容超過大小上限")
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise SyncPayloadError(f"無法解析JSON：{e}")
+
+
+def _validate(payload):
+    if not isinstance(payload, dict):
+        raise SyncPayloadError("上傳內容必須是JSON物件")
+    device = payload.get("device_id")
+    if not isinstance(device, str) or not 0 < len(device) <= 64:
+        raise SyncPayloadError("缺少有效的 device_id")
+    records = payload.get("records")
+    if not isinstance(records, list):
+        raise SyncPayloadError("缺少 records 清單")
+    for record in records:
+        # bool 是 int 的子類別，true/false 不能當作記錄編號
+        if (not isinstance(record, dict) or not isinstance(record.get("record_id"), int)
+                or isinstance(record["record_id"], bool)):
+            raise SyncPayloadError("每筆記錄都需要整數 record_id")
+        for field in ("practice_mode", "topic", "input_text"):
+            if not isinstance(record.get(field), str):
+                raise SyncPayloadError(f"記錄 {record['record_id']} 缺少 {field}")
+        for field in ("student_id", "school_id", "class_id", "suggested_text", "practice_time"):
+            if not isinstance(record.get(field), (str, type(None))):
+                raise SyncPayloadError(f"記錄 {record['record_id']} 的 {field} 不是文字")
+        for field in ("score", *(column for _, column, _ in SUB_SCORE_COLUMNS)):
+            if not isinstance(record.get(field, 0), (int, float, type(None))):
+                raise SyncPayloadError(f"記錄 {record['record_id']} 的 {field} 不是數字")
+        if record.get("practice_time") is not None and not _valid_time(record["practice_time"]):
+            raise SyncPayloadError(f"記錄 {record['record_id']} 的 practice_time 格式應為 YYYY-MM-DD[ HH:MM:SS]")
+    return device, records
+
+
+def _valid_time(value):
+    for fmt in PRACTICE_TIME_FORMATS:
+        try:
+            datetime.strptime(value, fmt)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+def install_sync_receipts(cursor):
+    """建立上傳收據表：（裝置編號, 來源記錄編號）→ 中央記錄編號，用於去重"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_receipts (
+        device_id TEXT NOT NULL,
+        source_record_id INTEGER NOT NULL,
+        record_id INTEGER NOT NULL,
+        PRIMARY KEY (device_id, source_record_id)
+    ) WITHOUT ROWID
+    ''')
+
+
+def receive_batch(router, payload):
+    """寫入一批上傳的記錄（依學校/班級寫入中央對應分庫）；已收過的記錄略過
+
+    整批在各分庫的交易內完成，任何錯誤都會整批回滾，用戶端重傳即可。
+    回傳 {"accepted": 新寫入筆數, "duplicates": 重複筆數, "last_record_id": 本批最大來源編號}。
+    """
+    from writing_advisor import insert_practice_record
+
+    device, records = _validate(payload)
+    touched = {}
+    accepted = duplicates = 0
+    try:
+        for record in records:
+            conn = router.records_connection(record.get("school_id") or "", record.get("class_id") or "")
+            if id(conn) not in touched:
+                install_sync_receipts(conn.cursor())
+                touched[id(conn)] = (conn, TextCodec(conn))
+            codec = touched[id(conn)][1]
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sync_receipts WHERE device_id = ? AND source_record_id = ?",
+                           (device, record["record_id"]))
+            if cursor.fetchone():
+                duplicates += 1
+                continue
+            record_id = insert_practice_record(
+                cursor, codec, record.get("student_id") or "default_student", record.get("school_id") or "",
+                record.get("class_id") or "", record["practice_mode"], record["topic"], record["input_text"],
+                record.get("suggested_text"), record.get("score") or 0, record.get("practice_time"),
+                {name: record.get(column) for name, column, _ in SUB_SCORE_COLUMNS})
+            cursor.execute("INSERT INTO sync_receipts (device_id, source_record_id, record_id) VALUES (?, ?, ?)",
+                           (device, record["record_id"], record_id))
+            accepted += 1
+        for conn, _ in touched.values():
+            conn.commit()
+    except Exception:
+        for conn, _ in touched.values():
+            conn.rollback()
+        raise
+    last_record_id = max((record["record_id"] for record in records), default=None)
+    return {"accepted": accepted, "duplicates": duplicates, "last_record_id": last_record_id}
+
+
+def token_configured():
+    return bool(os.environ.get(SYNC_TOKEN_ENV))
+
+
+def check_token(authorization):
+    """檢查 Authorization 標頭；伺服器沒有設定權杖時一律拒絕（上傳與匯出都不開放匿名存取）"""
+    token = os.environ.get(SYNC_TOKEN_ENV)
+    if not token:
+        return False
+    return hmac.compare_digest(authorization or "", f"Bearer {token}")
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="把本機練習記錄同步到中央伺服器")
+    parser.add_argument("--url", default=os.environ.get(SYNC_URL_ENV), help=f"同步網址（預設讀取 {SYNC_URL_ENV}）")
+    parser.add_argument("--reset", action="store_true", help="清除高水位，下次從頭上傳（更換伺服器時使用）")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    if args.reset:
+        for path in router.shard_paths():
+            conn = sqlite3.connect(path)
+            install_sync_state(conn.cursor())
+            conn.execute("DELETE FROM sync_state WHERE name = 'high_water_mark'")
+            conn.commit()
+            conn.close()
+        print("✅ 已清除同步進度")
+    if args.url:
+        client = SyncClient(HttpTransport(args.url, os.environ.get(SYNC_TOKEN_ENV)))
+        try:
+            print(f"✅ 已同步 {client.sync_router(router)} 筆練習記錄")
+        except SyncError as e:
+            print(f"❌ {e}")
+    elif not args.reset:
+        parser.error(f"請以 --url 或環境變數 {SYNC_URL_ENV} 指定伺服器")
+    router.close()
@@ -0,0 +1,291 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+
+# 內建規則包（db_init 每次啟動匯入；內容沒變時不會重寫資料庫）
+BUILTIN_PACK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "packs", "builtin.json")
+
+RULE_COLUMNS = ("rule_type", "rule_desc", "trigger_condition", "suggestion_template", "score_weight", "grade_range")
+RESOURCE_COLUMNS = ("res_type", "content", "grade_range")
+
+# 建議模板可用的佔位符（writing_advisor.generate_suggestions 會替換的項目）
+PLACEHOLDERS = {"主語", "謂語", "推薦謂語", "形容詞", "比喻詞", "銜接詞", "賓語", "擬人詞", "時間", "地點", "動作",
+                "感受", "喻體", "道理", "句子", "主題", "下句優化", "優化後短句", "正確表述", "題目", "題目關鍵詞",
+                "錯別字類型"}
+_PLACEHOLDER_RE = re.compile(r"【([^】]*)】")
+_GRADE_RE = re.compile(r"^[1-6]-[1-6]年級$")
+# 錯誤訊息最多列出幾筆
+MAX_ERRORS = 20
+
+# 依規則包刪除舊內容用的索引；大量寫入時先移除，寫完再一次建立
+PACK_INDEXES = [
+    ("idx_writing_rules_pack", "writing_rules"),
+    ("idx_student_resources_pack", "student_resources"),
+]
+
+Pack = namedtuple("Pack", ["name", "version", "rules", "resources"])
+Pack.__doc__ = """規則包：名稱、版本號、規則（RULE_COLUMNS 順序的 tuple）與資源（RESOURCE_COLUMNS 順序的 tuple）"""
+
+
+class PackError(ValueError):
+    """規則包格式錯誤、內容不合法，或版本號沒有比已安裝的新"""
+
+
+def install_pack_tables(cursor):
+    """建立已安裝規則包的記錄表與依規則包查詢的索引（writing_rules / student_resources 的 pack 欄位由 db_init 建立）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS rule_packs (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        checksum TEXT NOT NULL,
+        rule_count INTEGER NOT NULL,
+        resource_count INTEGER NOT NULL,
+        imported_time DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    for index, table in PACK_INDEXES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index} ON {table} (pack)")
+
+
+def read_pack(path):
+    """讀取規則包：.json 或 .csv（副檔名決定格式）
+
+    JSON：{"name": ..., "version": 1, "rules": [{欄位: 值}, ...], "resources": [...]}
+    CSV：第一行「#pack,名稱,版本」，之後以「#rules」「#resources」分段，各段第一行為欄位名稱。
+    """
+    if path.lower().endswith(".csv"):
+        return _read_csv_pack(path)
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except json.JSONDecodeError as e:
+        raise PackError(f"{path}：JSON 格式錯誤：{e}") from None
+    if not isinstance(data, dict):
+        raise PackError(f"{path}：規則包必須是 JSON 物件")
+    return Pack(data.get("name"), data.get("version"), data.get("rules", []), data.get("resources", []))
+
+
+def _read_csv_pack(path):
+    sections = {"rules": [], "resources": []}
+    name = version = section = header = None
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for line_number, row in enumerate(csv.reader(f), 1):
+            if not any(cell.strip() for cell in row):
+                continue
+            first = row[0].strip()
+            if first == "#pack":
+                if len(row) < 3:
+                    raise PackError(f"{path} 第 {line_number} 行：應為「#pack,名稱,版本」")
+                name, version = row[1].strip(), row[2].strip()
+                version = int(version) if version.isdigit() else version
+            elif first in ("#rules", "#resources"):
+                section, header = first[1:], None
+            elif section is None:
+                raise PackError(f"{path} 第 {line_number} 行：資料前需要「#rules」或「#resources」")
+            elif header is None:
+                header = [cell.strip() for cell in row]
+            else:
+                sections[section].append(dict(zip(header, row)))
+    return Pack(name, version, sections["rules"], sections["resources"])
+
+
+def _text(row, column):
+    value = row.get(column)
+    return value.strip() if isinstance(value, str) else ""
+
+
+def validate_pack(pack):
+    """檢查規則包並去除重複，回傳（整理後的 Pack, 重複筆數）；有錯誤時丟出 PackError（列出前幾筆錯誤）
+
+    重複的規則（同年級、觸發條件、類型與模板）只保留第一筆；同類型、同年級的資源合併成一筆並去除重複詞語。
+    """
+    errors = []
+    if not isinstance(pack.name, str) or not pack.name.strip():
+        errors.append("規則包需要名稱（name）")
+    if isinstance(pack.version, bool) or not isinstance(pack.version, int) or pack.version < 1:
+        errors.append(f"版本號（version）須為正整數，收到：{pack.version!r}")
+    if not isinstance(pack.rules, list) or not isinstance(pack.resources, list):
+        raise PackError("rules 與 resources 必須是清單")
+
+    rules, seen, duplicates = [], set(), 0
+    for number, row in enumerate(pack.rules, 1):
+        if not isinstance(row, dict):
+            errors.append(f"規則第 {number} 筆：必須是物件")
+            continue
+        values = {column: _text(row, column) for column in RULE_COLUMNS if column != "score_weight"}
+        missing = [column for column, value in values.items() if not value]
+        if missing:
+            errors.append(f"規則第 {number} 筆：缺少 {'、'.join(missing)}")
+            continue
+        try:
+            weight = float(row.get("score_weight"))
+        except (TypeError, ValueError):
+            weight = None
+        if weight is None or not 0 <= weight <= 1:
+            errors.append(f"規則第 {number} 筆：score_weight 須為 0~1 的數字，收到：{row.get('score_weight')!r}")
+            continue
+        if not _GRADE_RE.match(values["grade_range"]):
+            errors.append(f"規則第 {number} 筆：年級格式應如「3-6年級」，收到：{values['grade_range']}")
+            continue
+        unknown = set(_PLACEHOLDER_RE.findall(values["suggestion_template"])) - PLACEHOLDERS
+        if unknown:
+            errors.append(f"規則第 {number} 筆：模板有未知的佔位符 {'、'.join(f'【{name}】' for name in sorted(unknown))}")
+            continue
+        key = (values["grade_range"], values["trigger_condition"], values["rule_type"], values["suggestion_template"])
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        rules.append((values["rule_type"], values["rule_desc"], values["trigger_condition"],
+                      values["suggestion_template"], weight, values["grade_range"]))
+
+    merged = {}
+    for number, row in enumerate(pack.resources, 1):
+        if not isinstance(row, dict):
+            errors.append(f"資源第 {number} 筆：必須是物件")
+            continue
+        res_type, grade_range = _text(row, "res_type"), _text(row, "grade_range")
+        words = [word.strip() for word in _text(row, "content").split("、") if word.strip()]
+        if not res_type or not words:
+            errors.append(f"資源第 {number} 筆：缺少 res_type 或 content")
+            continue
+        if not _GRADE_RE.match(grade_range):
+            errors.append(f"資源第 {number} 筆：年級格式應如「3-6年級」，收到：{grade_range}")
+            continue
+        group = merged.setdefault((res_type, grade_range), {})
+        for word in words:
+            if word in group:
+                duplicates += 1
+            group[word] = None
+
+    if errors:
+        more = f"\n……另有 {len(errors) - MAX_ERRORS} 個錯誤" if len(errors) > MAX_ERRORS else ""
+        raise PackError("\n".join(errors[:MAX_ERRORS]) + more)
+    resources = [(res_type, "、".join(words), grade_range) for (res_type, grade_range), words in merged.items()]
+    return Pack(pack.name.strip(), pack.version, rules, resources), duplicates
+
+
+def pack_checksum(pack):
+    """整理後內容的雜湊（不含版本號）：內容相同就不必重新匯入"""
+    payload = json.dumps([pack.rules, pack.resources], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def installed_packs(conn):
+    """已安裝的規則包：名稱 → （版本, 規則數, 資源數）"""
+    install_pack_tables(conn.cursor())
+    return {name: (version, rule_count, resource_count) for name, version, rule_count, resource_count in
+            conn.execute("SELECT name, version, rule_count, resource_count FROM rule_packs ORDER BY name")}
+
+
+def import_pack(conn, pack, force=False):
+    """匯入規則包（路徑或 Pack）：取代同名規則包的舊內容，全部在一個交易內完成
+
+    內容與已安裝的相同時不寫入（重複執行不會改變資料庫，也不會讓執行中的建議生成器重新載入）；
+    內容有變時版本號必須比已安裝的大（force=True 可略過）。每個規則包擁有自己的規則與資源（只去除包內的重複），
+    移除其他規則包不影響本包宣告的規則；不同規則包的相同規則在建議生成器載入時合併成一條。
+    回傳 {"name", "version", "status": "imported" 或 "unchanged", "rules", "resources", "duplicates"}。
+    """
+    if isinstance(pack, str):
+        pack = read_pack(pack)
+    pack, duplicates = validate_pack(pack)
+    checksum = pack_checksum(pack)
+    result = {"name": pack.name, "version": pack.version, "status": "unchanged",
+              "rules": len(pack.rules), "resources": len(pack.resources), "duplicates": duplicates}
+    install_pack_tables(conn.cursor())
+    conn.commit()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.cursor()
+        row = cursor.execute("SELECT version, checksum FROM rule_packs WHERE name = ?", (pack.name,)).fetchone()
+        if row is not None and row[1] == checksum:
+            conn.rollback()
+            return result
+        if row is not None and pack.version <= row[0] and not force:
+            raise PackError(f"規則包「{pack.name}」已安裝第 {row[0]} 版，內容有變更時版本號需要更大（收到第 {pack.version} 版）")
+        cursor.execute("DELETE FROM writing_rules WHERE pack = ?", (pack.name,))
+        cursor.execute("DELETE FROM student_resources WHERE pack = ?", (pack.name,))
+
+        for index, _ in PACK_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {index}")
+        cursor.executemany(f'''
+        INSERT INTO writing_rules ({", ".join(RULE_COLUMNS)}, pack) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(*rule, pack.name) for rule in pack.rules])
+        cursor.executemany(f'''
+        INSERT INTO student_resources ({", ".join(RESOURCE_COLUMNS)}, pack) VALUES (?, ?, ?, ?)
+        ''', [(*resource, pack.name) for resource in pack.resources])
+        install_pack_tables(cursor)
+        cursor.execute('''
+        INSERT OR REPLACE INTO rule_packs (name, version, checksum, rule_count, resource_count)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (pack.name, pack.version, checksum, len(pack.rules), len(pack.resources)))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    result["status"] = "imported"
+    return result
+
+
+def remove_pack(conn, name):
+    """移除規則包及其規則與資源，回傳是否有這個規則包"""
+    install_pack_tables(conn.cursor())
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM writing_rules WHERE pack = ?", (name,))
+        conn.execute("DELETE FROM student_resources WHERE pack = ?", (name,))
+        removed = conn.execute("DELETE FROM rule_packs WHERE name = ?", (name,)).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return bool(removed)
+
+
+if __name__ == "__main__":
+    import time
+
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="匯入、檢查或移除寫作規則包（JSON / CSV）")
+    parser.add_argument("packs", nargs="*", help="要匯入的規則包檔案")
+    parser.add_argument("--check", action="store_true", help="只檢查格式，不匯入")
+    parser.add_argument("--force", action="store_true", help="版本號沒有增加也匯入")
+    parser.add_argument("--remove", default=None, help="移除指定名稱的規則包")
+    parser.add_argument("--list", action="store_true", help="列出已安裝的規則包")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    conn = router.connect_shared(read_only=False)
+    try:
+        for path in args.packs:
+            try:
+                if args.check:
+                    pack, duplicates = validate_pack(read_pack(path))
+                    print(f"✅ {path}：{len(pack.rules)} 條規則、{len(pack.resources)} 筆資源（略過 {duplicates} 個重複）")
+                    continue
+                started = time.perf_counter()
+                result = import_pack(conn, path, force=args.force)
+            except PackError as e:
+                print(f"❌ {path}：\n{e}")
+                continue
+            if result["status"] == "unchanged":
+                print(f"ℹ️ {result['name']} 第 {result['version']} 版內容沒有變更，略過")
+            else:
+                print(f"✅ 已匯入 {result['name']} 第 {result['version']} 版：{result['rules']} 條規則、"
+                      f"{result['resources']} 筆資源（略過 {result['duplicates']} 個重複，"
+                      f"{time.perf_counter() - started:.2f} 秒）")
+        if args.remove:
+            print(f"✅ 已移除 {args.remove}" if remove_pack(conn, args.remove) else f"❌ 沒有規則包：{args.remove}")
+        if args.list:
+            for name, (version, rule_count, resource_count) in installed_packs(conn).items():
+                print(f"{name}\t第 {version} 版\t{rule_count} 條規則\t{resource_count} 筆資源")
+    finally:
+        conn.close()
+        router.close()
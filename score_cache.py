@@ -0,0 +1,78 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from db_init import SUB_SCORE_COLUMNS
+
+# 評分方式（calculate_score 的計分規則）改變時加一，資料庫中舊的評分結果隨之不再沿用
+SCORE_VERSION = 2
+# 記憶體中保留最近的作文評分結果數
+CACHE_SIZE = 1024
+
+
+def normalize_text(text):
+    """評分前的文字正規化：統一換行、去掉前後空白（這些差異不影響評分）"""
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def content_hash(text, topic, version):
+    """作文評分結果的快取鍵：正規化文字、作文題目與規則資源版本的 SHA-256
+
+    version 為規則資源（含題目向量）與錯字模型的版本，任一改變時鍵就不同，舊結果自然作廢。
+    """
+    key = "\0".join((str(SCORE_VERSION), str(version), topic or "", normalize_text(text)))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ScoreCache:
+    """作文評分結果的記憶體快取（只保留最近使用的，可跨執行緒使用）"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """回傳（總分, 分項得分）；分項得分每次回傳新的 dict，呼叫端修改不影響快取"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        total_score, scores = entry
+        return total_score, dict(scores)
+
+    def put(self, key, total_score, scores):
+        with self._lock:
+            self._entries[key] = (total_score, tuple(scores.items()))
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def matches(self, key, total_score, scores):
+        """快取中是否有這個鍵且結果相同（儲存記錄時確認分數確實是這份內容的評分）"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry is not None and entry == (total_score, tuple(scores.items()))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def stored_score(conn, key):
+    """從練習記錄中找出同一內容雜湊的評分，回傳（總分, 分項得分），沒有時回傳None"""
+    row = conn.execute(f'''
+    SELECT score, {", ".join(column for _, column, _ in SUB_SCORE_COLUMNS)} FROM practice_records
+    WHERE content_hash = ? ORDER BY record_id DESC LIMIT 1
+    ''', (key,)).fetchone()
+    if row is None or None in row:
+        return None
+    return row[0], {name: value for (name, _, _), value in zip(SUB_SCORE_COLUMNS, row[1:])}
@@ -0,0 +1,132 @@
+import argparse
+
+# 練習時間無法解析（如「昨天」、「2024/03/04」）時歸入的週次，週次欄不可為 NULL
+UNKNOWN_WEEK = "unknown"
+# 週次鍵（年-W週），依練習時間計算
+WEEK_EXPR = f"COALESCE(strftime('%Y-W%W', COALESCE({{row}}.practice_time, 'now')), '{UNKNOWN_WEEK}')"
+
+_ADD_ROW = '''
+    INSERT INTO score_rollups (student_id, practice_mode, topic, week, record_count, score_sum, best_score)
+    VALUES (NEW.student_id, NEW.practice_mode, NEW.topic, {week}, 1, NEW.score, NEW.score)
+    ON CONFLICT (student_id, practice_mode, topic, week) DO UPDATE SET
+        record_count = record_count + 1,
+        score_sum = score_sum + excluded.score_sum,
+        best_score = MAX(best_score, excluded.best_score);
+'''.format(week=WEEK_EXPR.format(row="NEW"))
+
+# 刪除時最高分可能改變，只重算該學生同一分組的記錄
+_REMOVE_ROW = '''
+    UPDATE score_rollups SET
+        record_count = record_count - 1,
+        score_sum = score_sum - OLD.score,
+        best_score = COALESCE((SELECT MAX(score) FROM practice_records
+                               WHERE student_id = OLD.student_id AND practice_mode = OLD.practice_mode
+                                 AND topic = OLD.topic AND {record_week} = {week}), 0)
+    WHERE student_id = OLD.student_id AND practice_mode = OLD.practice_mode
+      AND topic = OLD.topic AND week = {week};
+    DELETE FROM score_rollups
+    WHERE student_id = OLD.student_id AND practice_mode = OLD.practice_mode
+      AND topic = OLD.topic AND week = {week} AND record_count <= 0;
+'''.format(week=WEEK_EXPR.format(row="OLD"), record_week=WEEK_EXPR.format(row="practice_records"))
+
+
+def install_rollups(cursor):
+    """建立分數彙總表與維護觸發器；新建彙總表時以既有記錄回填"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='score_rollups'")
+    existed = cursor.fetchone() is not None
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS score_rollups (
+        student_id TEXT NOT NULL,
+        practice_mode TEXT NOT NULL,
+        topic TEXT NOT NULL,
+        week TEXT NOT NULL,
+        record_count INTEGER NOT NULL,
+        score_sum FLOAT NOT NULL,
+        best_score FLOAT NOT NULL,
+        PRIMARY KEY (student_id, practice_mode, topic, week)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_practice_records_student ON practice_records (student_id, practice_mode, topic)")
+    # 觸發器依目前的週次算式重建（舊版資料庫的觸發器可能沿用舊算式）
+    for name in ("insert", "delete", "update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS practice_records_rollup_{name}")
+    cursor.execute(f'''
+    CREATE TRIGGER practice_records_rollup_insert AFTER INSERT ON practice_records
+    BEGIN {_ADD_ROW} END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER practice_records_rollup_delete AFTER DELETE ON practice_records
+    BEGIN {_REMOVE_ROW} END
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER practice_records_rollup_update
+    AFTER UPDATE OF student_id, practice_mode, topic, score, practice_time ON practice_records
+    BEGIN {_REMOVE_ROW} {_ADD_ROW} END
+    ''')
+    if not existed:
+        rebuild_rollups(cursor)
+
+
+def rebuild_rollups(cursor):
+    """清空並從練習記錄重新計算所有彙總"""
+    cursor.execute("DELETE FROM score_rollups")
+    cursor.execute(f'''
+    INSERT INTO score_rollups (student_id, practice_mode, topic, week, record_count, score_sum, best_score)
+    SELECT student_id, practice_mode, topic, {WEEK_EXPR.format(row="practice_records")},
+           COUNT(*), SUM(score), MAX(score)
+    FROM practice_records
+    GROUP BY 1, 2, 3, 4
+    ''')
+
+
+def _to_dict(row):
+    student_id, practice_mode, topic, week, record_count, score_sum, best_score = row
+    return {
+        "student_id": student_id,
+        "practice_mode": practice_mode,
+        "topic": topic,
+        "week": week,
+        "record_count": record_count,
+        "average_score": score_sum / record_count,
+        "best_score": best_score,
+    }
+
+
+def get_rollup(conn, student_id, practice_mode, topic, week):
+    """以主鍵直接讀取單一彙總（不掃描練習記錄）"""
+    row = conn.execute('''
+    SELECT student_id, practice_mode, topic, week, record_count, score_sum, best_score
+    FROM score_rollups WHERE student_id=? AND practice_mode=? AND topic=? AND week=?
+    ''', (student_id, practice_mode, topic, week)).fetchone()
+    return _to_dict(row) if row else None
+
+
+def get_student_progress(conn, student_id, practice_mode=None):
+    """讀取學生各模式、題目、週次的彙總，供進度儀表板使用"""
+    sql = '''
+    SELECT student_id, practice_mode, topic, week, record_count, score_sum, best_score
+    FROM score_rollups WHERE student_id=?
+    '''
+    params = [student_id]
+    if practice_mode is not None:
+        sql += " AND practice_mode=?"
+        params.append(practice_mode)
+    return [_to_dict(row) for row in conn.execute(sql + " ORDER BY practice_mode, topic, week", params)]
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="分數彙總表維護工具")
+    parser.add_argument("--rebuild", action="store_true", help="從練習記錄重新計算所有彙總")
+    args = parser.parse_args()
+    if args.rebuild:
+        router = StorageRouter.from_env()
+        for path in router.shard_paths():
+            conn = router.connection_for_path(path)
+            rebuild_rollups(conn.cursor())
+            conn.commit()
+            print(f"✅ 已重建分數彙總：{path}")
+        router.close()
+    else:
+        parser.print_help()
@@ -0,0 +1,56 @@
+import re
+from collections import namedtuple
+
+# 句末標點與其後可能緊接的收尾引號、括號
+TERMINALS = "。！？!?…"
+CLOSERS = "」』”’）)》〉"
+
+# 一句 = 非句末標點、非換行的文字 + 選擇性的句末標點（可連續，如「……」「！？」）與收尾符號
+_SENTENCE_RE = re.compile(
+    r"(?P<body>[^{t}\n]+)(?P<end>[{t}]+[{c}]*)?".format(t=re.escape(TERMINALS), c=re.escape(CLOSERS))
+)
+
+SentenceSpan = namedtuple("SentenceSpan", ["start", "end", "text", "body", "terminated"])
+SentenceSpan.__doc__ = """句子範圍：start/end 為在原文中的位置（含句末標點），body 為去掉句末標點的句子"""
+
+
+def _span(match):
+    body = match.group("body")
+    lead = len(body) - len(body.lstrip())
+    body = body.strip()
+    if not body:
+        return None
+    start = match.start() + lead
+    terminated = match.group("end") is not None
+    end = match.end() if terminated else start + len(body)
+    return SentenceSpan(start, end, match.string[start:end], body, terminated)
+
+
+def iter_sentences(text, pos=0):
+    """逐句產生 SentenceSpan（單次線性掃描，不建立中間清單）"""
+    for match in _SENTENCE_RE.finditer(text, pos):
+        span = _span(match)
+        if span is not None:
+            yield span
+
+
+def last_sentence(text):
+    """回傳文末最後一句的 SentenceSpan；只往回掃描到上一個句界，與全文長度無關"""
+    i = len(text.rstrip())
+    while i > 0 and text[i - 1] in TERMINALS + CLOSERS:
+        i -= 1
+    j = i
+    while j > 0 and text[j - 1] not in TERMINALS and text[j - 1] != "\n":
+        j -= 1
+    # 上一句的收尾引號屬於上一句
+    while j < i and text[j] in CLOSERS:
+        j += 1
+    return next(iter_sentences(text, j), None)
+
+
+_ENDING_RE = re.compile(r"[{t}]+[{c}]*$".format(t=re.escape(TERMINALS), c=re.escape(CLOSERS)))
+
+
+def sentence_body(text):
+    """去掉句末標點與收尾符號後的句子"""
+    return _ENDING_RE.sub("", text.strip()).strip()
@@ -0,0 +1,293 @@
+import argparse
+import gc
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+# 工作進程數與每個工作進程的執行緒數（工作進程數未設定時為CPU核心數）
+WORKERS_ENV = "WRITING_WORKERS"
+THREADS_ENV = "WRITING_THREADS"
+DEFAULT_THREADS = 4
+# 關閉或輪替時等待進行中請求完成的秒數，逾時強制結束
+GRACEFUL_TIMEOUT = 30
+# 新的工作進程回報就緒的最長等待秒數
+READY_TIMEOUT = 60
+
+# 預熱用的句子：主進程先跑一次完整的建議與評分流程，分詞詞典與各種快照都在 fork 前載入
+WARMUP_TOPIC = "我的寵物"
+WARMUP_SENTENCE = "週末我和媽媽帶小狗去公園散步，牠開心地跑來跑去。"
+
+
+def warm_up(advisor):
+    advisor.generate_suggestions(WARMUP_SENTENCE, topic=WARMUP_TOPIC)
+    advisor.calculate_score(WARMUP_SENTENCE, topic=WARMUP_TOPIC)
+
+
+def preload():
+    """主進程預先載入：初始化資料庫，建立建議生成器並預熱，之後關閉SQLite連線（連線不能跨 fork）
+
+    回傳（Flask 應用, 建議生成器）；工作進程 fork 後重新開啟連線，已載入的快照直接沿用。
+    """
+    import db_init
+    from app import app, get_advisor
+    from storage_router import StorageRouter
+
+    db_init.init_database(StorageRouter.from_env().shared_path)
+    advisor = get_advisor()
+    warm_up(advisor)
+    advisor.close()
+    return app, advisor
+
+
+class _WorkerServer(WSGIServer):
+    """在繼承來的監聽socket上服務，以固定大小的執行緒池處理請求
+
+    接受連線前先取得一個執行緒名額：執行緒都在忙時不接新連線，留給其他工作進程。
+    """
+
+    def __init__(self, listener, app, threads):
+        super().__init__(listener.getsockname()[:2], WSGIRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener
+        self.server_name, self.server_port = listener.getsockname()[:2]
+        self.setup_environ()
+        self.set_app(app)
+        self._slots = threading.BoundedSemaphore(threads)
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix="request")
+
+    def get_request(self):
+        self._slots.acquire()
+        try:
+            request, client_address = self.socket.accept()
+        except OSError:
+            # 同一個連線被其他工作進程先接走了
+            self._slots.release()
+            raise
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def drain(self):
+        """等待進行中的請求完成"""
+        self._pool.shutdown(wait=True)
+
+
+class PreforkServer:
+    """主進程預先載入後 fork 出多個工作進程，共用同一個監聽socket
+
+    分詞詞典、錯字模型、規則快照與範例句索引只在主進程載入一次，工作進程以寫入時複製共用，
+    第一個請求就是熱的。SIGHUP：逐一輪替工作進程（新的就緒後才停掉舊的，服務不中斷）；
+    SIGTERM/SIGINT：停止接收新連線，等進行中的請求完成後結束。
+    """
+
+    def __init__(self, app, advisor, host="0.0.0.0", port=5000, workers=2, threads=DEFAULT_THREADS,
+                 graceful_timeout=GRACEFUL_TIMEOUT):
+        self.app = app
+        self.advisor = advisor
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.workers = set()
+        self._signals = []
+        self.listener = None
+
+    def run(self):
+        self.listener = socket.create_server((self.host, self.port), backlog=128)
+        # 多個工作進程同時被喚醒時只有一個接得到連線，其餘不可卡在 accept
+        self.listener.setblocking(False)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        signal.set_wakeup_fd(self._wakeup_w)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+        # 預先載入的物件移出垃圾回收的追蹤範圍，避免工作進程的GC寫入這些頁面而複製
+        gc.freeze()
+        try:
+            for _ in range(self.worker_count):
+                if self._spawn() is None:
+                    raise RuntimeError("工作進程無法就緒")
+            print(f"✅ 伺服器已啟動：{self.host}:{self.port}（{self.worker_count} 個工作進程 × {self.threads} 個執行緒）",
+                  flush=True)
+            self._loop()
+        finally:
+            self._stop(list(self.workers))
+            self.listener.close()
+            signal.set_wakeup_fd(-1)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _loop(self):
+        while True:
+            select.select([self._wakeup_r], [], [], 1.0)
+            try:
+                while os.read(self._wakeup_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
+            self._reap()
+            signals, self._signals = self._signals, []
+            if signal.SIGTERM in signals or signal.SIGINT in signals:
+                print("🛑 正在關閉伺服器...", flush=True)
+                return
+            if signal.SIGHUP in signals:
+                self.rolling_restart()
+            while len(self.workers) < self.worker_count:
+                if self._spawn() is None:
+                    break
+
+    def _reap(self):
+        """回收意外結束的工作進程（主迴圈會補上新的）"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.workers:
+                self.workers.discard(pid)
+                print(f"⚠️ 工作進程 {pid} 意外結束（{os.waitstatus_to_exitcode(status)}），重新啟動", flush=True)
+
+    def _spawn(self):
+        """fork 一個工作進程並等待它回報就緒；失敗時回傳None"""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                self._run_worker(ready_w)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        os.close(ready_w)
+        try:
+            ready = select.select([ready_r], [], [], READY_TIMEOUT)[0] and os.read(ready_r, 1)
+        finally:
+            os.close(ready_r)
+        if not ready:
+            self._kill(pid)
+            print(f"❌ 工作進程 {pid} 未能就緒", flush=True)
+            return None
+        self.workers.add(pid)
+        return pid
+
+    def _run_worker(self, ready_fd):
+        signal.set_wakeup_fd(-1)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        for signum in (signal.SIGHUP, signal.SIGINT):
+            signal.signal(signum, signal.SIG_IGN)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        # fork 後各工作進程的亂數狀態相同，重新播種讓建議的排列各自不同
+        random.seed()
+        self.advisor.reconnect()
+        server = _WorkerServer(self.listener, self.app, self.threads)
+        # shutdown 會等服務迴圈結束，不能在服務迴圈所在的主執行緒呼叫
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown,
+                                                                             daemon=True).start())
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+        server.serve_forever(poll_interval=0.5)
+        server.drain()
+
+    def rolling_restart(self):
+        """逐一以新的工作進程取代舊的；新進程沒有就緒時保留舊進程"""
+        self._refresh()
+        for old in list(self.workers):
+            if self._spawn() is None:
+                print("❌ 新的工作進程無法就緒，保留其餘舊的工作進程", flush=True)
+                return
+            self.workers.discard(old)
+            self._stop([old])
+        print(f"🔄 已輪替所有工作進程：{sorted(self.workers)}", flush=True)
+
+    def _refresh(self):
+        """更新主進程的快照（規則或範例句有變更時），新的工作進程 fork 後就不必各自重新載入"""
+        try:
+            self.advisor.reconnect()
+            warm_up(self.advisor)
+        except Exception as e:
+            print(f"⚠️ 更新快照失敗，沿用目前的快照：{e}", flush=True)
+        finally:
+            self.advisor.close()
+        gc.freeze()
+
+    def _stop(self, pids):
+        """通知工作進程結束，等進行中的請求完成；逾時強制結束"""
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0]:
+                        remaining.discard(pid)
+                except ChildProcessError:
+                    remaining.discard(pid)
+            time.sleep(0.05)
+        for pid in remaining:
+            self._kill(pid)
+        self.workers.difference_update(pids)
+
+    def _kill(self, pid):
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+
+def default_workers():
+    return int(os.environ.get(WORKERS_ENV) or os.cpu_count() or 1)
+
+
+def default_threads():
+    return int(os.environ.get(THREADS_ENV) or DEFAULT_THREADS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Web API 伺服器（預先載入後 fork 多個工作進程，不需要圖形介面）")
+    parser.add_argument("--host", default="0.0.0.0", help="監聽位址")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)), help="監聽埠號")
+    parser.add_argument("--workers", type=int, default=default_workers(), help=f"工作進程數（環境變數 {WORKERS_ENV}）")
+    parser.add_argument("--threads", type=int, default=default_threads(), help=f"每個工作進程的執行緒數（環境變數 {THREADS_ENV}）")
+    parser.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT, help="等待進行中請求完成的秒數")
+    args = parser.parse_args()
+
+    app, advisor = preload()
+    PreforkServer(app, advisor, args.host, args.port, max(1, args.workers), max(1, args.threads),
+                  args.graceful_timeout).run()
@@ -0,0 +1,138 @@
+import argparse
+import gzip
+import json
+import os
+import time
+
+# 設定此環境變數（目錄）即開啟打字記錄，預設不記錄
+TRACE_DIR_ENV = "WRITING_SESSION_TRACE_DIR"
+
+# 事件類型：開始練習、觸發檢查的編輯、暫停訊號時的編輯（如採納建議）
+EVENT_START = "s"
+EVENT_EDIT = "e"
+EVENT_QUIET_EDIT = "q"
+EVENT_ADOPT = "a"
+
+
+class SessionRecorder:
+    """記錄作文編輯器的打字事件，供負載測試重播
+
+    每行一筆JSON陣列 [距上一事件毫秒數, 類型, ...]，以gzip壓縮：
+    - ["s", meta]：開始練習（題目、年級）
+    - ["e", 位置, 刪除字數, 新增文字]：一般編輯（會觸發句子檢查）
+    - ["q", 位置, 刪除字數, 新增文字]：訊號暫停時的編輯（不觸發檢查）
+    - ["a", 句子]：採納建議，之後以採納的句子作為上一句
+    """
+
+    def __init__(self, path, meta=None):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._last = time.monotonic()
+        self._write(EVENT_START, meta or {})
+
+    @classmethod
+    def from_env(cls, session_id, meta=None):
+        """有設定記錄目錄時建立記錄器，否則回傳None"""
+        directory = os.environ.get(TRACE_DIR_ENV)
+        if not directory:
+            return None
+        return cls(os.path.join(directory, session_id + ".trace.gz"), meta)
+
+    def _write(self, kind, *fields):
+        now = time.monotonic()
+        delta_ms = int((now - self._last) * 1000)
+        self._last = now
+        self._file.write(json.dumps([delta_ms, kind, *fields], ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def record_edit(self, position, removed, added, quiet=False):
+        self._write(EVENT_QUIET_EDIT if quiet else EVENT_EDIT, position, removed, added)
+
+    def record_adopt(self, sentence):
+        self._write(EVENT_ADOPT, sentence)
+
+    def close(self):
+        self._file.close()
+
+
+def load_trace(path):
+    """逐筆產生記錄檔中的事件（延遲毫秒, 類型, 欄位）"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                delta_ms, kind, *fields = json.loads(line)
+                yield delta_ms, kind, fields
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def replay_trace(path, advisor, speed=None, grade="3-6年級"):
+    """以無介面方式重播打字記錄，逐事件量測建議生成的延遲
+
+    speed=None 時不等待、全速重播；speed=1 為真實速度，speed=10 為十倍速。
+    每個一般編輯事件都走與編輯器相同的 check_finished_sentence 流程（含逐句分析狀態）。
+    """
+    text = ""
+    prev_sentence = ""
+    session = advisor.new_session()
+    latencies = []
+    triggered = []
+    started = time.perf_counter()
+    for delta_ms, kind, fields in load_trace(path):
+        if speed:
+            time.sleep(delta_ms / 1000 / speed)
+        if kind == EVENT_START:
+            text, prev_sentence = "", ""
+            session.reset()
+            grade = fields[0].get("advisor_grade", grade)
+            continue
+        if kind == EVENT_ADOPT:
+            prev_sentence = fields[0]
+            session.replace_last(prev_sentence)
+            continue
+        position, removed, added = fields
+        text = text[:position] + added + text[position + removed:]
+        if kind == EVENT_QUIET_EDIT:
+            continue
+        t0 = time.perf_counter()
+        result = advisor.check_finished_sentence(text, prev_sentence, grade, session)
+        elapsed = (time.perf_counter() - t0) * 1000
+        latencies.append(elapsed)
+        if result is not None:
+            prev_sentence = result[2]
+            triggered.append(elapsed)
+    latencies.sort()
+    triggered.sort()
+    return {
+        "events": len(latencies),
+        "suggestion_events": len(triggered),
+        "wall_time_s": time.perf_counter() - started,
+        "all_ms": {"p50": _percentile(latencies, 0.5), "p95": _percentile(latencies, 0.95),
+                   "p99": _percentile(latencies, 0.99), "max": latencies[-1] if latencies else 0.0},
+        "suggestion_ms": {"p50": _percentile(triggered, 0.5), "p95": _percentile(triggered, 0.95),
+                          "p99": _percentile(triggered, 0.99), "max": triggered[-1] if triggered else 0.0},
+        "final_text": text,
+    }
+
+
+if __name__ == "__main__":
+    from writing_advisor import WritingAdvisor
+
+    parser = argparse.ArgumentParser(description="重播作文打字記錄並量測建議延遲")
+    parser.add_argument("traces", nargs="+", help="記錄檔（.trace.gz）")
+    parser.add_argument("--speed", type=float, default=None, help="重播倍速（預設不等待，全速重播）")
+    args = parser.parse_args()
+
+    advisor = WritingAdvisor()
+    for trace in args.traces:
+        report = replay_trace(trace, advisor, speed=args.speed)
+        print(f"📼 {trace}")
+        print(f"   事件數：{report['events']}（觸發建議 {report['suggestion_events']} 次），耗時 {report['wall_time_s']:.2f} 秒")
+        for label, key in (("所有事件", "all_ms"), ("觸發建議", "suggestion_ms")):
+            stats = report[key]
+            print(f"   {label}延遲(ms)：p50={stats['p50']:.2f} p95={stats['p95']:.2f} p99={stats['p99']:.2f} max={stats['max']:.2f}")
+    advisor.close()
@@ -0,0 +1,261 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import zlib
+from functools import cached_property
+
+import db_init
+
+# 共用詞典檔路徑（設定後各工作進程直接映射此檔，不再各自載入jieba詞典）
+LEXICON_ENV = "WRITING_LEXICON_PATH"
+DEFAULT_LEXICON_PATH = "shared_lexicon.bin"
+
+MAGIC = b"WLEX\x00\x01\x00\x00"
+_SECTION = struct.Struct("<16sQQ")
+_TABLE_HEADER = struct.Struct("<II")
+_ENTRY_HEADER = struct.Struct("<HI")
+
+
+# ------------------------------ 唯讀雜湊表（映射檔格式） ------------------------------
+def pack_hash_table(items):
+    """把（詞彙, 數值）打包成開放定址雜湊表：表頭 + 槽位陣列 + 詞條區
+
+    槽位存放詞條在詞條區的位移+1（0表示空槽），以crc32定位、線性探測，
+    讀取時不需反序列化，直接在映射記憶體上查詢。
+    """
+    items = [(key.encode("utf-8"), value) for key, value in items]
+    n_slots = 1
+    while n_slots < len(items) * 2:
+        n_slots <<= 1
+    mask = n_slots - 1
+    slots = [0] * n_slots
+    entries = bytearray()
+    for key, value in items:
+        index = zlib.crc32(key) & mask
+        while slots[index]:
+            index = (index + 1) & mask
+        slots[index] = len(entries) + 1
+        entries += _ENTRY_HEADER.pack(len(key), value) + key
+    return _TABLE_HEADER.pack(n_slots, len(items)) + struct.pack(f"<{n_slots}I", *slots) + bytes(entries)
+
+
+class MappedTable:
+    """映射檔中的唯讀雜湊表，提供類似dict的查詢介面"""
+
+    def __init__(self, buffer, offset):
+        self._buffer = buffer
+        n_slots, self._count = _TABLE_HEADER.unpack_from(buffer, offset)
+        slots_offset = offset + _TABLE_HEADER.size
+        self._mask = n_slots - 1
+        self._view = memoryview(buffer)[slots_offset:slots_offset + n_slots * 4]
+        self._slots = self._view.cast("I")
+        self._entries_offset = slots_offset + n_slots * 4
+
+    def _lookup(self, key):
+        key_bytes = key.encode("utf-8")
+        index = zlib.crc32(key_bytes) & self._mask
+        slots = self._slots
+        buffer = self._buffer
+        while True:
+            slot = slots[index]
+            if not slot:
+                return None
+            position = self._entries_offset + slot - 1
+            key_len, value = _ENTRY_HEADER.unpack_from(buffer, position)
+            start = position + _ENTRY_HEADER.size
+            if key_len == len(key_bytes) and buffer[start:start + key_len] == key_bytes:
+                return value
+            index = (index + 1) & self._mask
+
+    def release(self):
+        """釋放對映射記憶體的參照，之後才能關閉映射"""
+        self._slots.release()
+        self._view.release()
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        position = self._entries_offset
+        for _ in range(self._count):
+            key_len, value = _ENTRY_HEADER.unpack_from(self._buffer, position)
+            start = position + _ENTRY_HEADER.size
+            yield self._buffer[start:start + key_len].decode("utf-8"), value
+            position = start + key_len
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+
+class OverlayFreq:
+    """jieba詞頻介面：共用的唯讀詞典 + 本進程自行新增的詞（add_word / load_userdict）"""
+
+    def __init__(self, table):
+        self.table = table
+        self.local = {}
+
+    def get(self, key, default=None):
+        if key in self.local:
+            return self.local[key]
+        return self.table.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.local or key in self.table
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+        return self.table[key]
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+
+    def __len__(self):
+        return len(self.table) + len(self.local)
+
+
+# ------------------------------ 分段映射檔 ------------------------------
+def write_sections(output_path, magic, sections):
+    """寫出分段檔：魔數 + 段數 + 段落目錄（名稱, 位移, 長度）+ 各段資料
+
+    先寫暫存檔再替換：正在映射舊檔的進程不受影響。
+    """
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(pack_sections(magic, sections))
+    os.replace(tmp_path, output_path)
+
+
+def pack_sections(magic, sections):
+    """與 write_sections 相同格式，但直接回傳位元組（不落地的小型資料檔）"""
+    position = len(magic) + 4 + _SECTION.size * len(sections)
+    header = bytearray(magic + struct.pack("<I", len(sections)))
+    for name, data in sections:
+        header += _SECTION.pack(name.encode("ascii"), position, len(data))
+        position += len(data)
+    return bytes(header) + b"".join(data for _, data in sections)
+
+
+def read_sections(buffer, magic, path=""):
+    """讀取分段檔的目錄，回傳 名稱 →（位移, 長度）"""
+    if buffer[:len(magic)] != magic:
+        raise ValueError(f"檔案格式不符：{path}")
+    (section_count,) = struct.unpack_from("<I", buffer, len(magic))
+    sections = {}
+    position = len(magic) + 4
+    for _ in range(section_count):
+        name, offset, length = _SECTION.unpack_from(buffer, position)
+        sections[name.rstrip(b"\x00").decode("ascii")] = (offset, length)
+        position += _SECTION.size
+    return sections
+
+
+def buffer_checksum(buffer):
+    """資料檔內容的雜湊（內容不同就不同，不受檔名、修改時間或筆數相同影響）"""
+    return hashlib.sha256(buffer).hexdigest()
+
+
+# ------------------------------ 共用詞典檔 ------------------------------
+class SharedLexicon:
+    """以mmap映射的共用詞典檔：jieba前綴詞典、資源詞庫、詞彙成分對照表
+
+    檔案以唯讀方式映射，所有工作進程共用同一份作業系統頁面快取。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._sections = read_sections(self._mmap, MAGIC, path)
+        offset, length = self._sections["meta"]
+        self.meta = json.loads(self._mmap[offset:offset + length].decode("utf-8"))
+        self.total = self.meta["total"]
+        self.freq = MappedTable(self._mmap, self._sections["freq"][0])
+        self.word_flags = MappedTable(self._mmap, self._sections["flags"][0])
+
+    @cached_property
+    def checksum(self):
+        return buffer_checksum(self._mmap)
+
+    def resources(self):
+        """取得資源詞庫（與資料庫載入的格式相同）"""
+        return {res_type: list(words) for res_type, words in self.meta["resources"].items()}
+
+    def install_into_jieba(self, tokenizer=None):
+        """讓jieba直接使用映射的前綴詞典，跳過詞典解析與快取載入"""
+        import jieba
+        tokenizer = tokenizer or jieba.dt
+        if isinstance(tokenizer.FREQ, OverlayFreq) and tokenizer.FREQ.table is self.freq:
+            return
+        with tokenizer.lock:
+            tokenizer.FREQ = OverlayFreq(self.freq)
+            tokenizer.total = self.total
+            tokenizer.initialized = True
+
+    def close(self):
+        self.freq.release()
+        self.word_flags.release()
+        self._mmap.close()
+
+
+_opened = {}
+
+def open_shared_lexicon(path):
+    """開啟共用詞典檔（同一進程重複開啟時共用同一個映射）"""
+    path = os.path.abspath(path)
+    if path not in _opened:
+        _opened[path] = SharedLexicon(path)
+    return _opened[path]
+
+
+def build_shared_lexicon(output_path=DEFAULT_LEXICON_PATH, db_path=db_init.DB_PATH, dictionary=None):
+    """解析jieba詞典與資料庫資源，輸出共用詞典檔（部署時執行一次）"""
+    import jieba
+    from advisor_snapshot import read_rules_version
+    from writing_advisor import ANALYSIS_FLAGS, compile_word_flags, resources_from_rows
+
+    tokenizer = jieba.Tokenizer(dictionary or jieba.DEFAULT_DICT)
+    freq, total = jieba.Tokenizer.gen_pfdict(tokenizer.get_dict_file())
+
+    # 資源與其規則版本在同一個讀取交易中取得；載入時版本不符就改從資料庫讀取
+    conn = sqlite3.connect(db_path)
+    conn.execute("BEGIN")
+    config_version = read_rules_version(conn)
+    resources = resources_from_rows(conn.execute("SELECT res_type, content, grade_range FROM student_resources"))
+    conn.close()
+
+    meta = {"total": total, "resources": resources, "flags": ANALYSIS_FLAGS, "config_version": config_version}
+    sections = [
+        ("meta", json.dumps(meta, ensure_ascii=False).encode("utf-8")),
+        ("freq", pack_hash_table(freq.items())),
+        ("flags", pack_hash_table(compile_word_flags(resources).items())),
+    ]
+    write_sections(output_path, MAGIC, sections)
+    print(f"✅ 共用詞典檔已建立：{output_path}（{len(freq)} 個詞條）")
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="建立多進程共用的詞典映射檔")
+    parser.add_argument("--output", default=DEFAULT_LEXICON_PATH, help="輸出檔案路徑")
+    parser.add_argument("--db", default=db_init.DB_PATH, help="資源所在的資料庫")
+    parser.add_argument("--dict", default=None, help="jieba詞典檔（預設為內建詞典）")
+    args = parser.parse_args()
+    build_shared_lexicon(args.output, args.db, args.dict)
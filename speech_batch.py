@@ -0,0 +1,220 @@
+import argparse
+import importlib
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from writing_advisor import insert_practice_record
+
+# 語音辨識器：google（需要 SpeechRecognition 與網路）、sidecar（讀取同名 .txt，離線測試用）或「模組:工廠函式」
+RECOGNIZER_ENV = "WRITING_RECOGNIZER"
+DEFAULT_RECOGNIZER = "google"
+LANGUAGE = "zh-TW"
+
+SPEECH_MODE = "講話轉寫模式"
+SPEECH_TOPIC = "口語轉書面語練習"
+# 每個辨識進程最多預先排入幾個檔案（其餘等有空位再送出，中斷時不會丟失太多進度）
+QUEUE_PER_WORKER = 2
+
+Transcript = namedtuple("Transcript", ["key", "path", "text", "error"])
+Transcript.__doc__ = """一個錄音檔的辨識結果（text 為 None 時 error 說明失敗原因）"""
+
+
+class GoogleRecognizer:
+    """以 SpeechRecognition 讀取 WAV 檔並送 Google 語音辨識（與麥克風輸入相同）"""
+
+    def __init__(self, language=LANGUAGE):
+        import speech_recognition as sr
+
+        self._sr = sr
+        self.language = language
+        self.recognizer = sr.Recognizer()
+
+    def __call__(self, path):
+        with self._sr.AudioFile(path) as source:
+            audio = self.recognizer.record(source)
+        try:
+            return self.recognizer.recognize_google(audio, language=self.language)
+        except self._sr.UnknownValueError:
+            return ""
+
+
+class SidecarRecognizer:
+    """讀取錄音檔旁同名的 .txt 當作辨識結果（離線測試或已有人工逐字稿時使用）"""
+
+    def __call__(self, path):
+        with open(os.path.splitext(path)[0] + ".txt", encoding="utf-8") as f:
+            return f.read().strip()
+
+
+RECOGNIZERS = {"google": GoogleRecognizer, "sidecar": SidecarRecognizer}
+
+
+def make_recognizer(spec=None):
+    """依名稱建立辨識器；「模組:名稱」形式則匯入該工廠函式或類別並呼叫（回傳 path → 文字 的可呼叫物件）"""
+    spec = spec or os.environ.get(RECOGNIZER_ENV) or DEFAULT_RECOGNIZER
+    if spec in RECOGNIZERS:
+        return RECOGNIZERS[spec]()
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(f"未知的語音辨識器：{spec}（可用 {sorted(RECOGNIZERS)} 或「模組:名稱」）")
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+def install_batch_progress(cursor):
+    """記錄已轉寫的錄音檔（與練習記錄同一分庫、同一交易寫入，中斷後重新執行會略過）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS speech_batch_files (
+        file_key TEXT PRIMARY KEY,
+        record_id INTEGER NOT NULL,
+        processed_time DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def list_recordings(directory):
+    """列出目錄（含子目錄）中的 WAV 檔，回傳（檔案鍵, 路徑）；檔案鍵含大小與修改時間，檔案被替換後會重新轉寫"""
+    recordings = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(".wav"):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                relative = os.path.relpath(path, directory).replace(os.sep, "/")
+                recordings.append((f"{relative}:{stat.st_size}:{stat.st_mtime_ns}", path))
+    return sorted(recordings)
+
+
+def student_id_for(path):
+    """錄音檔名（不含副檔名）即學生編號"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+_recognizer = None
+
+
+def _init_worker(spec):
+    global _recognizer
+    _recognizer = make_recognizer(spec)
+
+
+def _transcribe(key, path):
+    try:
+        text = _recognizer(path).strip()
+    except Exception as e:
+        return Transcript(key, path, None, f"{type(e).__name__}: {e}")
+    if not text:
+        return Transcript(key, path, None, "無法辨識語音")
+    return Transcript(key, path, text, None)
+
+
+def transcribe_directory(advisor, directory, recognizer=None, workers=None, grade="3-6年級",
+                         school_id="", class_id="", limit=None, progress=None):
+    """以多個進程平行辨識目錄中的錄音檔，轉成書面語、產生建議並評分，逐筆寫入練習記錄
+
+    辨識（最慢的部分）在進程池中進行；分詞、建議與評分在本進程，寫入交給建議生成器的寫入執行緒，
+    每完成一個檔案就提交一次（建議文字第一行為書面語版本，之後每行一則建議），
+    中斷後重新執行只處理尚未完成的檔案。progress(完成數, 待處理數, 路徑, 錯誤) 在每個檔案結束時呼叫。
+    回傳 {"processed": 成功數, "skipped": 先前已完成數, "failed": {路徑: 錯誤}}。
+    """
+    # 進度與練習記錄都由建議生成器唯一的寫入執行緒讀寫
+    done = advisor.write_records(_load_progress, school_id=school_id, class_id=class_id)
+    recordings = list_recordings(directory)
+    pending = [(key, path) for key, path in recordings if key not in done]
+    if limit is not None:
+        pending = pending[:limit]
+    result = {"processed": 0, "skipped": sum(key in done for key, _ in recordings), "failed": {}}
+    if not pending:
+        return result
+
+    workers = workers or os.cpu_count() or 1
+    queue = iter(pending)
+    finished = 0
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(recognizer,)) as pool:
+        running = set()
+        try:
+            while True:
+                while len(running) < workers * QUEUE_PER_WORKER:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    running.add(pool.submit(_transcribe, *item))
+                if not running:
+                    break
+                completed, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    transcript = future.result()
+                    if transcript.text is None:
+                        result["failed"][transcript.path] = transcript.error
+                    else:
+                        _save_transcript(advisor, transcript, grade, school_id, class_id)
+                        result["processed"] += 1
+                    finished += 1
+                    if progress is not None:
+                        progress(finished, len(pending), transcript.path, transcript.error)
+        except BaseException:
+            # 中斷時不再等排隊中的檔案，已提交的結果保留，下次從未完成的檔案繼續
+            for future in running:
+                future.cancel()
+            raise
+    return result
+
+
+def _load_progress(conn, codec):
+    install_batch_progress(conn.cursor())
+    conn.commit()
+    return {key for (key,) in conn.execute("SELECT file_key FROM speech_batch_files")}
+
+
+def suggested_text_for(formal_text, suggestions):
+    """儲存的建議文字：第一行為書面語版本，之後每行一則優化建議"""
+    return "\n".join([formal_text] + [suggestion for suggestion in suggestions
+                                       if not suggestion.startswith("書面語優化：")])
+
+
+def _save_transcript(advisor, transcript, grade, school_id, class_id):
+    """分析與評分在呼叫端執行，寫入（練習記錄與進度同一個交易）交給寫入執行緒"""
+    formal_text, suggestions = advisor.speech_suggestions(transcript.text, grade=grade)
+    total_score, scores = advisor.calculate_score(formal_text)
+    suggested_text = suggested_text_for(formal_text, suggestions)
+
+    def insert(conn, codec):
+        cursor = conn.cursor()
+        record_id = insert_practice_record(cursor, codec, student_id_for(transcript.path), school_id, class_id,
+                                           SPEECH_MODE, SPEECH_TOPIC, transcript.text, suggested_text, total_score,
+                                           detail_scores=scores)
+        cursor.execute("INSERT INTO speech_batch_files (file_key, record_id) VALUES (?, ?)",
+                       (transcript.key, record_id))
+        conn.commit()
+        return record_id
+
+    return advisor.write_records(insert, school_id=school_id, class_id=class_id)
+
+
+if __name__ == "__main__":
+    from writing_advisor import WritingAdvisor
+
+    parser = argparse.ArgumentParser(description="批次轉寫錄音作業：平行辨識 WAV 檔，轉成書面語並評分後寫入練習記錄")
+    parser.add_argument("directory", help="錄音檔目錄（檔名即學生編號，如 S001.wav）")
+    parser.add_argument("--recognizer", default=None,
+                        help=f"語音辨識器：{'/'.join(RECOGNIZERS)} 或「模組:名稱」（預設 {DEFAULT_RECOGNIZER}，環境變數 {RECOGNIZER_ENV}）")
+    parser.add_argument("--workers", type=int, default=None, help="辨識進程數（預設為CPU核心數）")
+    parser.add_argument("--grade", default="3-6年級", help="建議適用年級")
+    parser.add_argument("--school", default="", help="學校代碼")
+    parser.add_argument("--class", dest="class_id", default="", help="班級代碼")
+    parser.add_argument("--limit", type=int, default=None, help="本次最多處理幾個檔案")
+    args = parser.parse_args()
+
+    def report(finished, total, path, error):
+        print(f"{'❌' if error else '✅'} [{finished}/{total}] {os.path.basename(path)}" + (f"：{error}" if error else ""))
+
+    advisor = WritingAdvisor()
+    try:
+        result = transcribe_directory(advisor, args.directory, args.recognizer, args.workers, args.grade,
+                                      args.school, args.class_id, args.limit, report)
+    except KeyboardInterrupt:
+        print("\n⏸️ 已中斷，已完成的檔案已儲存，重新執行會從未完成的檔案繼續")
+    else:
+        print(f"📋 完成 {result['processed']} 個，略過先前已完成 {result['skipped']} 個，失敗 {len(result['failed'])} 個")
+    finally:
+        advisor.close()
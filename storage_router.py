@@ -0,0 +1,182 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+
+import db_init
+
+# 分庫設定檔路徑（JSON），未設定時所有資料放在單一資料庫
+CONFIG_ENV = "WRITING_STORAGE_CONFIG"
+
+SHARD_BY_OPTIONS = ("school", "class")
+
+
+class StorageRouter:
+    """儲存路由：規則與資源放在共用庫，練習記錄依學校或班級分散到各分庫檔案
+
+    設定檔格式：
+    {"shared_db": "student_writing.db", "shard_dir": "shards", "shard_by": "school"}
+    未設定 shard_dir 時不分庫，練習記錄與規則同放在共用庫（單機版預設行為）。
+    """
+
+    def __init__(self, shared_db=db_init.DB_PATH, shard_dir=None, shard_by="school"):
+        if shard_by not in SHARD_BY_OPTIONS:
+            raise ValueError(f"shard_by 只能是 {SHARD_BY_OPTIONS}，收到：{shard_by}")
+        self.shared_path = shared_db
+        self.shard_dir = shard_dir
+        self.shard_by = shard_by
+        self._connections = {}
+        if self.sharded:
+            os.makedirs(self.shard_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, path):
+        """從JSON設定檔建立路由"""
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(
+            shared_db=config.get("shared_db", db_init.DB_PATH),
+            shard_dir=config.get("shard_dir"),
+            shard_by=config.get("shard_by", "school"),
+        )
+
+    @classmethod
+    def from_env(cls):
+        """依環境變數載入設定；未設定時回傳單一資料庫路由"""
+        path = os.environ.get(CONFIG_ENV)
+        return cls.from_config(path) if path else cls()
+
+    def clone(self):
+        """以相同設定建立新的路由（連線各自開啟，給另一個執行緒使用）"""
+        return StorageRouter(self.shared_path, self.shard_dir, self.shard_by)
+
+    @property
+    def sharded(self):
+        return bool(self.shard_dir)
+
+    # ------------------------------ 共用庫（規則/資源） ------------------------------
+    def connect_shared(self, read_only=None, check_same_thread=True):
+        """開啟共用庫連線；分庫模式下預設唯讀，避免與各校寫入互相影響"""
+        if read_only is None:
+            read_only = self.sharded
+        if read_only:
+            uri = "file:" + os.path.abspath(self.shared_path) + "?mode=ro"
+            return sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+        return sqlite3.connect(self.shared_path, check_same_thread=check_same_thread)
+
+    # ------------------------------ 分庫（練習記錄） ------------------------------
+    def shard_key(self, school_id="", class_id=""):
+        """依設定計算分庫鍵；班級分庫時以「學校_班級」避免不同學校班級名稱重複
+
+        名稱中不能放進檔名的字元換成底線，再加上原始名稱雜湊的前 8 碼，
+        換字後相同的名稱（如「三年 1班」與「三年_1班」）不會寫進同一個分庫。
+        """
+        if not self.sharded:
+            return None
+        raw = school_id if self.shard_by == "school" else f"{school_id}\0{class_id}"
+        key = school_id if self.shard_by == "school" else f"{school_id}_{class_id}"
+        key = re.sub(r"[^\w-]", "_", key).strip("_") or "default"
+        return f"{key}_{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:8]}"
+
+    def shard_path(self, key):
+        """分庫鍵對應的資料庫檔案"""
+        if key is None:
+            return self.shared_path
+        return os.path.join(self.shard_dir, f"records_{key}.db")
+
+    def _open_records_db(self, path):
+        conn = sqlite3.connect(path)
+        if self.sharded:
+            # WAL模式讓讀取不阻擋寫入，各分庫各自擁有寫入鎖
+            conn.execute("PRAGMA journal_mode=WAL")
+        db_init.create_practice_tables(conn.cursor())
+        conn.commit()
+        return conn
+
+    def records_connection(self, school_id="", class_id=""):
+        """取得練習記錄所在分庫的連線（同一分庫重複使用連線）"""
+        return self.connection_for_path(self.shard_path(self.shard_key(school_id, class_id)))
+
+    def connection_for_path(self, path):
+        """取得指定練習記錄庫檔案的寫入連線"""
+        conn = self._connections.get(path)
+        if conn is None:
+            conn = self._open_records_db(path)
+            self._connections[path] = conn
+        return conn
+
+    def shard_paths(self):
+        """列出所有現存的練習記錄庫檔案"""
+        if not self.sharded:
+            return [self.shared_path]
+        return sorted(glob.glob(os.path.join(self.shard_dir, "records_*.db")))
+
+    def iter_shards(self):
+        """逐一產生（分庫鍵, 唯讀連線），供跨分庫查詢使用"""
+        for path in self.shard_paths():
+            key = None
+            if self.sharded:
+                key = os.path.basename(path)[len("records_"):-len(".db")]
+            conn = sqlite3.connect("file:" + os.path.abspath(path) + "?mode=ro", uri=True)
+            try:
+                yield key, conn
+            finally:
+                conn.close()
+
+    def migrate_shards(self):
+        """把舊版檔名（沒有雜湊）的分庫改成目前的檔名，回傳（舊路徑, 新路徑）清單
+
+        依分庫內記錄的學校/班級計算應有的檔名；記錄分屬多個分庫鍵（舊版檔名相撞）
+        或目標檔案已存在時不動，留待人工處理。執行期間不可有其他程式寫入分庫。
+        """
+        moved = []
+        for path in self.shard_paths() if self.sharded else []:
+            conn = sqlite3.connect(path)
+            try:
+                keys = {self.shard_key(school_id or "", class_id or "") for school_id, class_id in
+                        conn.execute("SELECT DISTINCT school_id, class_id FROM practice_records")}
+                # 併回 WAL，改名時只需搬主檔
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+            if len(keys) != 1:
+                continue
+            target = self.shard_path(keys.pop())
+            if os.path.abspath(target) == os.path.abspath(path) or os.path.exists(target):
+                continue
+            cached = self._connections.pop(path, None)
+            if cached is not None:
+                cached.close()
+            os.rename(path, target)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            moved.append((path, target))
+        return moved
+
+    def query_all(self, sql, params=()):
+        """在所有分庫執行同一查詢，逐列產生（分庫鍵, 資料列），供區域報表彙整"""
+        for key, conn in self.iter_shards():
+            for row in conn.execute(sql, params):
+                yield key, row
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分庫維護工具")
+    parser.add_argument("--migrate", action="store_true", help="把舊版檔名（沒有雜湊）的分庫改成目前的檔名")
+    args = parser.parse_args()
+    if args.migrate:
+        router = StorageRouter.from_env()
+        for old, new in router.migrate_shards():
+            print(f"✅ {old} → {new}")
+        router.close()
+    else:
+        parser.print_help()
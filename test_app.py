@@ -8,6 +8,7 @@ import os
 import sys
 import sqlite3
 import subprocess
+import tempfile
 import time
 
 def test_database():
@@ -117,6 +118,1400 @@ def test_writing_advisor():
         import traceback
         traceback.print_exc()
 
+def test_storage_router():
+    """測試練習記錄分庫與跨分庫查詢"""
+    print("\n🔍 正在測試分庫儲存...")
+
+    import db_init
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        shared_db = os.path.join(tmp, "shared.db")
+        db_init.init_database(shared_db)
+        router = StorageRouter(shared_db=shared_db, shard_dir=os.path.join(tmp, "shards"), shard_by="school")
+        advisor = WritingAdvisor(router)
+        advisor.save_practice_record("作文模式", "我的寵物", "我有一隻小狗。", "", 80, school_id="光明國小")
+        advisor.save_practice_record("作文模式", "我的學校", "學校很漂亮。", "", 70, school_id="仁愛國小")
+        advisor.save_practice_record("造句模式", "關鍵詞「開心」", "我很開心。", "", 100, school_id="仁愛國小")
+        advisor.close()
+
+        assert len(router.shard_paths()) == 2
+        counts = {}
+        for key, (count,) in router.query_all("SELECT COUNT(*) FROM practice_records"):
+            counts[key] = count
+        assert counts == {router.shard_key("光明國小"): 1, router.shard_key("仁愛國小"): 2}
+        assert router.shard_key("光明國小").startswith("光明國小_")
+
+        # 換成檔名字元後相同的班級名稱仍寫進不同分庫
+        by_class = StorageRouter(shared_db=shared_db, shard_dir=os.path.join(tmp, "classes"), shard_by="class")
+        names = ("三年1班", "三年-1班", "三年 1班", "三年_1班")
+        assert len({by_class.shard_key("光明國小", name) for name in names}) == len(names)
+        assert by_class.shard_key("a_b", "c") != by_class.shard_key("a", "b_c")
+
+        # 舊版檔名的分庫改名後沿用
+        legacy_path = os.path.join(by_class.shard_dir, "records_光明國小_三年1班.db")
+        conn = by_class.connection_for_path(legacy_path)
+        conn.execute("INSERT INTO practice_records (school_id, class_id, practice_mode, topic, input_text) "
+                     "VALUES ('光明國小', '三年1班', '作文模式', '我的寵物', '舊分庫的作文。')")
+        conn.commit()
+        by_class.close()
+        assert by_class.migrate_shards() == [(legacy_path, by_class.shard_path(by_class.shard_key("光明國小", "三年1班")))]
+        assert [row for _, row in by_class.query_all("SELECT COUNT(*) FROM practice_records")] == [(1,)]
+        assert by_class.migrate_shards() == []
+        print(f"✅ 分庫寫入與跨分庫查詢成功：{counts}")
+
+def test_autosave_journal():
+    """測試自動儲存日誌的重播、壓縮與恢復"""
+    print("\n🔍 正在測試自動儲存日誌...")
+
+    from autosave_journal import AutosaveJournal, pending_sessions, restore_session
+
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = AutosaveJournal(meta={"mode": "作文模式", "topic": "我的寵物"}, directory=tmp, compact_every=4)
+        text = ""
+        for position, removed, added in [(0, 0, "我有"), (2, 0, "一隻狗"), (5, 0, "。"), (2, 0, "好"), (3, 3, "隻貓")]:
+            text = text[:position] + added + text[position + removed:]
+            journal.append(position, removed, added)
+            if journal.needs_compaction:
+                journal.compact(text)
+        journal.sync()  # 模擬當機：不呼叫 close()
+        assert restore_session(journal.session_id, tmp).text == text == "我有好隻貓。"
+        assert [s.text for s in pending_sessions(tmp)] == [text]
+
+        journal.mark_saved()
+        assert pending_sessions(tmp) == []
+        journal.close(discard=True)
+        assert os.listdir(tmp) == []
+        print("✅ 日誌重播與壓縮後恢復成功")
+
+def test_shared_lexicon():
+    """測試共用詞典映射檔的建立與查詢"""
+    print("\n🔍 正在測試共用詞典映射檔...")
+
+    import jieba
+    import db_init
+    from shared_lexicon import SharedLexicon, build_shared_lexicon
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "lexicon.db")
+        dict_path = os.path.join(tmp, "dict.txt")
+        with open(dict_path, "w", encoding="utf-8") as f:
+            f.write("動物園 500 n\n動物 800 n\n可愛 600 a\n小熊貓 200 n\n我們 900 r\n")
+        db_init.init_database(db_path)
+        lexicon_path = build_shared_lexicon(os.path.join(tmp, "lexicon.bin"), db_path, dict_path)
+
+        lexicon = SharedLexicon(lexicon_path)
+        assert lexicon.freq["動物園"] == 500 and "動物" in lexicon.freq and "熊貓" not in lexicon.freq
+        assert lexicon.resources()["比喻詞"][0] == "像" and "道理詞" in lexicon.resources()
+        assert lexicon.word_flags.get("動物園") == 1 << 5 and "小熊貓" not in lexicon.word_flags
+
+        tokenizer = jieba.Tokenizer(dict_path)
+        lexicon.install_into_jieba(tokenizer)
+        assert tokenizer.lcut("我們去動物園看小熊貓") == ["我們", "去", "動物園", "看", "小熊貓"]
+
+        # 重建詞典檔後內容雜湊不同（評分快取鍵隨之改變）
+        with open(dict_path, "a", encoding="utf-8") as f:
+            f.write("熊貓 300 n\n")
+        rebuilt = SharedLexicon(build_shared_lexicon(os.path.join(tmp, "rebuilt.bin"), db_path, dict_path))
+        assert rebuilt.checksum != lexicon.checksum
+        rebuilt.close()
+        lexicon.close()
+
+        # 建檔後資源有更新：詞典檔記錄的規則版本不符，建議生成器改從資料庫讀取資源
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO student_resources (res_type, content, grade_range) VALUES ('比喻詞', '恍若', '3-6年級')")
+        conn.commit()
+        conn.close()
+        saved_dictionary = jieba.dt.FREQ, jieba.dt.total, jieba.dt.initialized
+        try:
+            advisor = WritingAdvisor(StorageRouter(shared_db=db_path), lexicon_path=lexicon_path)
+            assert "恍若" in advisor.snapshot.resources["比喻詞"]
+            advisor.close()
+        finally:
+            jieba.dt.FREQ, jieba.dt.total, jieba.dt.initialized = saved_dictionary
+        print("✅ 共用詞典映射檔查詢與分詞成功")
+
+def test_score_rollups():
+    """測試分數彙總表隨練習記錄增量更新"""
+    print("\n🔍 正在測試分數彙總表...")
+
+    import db_init
+    from score_rollups import UNKNOWN_WEEK, get_rollup, get_student_progress, rebuild_rollups
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "rollups.db"))
+        cursor = conn.cursor()
+        db_init.create_practice_tables(cursor)
+        cursor.executemany('''
+        INSERT INTO practice_records (student_id, practice_mode, topic, input_text, score, practice_time)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            ("s1", "作文模式", "我的寵物", "第一篇", 80, "2026-10-12 10:00:00"),
+            ("s1", "作文模式", "我的寵物", "第二篇", 90, "2026-10-13 10:00:00"),
+            ("s1", "作文模式", "我的寵物", "第三篇", 70, "2026-10-20 10:00:00"),
+        ])
+        rollup = get_rollup(conn, "s1", "作文模式", "我的寵物", "2026-W41")
+        assert rollup["record_count"] == 2 and rollup["average_score"] == 85 and rollup["best_score"] == 90
+
+        cursor.execute("DELETE FROM practice_records WHERE score IN (90, 70)")
+        assert get_rollup(conn, "s1", "作文模式", "我的寵物", "2026-W41")["best_score"] == 80
+        assert get_rollup(conn, "s1", "作文模式", "我的寵物", "2026-W42") is None
+
+        incremental = get_student_progress(conn, "s1")
+        rebuild_rollups(cursor)
+        assert get_student_progress(conn, "s1") == incremental
+
+        # 無法解析的練習時間歸入 UNKNOWN_WEEK，寫入不會因週次為 NULL 而失敗
+        cursor.executemany('''
+        INSERT INTO practice_records (student_id, practice_mode, topic, input_text, score, practice_time)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', [("s2", "作文模式", "我的寵物", "補登", 60, "yesterday"),
+              ("s2", "作文模式", "我的寵物", "補登", 70, "2024/03/04")])
+        rollup = get_rollup(conn, "s2", "作文模式", "我的寵物", UNKNOWN_WEEK)
+        assert rollup["record_count"] == 2 and rollup["best_score"] == 70
+        conn.close()
+
+        # 舊版資料庫（尚無彙總表）含無法解析的練習時間，初始化時回填不會失敗
+        legacy_path = os.path.join(tmp, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        db_init.create_practice_tables(conn.cursor())
+        conn.execute("DROP TABLE score_rollups")
+        for name in ("insert", "delete", "update"):
+            conn.execute(f"DROP TRIGGER practice_records_rollup_{name}")
+        conn.execute('''
+        INSERT INTO practice_records (student_id, practice_mode, topic, input_text, score, practice_time)
+        VALUES ('s3', '作文模式', '我的寵物', '舊資料', 75, '上週三')
+        ''')
+        conn.commit()
+        conn.close()
+        db_init.init_database(legacy_path)
+        conn = sqlite3.connect(legacy_path)
+        assert get_rollup(conn, "s3", "作文模式", "我的寵物", UNKNOWN_WEEK)["best_score"] == 75
+        conn.close()
+        print("✅ 分數彙總增量更新與重建一致")
+
+def test_session_replay():
+    """測試打字記錄與無介面重播"""
+    print("\n🔍 正在測試打字記錄重播...")
+
+    import db_init
+    from session_recorder import SessionRecorder, replay_trace
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "replay.db")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+
+        trace_path = os.path.join(tmp, "session.trace.gz")
+        recorder = SessionRecorder(trace_path, {"topic": "我的寵物", "advisor_grade": "4-6年級"})
+        text = ""
+        for ch in "我有一隻可愛的小狗。\n它每天陪我玩。":
+            recorder.record_edit(len(text), 0, ch)
+            text += ch
+        recorder.record_edit(0, 2, "我們", quiet=True)
+        recorder.close()
+
+        report = replay_trace(trace_path, advisor)
+        advisor.close()
+        assert report["final_text"] == "我們一隻可愛的小狗。\n它每天陪我玩。"
+        assert report["events"] == len("我有一隻可愛的小狗。\n它每天陪我玩。")
+        assert report["suggestion_events"] == 2
+        print(f"✅ 重播完成：{report['events']} 個事件，建議延遲 p95={report['suggestion_ms']['p95']:.2f}ms")
+
+def test_analysis_session():
+    """測試逐句分析狀態：連續規則與評分重用"""
+    print("\n🔍 正在測試逐句分析狀態...")
+
+    import db_init
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "session.db")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        session = advisor.new_session()
+
+        sentences = ["我有一隻小狗", "牠每天陪我玩", "小狗像小太陽一樣溫暖", "我們在公園散步", "牠對我點頭"]
+        streaks = []
+        for sentence in sentences:
+            advisor.generate_suggestions(sentence, session=session)
+            streaks.append((session.streak("has_metaphor"), session.streak("has_personify")))
+        assert streaks == [(1, 1), (2, 2), (0, 3), (1, 3), (2, 0)]
+
+        full_text = "。".join(sentences) + "。"
+        assert advisor.calculate_score(full_text, session) == advisor.calculate_score(full_text)
+        advisor.close()
+        print(f"✅ 連續規則計數正確：{streaks}")
+
+def test_sentence_segmenter():
+    """測試斷句器對各種句末標點與引號的處理"""
+    print("\n🔍 正在測試斷句器...")
+
+    from sentence_segmenter import iter_sentences, last_sentence
+
+    text = "我有一隻狗！牠叫「小白」。他說：「你好嗎？」我很開心……\n第二行沒有句號"
+    spans = list(iter_sentences(text))
+    assert [span.body for span in spans] == ["我有一隻狗", "牠叫「小白」", "他說：「你好嗎", "我很開心", "第二行沒有句號"]
+    assert [span.terminated for span in spans] == [True, True, True, True, False]
+    assert all(text[span.start:span.end] == span.text for span in spans)
+    assert last_sentence(text) == spans[-1]
+    assert last_sentence(text[:spans[2].end]) == spans[2]
+    print(f"✅ 斷句正確：共 {len(spans)} 句")
+
+def test_essay_search():
+    """測試作文全文搜尋"""
+    print("\n🔍 正在測試作文全文搜尋...")
+
+    import db_init
+    from essay_search import search_essays, rebuild_index
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "search.db")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        essays = [
+            ("s1", "一次有趣的旅行", "週末我們去動物園，看到圓滾滾的熊貓在吃竹子。"),
+            ("s2", "我的寵物", "我的小狗很可愛，每天都在公園跑來跑去。"),
+            ("s3", "難忘的一天", "去年夏天在動物園迷路了，後來警察叔叔幫我找到媽媽。動物園真大！"),
+        ]
+        for student_id, topic, text in essays:
+            advisor.save_practice_record("作文模式", topic, text, "", 80, student_id=student_id)
+
+        conn = sqlite3.connect(db_path)
+        results = search_essays(conn, "動物園")
+        assert sorted(result["student_id"] for result in results) == ["s1", "s3"]
+        assert results[0]["student_id"] == "s3" and "【動物園】" in results[0]["snippet"]
+        assert [result["student_id"] for result in search_essays(conn, "狗")] == ["s2"]
+        assert search_essays(conn, "動物 熊貓", student_id="s3") == []
+
+        conn.execute("DELETE FROM practice_records WHERE student_id='s1'")
+        assert [result["student_id"] for result in search_essays(conn, "動物園")] == ["s3"]
+        assert rebuild_index(conn.cursor()) == 2
+        conn.close()
+        advisor.close()
+        print(f"✅ 全文搜尋成功：{results[0]['snippet']}")
+
+def test_near_duplicates():
+    """測試相似作文偵測"""
+    print("\n👯 正在測試相似作文偵測...")
+
+    import db_init
+    from near_duplicates import find_near_duplicates, cluster_submissions, minhash_signature, estimate_similarity
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    original = "週末我們全家去動物園玩，看到圓滾滾的熊貓抱著竹子大口大口地吃，旁邊的小猴子在樹上盪來盪去，真是開心的一天。"
+    copied = "週末我們全家去動物園玩！看到圓滾滾的熊貓抱著竹子大口大口地吃，旁邊的小猴子在樹上跳來跳去，真是快樂的一天。"
+    other = "我的小狗很可愛，每天放學回家它都會搖著尾巴在門口等我，我們常常一起到公園散步，它是我最好的朋友。"
+    assert estimate_similarity(minhash_signature(original), minhash_signature(original)) == 1.0
+    assert minhash_signature("。！") is None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "dup.db")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        first_id = advisor.save_practice_record("作文模式", "一次有趣的旅行", original, "", 80, student_id="s1")
+        advisor.save_practice_record("作文模式", "我的寵物", other, "", 80, student_id="s2")
+        copy_id = advisor.save_practice_record("作文模式", "一次有趣的旅行", copied, "", 80, student_id="s3")
+
+        conn = sqlite3.connect(db_path)
+        matches = find_near_duplicates(conn, copied, exclude_record_id=copy_id)
+        assert [match["record_id"] for match in matches] == [first_id]
+        assert matches[0]["student_id"] == "s1" and matches[0]["similarity"] >= 0.5
+        assert cluster_submissions(conn) == [[first_id, copy_id]]
+        assert cluster_submissions(conn, topic="我的寵物") == []
+
+        conn.execute("DELETE FROM practice_records WHERE record_id = ?", (first_id,))
+        assert find_near_duplicates(conn, copied, exclude_record_id=copy_id) == []
+        assert conn.execute("SELECT COUNT(*) FROM essay_lsh_bands WHERE record_id = ?", (first_id,)).fetchone()[0] == 0
+        conn.commit()
+        conn.close()
+
+        # 太短的造句不計算簽章
+        short_id = advisor.save_practice_record("造句模式", "", "我喜歡小狗。", "", 80, student_id="s4")
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM essay_minhash WHERE record_id = ?", (short_id,)).fetchone()[0] == 0
+        conn.close()
+
+        # 同一篇被大量重複提交：每桶只比對最新的幾筆，分群仍把所有副本串成一群
+        copy_ids = [advisor.save_practice_record("作文模式", "我的寵物", other, "", 80, student_id=f"c{i}")
+                    for i in range(12)]
+        conn = sqlite3.connect(db_path)
+        matches = find_near_duplicates(conn, other, max_bucket_size=5)
+        assert [match["record_id"] for match in matches] == sorted(copy_ids)[-5:]
+        cluster = sorted(copy_ids + [conn.execute("SELECT MIN(record_id) FROM practice_records WHERE topic='我的寵物'").fetchone()[0]])
+        assert cluster_submissions(conn, topic="我的寵物", max_bucket_size=3) == [cluster]
+        conn.close()
+        advisor.close()
+        print(f"✅ 相似作文偵測成功：相似度 {matches[0]['similarity']:.2f}")
+
+def test_text_storage():
+    """測試練習記錄文字壓縮"""
+    print("\n🗜️ 正在測試練習記錄文字壓縮...")
+
+    import db_init
+    from essay_search import search_essays, rebuild_index
+    from storage_router import StorageRouter
+    from text_storage import TextCodec, get_record, iter_records, train_from_records, compress_existing
+    from writing_advisor import WritingAdvisor
+
+    essays = [
+        "週末我們全家去動物園玩，看到圓滾滾的熊貓抱著竹子大口大口地吃，真是開心的一天。",
+        "今天下午老師帶我們到公園寫生，天空像藍色的大海，白雲彷彿一群綿羊在散步。",
+        "我的小狗很可愛，每天放學回家它都會搖著尾巴在門口等我，我們常常一起到公園散步。",
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "compress.db")
+        db_init.init_database(db_path)
+        conn = sqlite3.connect(db_path)
+        # 舊版程式寫入的未壓縮記錄
+        for text in essays * 20:
+            conn.execute("INSERT INTO practice_records (practice_mode, topic, input_text, suggested_text) VALUES (?, ?, ?, ?)",
+                         ("作文模式", "舊記錄", text, "短建議"))
+        conn.commit()
+        raw_bytes = sum(len(text.encode("utf-8")) for text in essays * 20)
+
+        dict_id = train_from_records(conn)
+        assert dict_id is not None
+        count, before, after = compress_existing(conn)
+        assert count == 60 and after < before / 2
+        assert conn.execute("SELECT COUNT(*) FROM practice_records WHERE typeof(input_text) = 'blob'").fetchone()[0] == 60
+        # 太短的建議維持原文；重跑不會再選出或改寫任何記錄
+        changes = conn.total_changes
+        assert compress_existing(conn) == (0, 0, 0)
+        assert conn.total_changes == changes
+        assert [record.input_text for record in iter_records(conn, batch_size=7)] == essays * 20
+        assert get_record(conn, 1).suggested_text == "短建議"
+
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        record_id = advisor.save_practice_record("作文模式", "新記錄", essays[1], essays[1], 90, student_id="s1")
+        stored = conn.execute("SELECT input_text FROM practice_records WHERE record_id = ?", (record_id,)).fetchone()[0]
+        assert isinstance(stored, bytes) and len(stored) < len(essays[1].encode("utf-8"))
+        record = get_record(conn, record_id)
+        assert record.input_text == essays[1] and record.suggested_text == essays[1] and record.student_id == "s1"
+        assert TextCodec(conn).decode(stored) == essays[1]
+
+        results = search_essays(conn, "白雲", student_id="s1")
+        assert len(results) == 1 and "【白雲】" in results[0]["snippet"]
+        assert rebuild_index(conn.cursor()) == 61
+        conn.close()
+        advisor.close()
+        print(f"✅ 文字壓縮成功：{raw_bytes} → {after} 位元組")
+
+def test_record_sync():
+    """測試練習記錄同步到中央伺服器"""
+    print("\n☁️ 正在測試練習記錄同步...")
+
+    import app
+    import db_init
+    import record_sync
+    from record_sync import SyncClient, SyncError, high_water_mark
+    from storage_router import StorageRouter
+    from text_storage import iter_records
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        local_db = os.path.join(tmp, "desktop.db")
+        db_init.init_database(local_db)
+        advisor = WritingAdvisor(StorageRouter(shared_db=local_db))
+        for i in range(5):
+            advisor.save_practice_record("作文模式", "我的寵物", f"我的小狗第{i}天學會了新把戲，大家都很開心。", "", 80 + i,
+                                         student_id=f"s{i % 2}", school_id="光明國小")
+        advisor.close()
+
+        central = StorageRouter(shared_db=os.path.join(tmp, "central.db"), shard_dir=os.path.join(tmp, "shards"))
+        app.app.config["STORAGE_ROUTER"] = central
+        client = app.app.test_client()
+        uploads = []
+        saved_token = os.environ.pop(record_sync.SYNC_TOKEN_ENV, None)
+        auth = {"Authorization": "Bearer sync-secret"}
+
+        def transport(body, headers):
+            uploads.append(len(body))
+            response = client.post("/api/sync/practice-records", data=body, headers=dict(headers, **auth))
+            return response.status_code, response.get_json()
+
+        # 前兩次連線失敗、伺服器忙碌，第三次成功
+        failures = [OSError("網路中斷"), (503, {})]
+        def flaky_transport(body, headers):
+            if failures:
+                failure = failures.pop(0)
+                if isinstance(failure, Exception):
+                    raise failure
+                return failure
+            return transport(body, headers)
+
+        delays = []
+        sync = SyncClient(flaky_transport, batch_size=2, sleep=delays.append)
+        try:
+            # 伺服器沒有設定權杖時不接收上傳；設定後必須帶正確的權杖
+            empty = {"device_id": "anonymous", "records": []}
+            assert client.post("/api/sync/practice-records", json=empty, headers=auth).status_code == 403
+            os.environ[record_sync.SYNC_TOKEN_ENV] = "sync-secret"
+            assert client.post("/api/sync/practice-records", json=empty).status_code == 401
+            assert client.post("/api/sync/practice-records", json=empty,
+                               headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+            assert sync.sync_database(local_db) == 5
+            assert len(uploads) == 3 and len(delays) == 2 and delays[1] > delays[0] / 2
+            conn = sqlite3.connect(local_db)
+            assert high_water_mark(conn) == 5
+            assert sync.sync_database(local_db) == 0
+
+            # 高水位遺失時重傳，伺服器依（裝置, 記錄編號）去重
+            conn.execute("DELETE FROM sync_state WHERE name = 'high_water_mark'")
+            conn.commit()
+            conn.close()
+            assert sync.sync_database(local_db) == 5
+            assert [row for _, row in central.query_all("SELECT COUNT(*) FROM practice_records")] == [(5,)]
+            shard = central.records_connection("光明國小")
+            records = list(iter_records(shard))
+            assert [record.score for record in records] == [80, 81, 82, 83, 84]
+            assert records[0].input_text == "我的小狗第0天學會了新把戲，大家都很開心。"
+
+            bad = client.post("/api/sync/practice-records", data=b"not json",
+                              headers={"Content-Type": "application/json", **auth})
+            assert bad.status_code == 400
+            # 欄位型別或練習時間格式錯誤：整批拒絕（400），不會寫到一半
+            record = {"record_id": 99, "practice_mode": "作文模式", "topic": "我的寵物", "input_text": "小狗。",
+                      "school_id": "光明國小"}
+            for field, value in (("practice_time", "yesterday"), ("practice_time", "2024-02-30"),
+                                 ("student_id", 7), ("class_id", ["三甲"]), ("suggested_text", {"x": 1}),
+                                 ("record_id", True)):
+                bad = client.post("/api/sync/practice-records", headers=auth,
+                                  json={"device_id": "bad-device", "records": [dict(record, **{field: value})]})
+                assert bad.status_code == 400 and field in bad.get_json()["error"], (field, value)
+            ok = client.post("/api/sync/practice-records", headers=auth,
+                             json={"device_id": "bad-device", "records": [dict(record, practice_time="2024-02-29")]})
+            assert ok.status_code == 200 and ok.get_json()["accepted"] == 1
+            conn = sqlite3.connect(local_db)
+            conn.execute("DELETE FROM sync_state WHERE name = 'high_water_mark'")
+            conn.commit()
+            conn.close()
+            for status, retries in ((400, 0), (500, 0), (503, 2)):
+                delays.clear()
+                try:
+                    SyncClient(lambda body, headers: (status, {}), max_retries=2, sleep=delays.append).sync_database(local_db)
+                    assert False, "上傳失敗應拋出 SyncError"
+                except SyncError:
+                    assert len(delays) == retries
+            conn = sqlite3.connect(local_db)
+            assert high_water_mark(conn) == 0
+            conn.close()
+        finally:
+            app.app.config["STORAGE_ROUTER"] = None
+            if saved_token is None:
+                os.environ.pop(record_sync.SYNC_TOKEN_ENV, None)
+            else:
+                os.environ[record_sync.SYNC_TOKEN_ENV] = saved_token
+            central.close()
+        print(f"✅ 同步成功：每批上傳 {min(uploads)}~{max(uploads)} 位元組，重複上傳自動略過")
+
+def test_advisor_snapshot():
+    """測試規則資源快照與熱更新"""
+    print("\n🔄 正在測試規則熱更新...")
+
+    import threading
+    import time
+    import db_init
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "reload.db")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        before = advisor.snapshot
+        assert before.rules[("3-6年級", "句子無謂語")][0][0] == "基礎規範"
+        assert "像" in advisor.resources["比喻詞"]
+
+        # 建議生成只讀快照，不查詢資料庫
+        statements = []
+        advisor.conn.set_trace_callback(statements.append)
+        advisor.generate_suggestions("小狗。", grade="3-6年級")
+        assert statements == []
+        advisor.conn.set_trace_callback(None)
+
+        errors = []
+        stop = threading.Event()
+
+        def worker():
+            try:
+                while not stop.is_set():
+                    assert len(advisor.generate_suggestions("小狗。", grade="3-6年級")) == 3
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        editor = sqlite3.connect(db_path)
+        editor.execute("UPDATE writing_rules SET suggestion_template = '試試看加上動作：【主語】【推薦謂語】' WHERE trigger_condition = '句子無謂語'")
+        editor.execute("UPDATE student_resources SET content = content || '、如同' WHERE res_type = '比喻詞'")
+        editor.commit()
+        changed_at = time.monotonic()
+        while advisor.snapshot is before and time.monotonic() - changed_at < 2:
+            time.sleep(0.05)
+        elapsed = time.monotonic() - changed_at
+        stop.set()
+        for thread in threads:
+            thread.join()
+        editor.close()
+
+        assert not errors, errors
+        assert elapsed < 1.0
+        after = advisor.snapshot
+        assert after.version > before.version
+        assert after.rules[("3-6年級", "句子無謂語")] == (("基礎規範", "試試看加上動作：【主語】【推薦謂語】"),)
+        assert "如同" in advisor.resources["比喻詞"] and "如同" not in before.resources["比喻詞"]
+        assert any(suggestion.startswith("試試看加上動作") for _ in range(20)
+                   for suggestion in advisor.generate_suggestions("小狗。", grade="3-6年級"))
+        advisor.close()
+        print(f"✅ 規則熱更新成功：修改後 {elapsed:.2f} 秒生效")
+
+def test_class_analytics():
+    """測試班級分數分析"""
+    print("\n📊 正在測試班級分數分析...")
+
+    import numpy as np
+    import app
+    import db_init
+    from class_analytics import ScoreAccumulator, accumulate
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "analytics.db")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        essays = [
+            "週末我和媽媽去動物園。可愛的熊貓在吃竹子，我覺得很開心！",
+            "我的小狗。",
+            "首先我們到公園散步，然後在草地上野餐。美麗的花朵像小太陽一樣，讓我覺得很快樂。這是難忘的一天。",
+        ]
+        totals = []
+        for i, text in enumerate(essays * 4):
+            total, detail = advisor.calculate_score(text)
+            totals.append(total)
+            advisor.save_practice_record("作文模式", "一次有趣的旅行", text, "", total,
+                                         student_id=f"s{i % 3}", class_id="601", detail_scores=detail)
+        advisor.save_practice_record("造句模式", "關鍵詞「開心」", "我很開心。", "", 100, class_id="601")
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE practice_records SET practice_time = '2024-03-04 10:00:00' WHERE record_id <= 6")
+        conn.commit()
+
+        accumulator = ScoreAccumulator()
+        assert accumulate(conn, accumulator, class_id="601", chunk_size=5) == 12
+        report = accumulator.result()
+        total = report["metrics"]["總分"]
+        assert report["records"] == 12 and report["students"] == 3
+        assert abs(total["mean"] - np.mean(totals)) < 0.01 and total["max"] == max(totals)
+        assert total["p50"] == int(np.percentile(totals, 50, method="inverted_cdf"))
+        assert sum(report["distribution"].values()) == 12
+        weakest = sum(area["weakest_ratio"] for area in report["weak_areas"].values())
+        assert abs(weakest - 1.0) < 0.001
+        assert [week["records"] for week in report["trend"]] == [6, 6] and report["trend"][0]["week"] == "2024-W10"
+        conn.close()
+        advisor.close()
+
+        # 舊資料中無法解析的練習時間：仍計入分數統計，不列入每週趨勢，也不會讓報表失敗
+        legacy = sqlite3.connect(":memory:")
+        legacy.execute("CREATE TABLE practice_records (student_id TEXT, practice_mode TEXT, school_id TEXT, "
+                       "class_id TEXT, topic TEXT, practice_time TEXT, score FLOAT, score_basics FLOAT, "
+                       "score_expression FLOAT, score_structure FLOAT, score_content FLOAT)")
+        legacy.executemany("INSERT INTO practice_records VALUES ('s1', '作文模式', '', '601', '舊記錄', ?, 80, 24, 20, 20, 16)",
+                           [("yesterday",), ("2024-03-04 10:00:00",)])
+        accumulator = ScoreAccumulator()
+        assert accumulate(legacy, accumulator) == 2
+        report = accumulator.result()
+        assert report["metrics"]["總分"]["count"] == 2
+        assert [(week["week"], week["records"]) for week in report["trend"]] == [("2024-W10", 1)]
+        legacy.close()
+
+        app.app.config["STORAGE_ROUTER"] = StorageRouter(shared_db=db_path)
+        try:
+            response = app.app.test_client().get("/api/analytics/scores?mode=造句模式")
+            data = response.get_json()
+            assert response.status_code == 200 and data["records"] == 1
+            assert data["metrics"]["總分"]["mean"] == 100 and data["metrics"]["基礎規範"]["count"] == 0
+        finally:
+            app.app.config["STORAGE_ROUTER"].close()
+            app.app.config["STORAGE_ROUTER"] = None
+        print(f"✅ 班級分析成功：平均 {total['mean']} 分，中位數 {total['p50']} 分")
+
+def test_typo_checker():
+    """測試錯別字模型"""
+    print("\n🔤 正在測試錯別字模型...")
+
+    import db_init
+    from storage_router import StorageRouter
+    from typo_checker import TypoChecker, build_typo_model, read_corpus, SEED_CORPUS
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "typo_model.bin")
+        build_typo_model(model_path)
+        checker = TypoChecker.open(model_path)
+        cases = {"他跑的很快": "他跑得很快", "小鳥快樂的唱歌": "小鳥快樂地唱歌", "我再學校看書": "我在學校看書",
+                 "我已為他生氣了": "我以為他生氣了", "爺爺帶著眼鏡": "爺爺戴著眼鏡"}
+        for wrong, right in cases.items():
+            assert checker.correct(wrong) == right, wrong
+        for sentence in ("媽媽做的菜很好吃", "這個地方很美", "明天再見", "我們在公園玩得很開心", "他認真地寫字",
+                         "我再也不敢了", "我再次說明", "他在家看書", "我高興地跳起來", "她高興得跳起來"):
+            assert checker.check(sentence) == [], sentence
+        # 「得」與「地」不相上下時不硬改
+        assert checker.correct("我高興的跳起來") != "我高興得跳起來"
+        typo = checker.check("他跑的很快")[0]
+        assert (typo.position, typo.wrong, typo.correct, typo.group) == (2, "的", "得", "的/得/地")
+        # 記憶體版與映射檔結果相同
+        assert TypoChecker.from_texts(read_corpus([SEED_CORPUS])).check("我再學校看書") == checker.check("我再學校看書")
+        checker.close()
+
+        db_path = os.path.join(tmp, "typo.db")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        suggestions = advisor.generate_suggestions("他跑的很快。")
+        assert suggestions[0] == "這裡可以優化為：他跑得很快，記得「的/得/地」的用法哦～"
+        _, wrong_scores = advisor.calculate_score("他跑的很快。我再學校看書。")
+        _, right_scores = advisor.calculate_score("他跑得很快。我在學校看書。")
+        assert wrong_scores["基礎規範"] == right_scores["基礎規範"] - 4
+        advisor.close()
+    print("✅ 錯別字模型成功：的/得/地與同音字都能正確修正")
+
+def test_db_backup():
+    """測試線上備份、輪替與還原"""
+    print("\n💾 正在測試資料庫備份...")
+
+    import threading
+    import db_init
+    from db_backup import (BackupError, BackupScheduler, backup_router, check_integrity, list_backups,
+                           restore_backup, verify_backup)
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "backup.db")
+        backup_dir = os.path.join(tmp, "backups")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        for i in range(200):
+            advisor.save_practice_record("作文模式", "我的家人", f"我的媽媽很溫柔，每天都陪我寫功課。第{i}篇" * 5, "", 80)
+
+        # 備份期間另一個執行緒持續寫入
+        stop = threading.Event()
+        written = []
+
+        def writer():
+            conn = sqlite3.connect(db_path, timeout=30)
+            conn.execute("CREATE TABLE IF NOT EXISTS backup_probe (value INTEGER)")
+            while not stop.is_set():
+                conn.execute("INSERT INTO backup_probe (value) VALUES (?)", (len(written),))
+                conn.commit()
+                written.append(1)
+                time.sleep(0.002)
+            conn.close()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        router = StorageRouter(shared_db=db_path)
+        try:
+            name = backup_router(router, backup_dir, keep=2, pages=4, step_sleep=0.001)
+        finally:
+            stop.set()
+            thread.join()
+        assert written, "備份期間寫入被擋住"
+        manifest = verify_backup(name, backup_dir)
+        backup_file = os.path.join(backup_dir, name, manifest["files"][0]["file"])
+        conn = sqlite3.connect(backup_file)
+        assert conn.execute("SELECT COUNT(*) FROM practice_records").fetchone()[0] == 200
+        conn.close()
+
+        # 輪替只保留最新兩份；排程在到期前不重複備份
+        backup_router(router, backup_dir, keep=2)
+        newest = backup_router(router, backup_dir, keep=2)
+        assert [item for item, _ in list_backups(backup_dir)][-1] == newest and len(list_backups(backup_dir)) == 2
+        assert BackupScheduler(router, backup_dir, interval=3600).run_if_due() is None
+
+        # 還原：刪掉的記錄回來，原檔另存
+        live = sqlite3.connect(db_path)
+        live.execute("DELETE FROM practice_records")
+        live.commit()
+        restore_backup(directory=backup_dir)
+        assert live.execute("SELECT COUNT(*) FROM practice_records").fetchone()[0] == 200
+        live.close()
+        assert os.path.exists(db_path + ".before-restore")
+
+        # 損壞的備份檔會被偵測出來
+        backup_file = os.path.join(backup_dir, newest, os.path.basename(db_path))
+        with open(backup_file, "r+b") as f:
+            f.seek(4096)
+            f.write(b"\xff" * 4096)
+        try:
+            check_integrity(backup_file)
+            raise AssertionError("損壞的備份未被偵測")
+        except BackupError:
+            pass
+        router.close()
+        advisor.close()
+    print(f"✅ 資料庫備份成功：備份期間寫入 {len(written)} 次未被阻擋")
+
+def test_topic_relevance():
+    """測試作文切題檢查"""
+    print("\n🎯 正在測試作文切題檢查...")
+
+    import jieba
+    import db_init
+    from storage_router import StorageRouter
+    from topic_relevance import build_topic_profiles, pack_vector, topic_score, unpack_vector
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "topic.db")
+        db_init.init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        # 尚未離線計算時使用種子語料的向量
+        pets = advisor.snapshot.topics["我的寵物"]
+        assert topic_score(pets, jieba.lcut("我的小狗每天都在門口等我回家。")) > 0.1
+        assert topic_score(pets, jieba.lcut("明天數學考試要考分數的加減法。")) == 0.0
+
+        weights = {"小狗": 0.8, "尾巴": 0.6}
+        restored = unpack_vector(pack_vector(weights))
+        assert restored.keys() == weights.keys() and abs(restored["小狗"] - 0.8) < 1e-6
+
+        session = advisor.new_session("我的寵物")
+        suggestions = advisor.generate_suggestions("爸爸開車載我們去高速公路兜風。", session=session)
+        assert suggestions[0].startswith("這句和「我的寵物」的關係不大") and "小狗" in suggestions[0]
+        on_topic = advisor.generate_suggestions("我的小狗每天都在門口等我回家。", session=session)
+        assert not any("關係不大" in suggestion for suggestion in on_topic)
+
+        essay = "我家有一隻小狗。爸爸開車載我們去高速公路兜風。"
+        _, plain = advisor.calculate_score(essay)
+        _, checked = advisor.calculate_score(essay, topic="我的寵物")
+        assert checked["內容充實"] == max(plain["內容充實"] - 2, 0)
+
+        # 高分作文加入語料後，新詞也算切題；建議生成器自動載入新向量
+        advisor.save_practice_record("作文模式", "我的寵物", "我的天竺鼠叫做布丁，布丁最愛吃牧草。" * 3, "", 90)
+        build_topic_profiles(StorageRouter(shared_db=db_path))
+        version = advisor.snapshot.version
+        time.sleep(advisor._reloader.interval + 0.1)
+        assert advisor.snapshot.version != version
+        assert topic_score(advisor.snapshot.topics["我的寵物"], jieba.lcut("天竺鼠在吃牧草")) > 0.1
+        advisor.close()
+    print("✅ 切題檢查成功：偏離題目的句子會優先提醒並扣內容充實分")
+
+def test_exemplar_index():
+    """測試高分作文範例句索引"""
+    print("\n📌 正在測試範例句索引...")
+
+    import db_init
+    from exemplar_index import update_exemplars
+    from storage_router import StorageRouter
+    from typo_checker import load_typo_checker
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "exemplar.db")
+        db_init.init_database(db_path)
+        router = StorageRouter(shared_db=db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        advisor.save_practice_record("作文模式", "中秋佳節", "中秋節的傍晚，我們在公園裡看著美麗的月亮。"
+                                     "圓圓的月亮好像一個大玉盤。好。他跑的很快，美麗的煙火在天空綻放。", "", 95)
+        advisor.save_practice_record("作文模式", "我的寵物", "週末我帶可愛的小狗到公園散步，牠開心地搖尾巴。", "", 90)
+        advisor.save_practice_record("作文模式", "我的寵物", "我的小狗在公園裡追著美麗的蝴蝶跑。", "", 40)
+        checker = load_typo_checker()
+        assert update_exemplars(router, typo_checker=checker) == 3
+        assert update_exemplars(router, typo_checker=checker) == 0
+
+        # 太短、有錯別字、低分作文的句子都不收
+        index = advisor._exemplars.reload()
+        sentences = {sentence for sentence, _, _ in index.sentences.values()}
+        assert "中秋節的傍晚，我們在公園裡看著美麗的月亮。" in sentences
+        assert not any("跑的" in sentence or "蝴蝶" in sentence or sentence == "好。" for sentence in sentences)
+
+        # 相同題目優先；不回傳學生自己的句子
+        found = advisor.find_exemplars("傍晚我在公園看到美麗的月亮。", "中秋佳節")
+        assert found[0] == "中秋節的傍晚，我們在公園裡看著美麗的月亮。"
+        assert advisor.find_exemplars("週末我帶可愛的小狗到公園散步，牠開心地搖尾巴。", "我的寵物", limit=5) == []
+        suggestions = advisor.generate_suggestions("傍晚我在公園看到美麗的月亮。", topic="中秋佳節")
+        assert suggestions[-1].startswith("參考高分作文的句子：")
+
+        # 新記錄增量加入，建議生成器自動載入新索引
+        advisor.save_practice_record("作文模式", "我的寵物", "放學後我在操場上和活潑的小狗一起玩耍。", "", 88)
+        version = advisor._exemplars.current().version
+        assert update_exemplars(router, typo_checker=checker) == 1
+        time.sleep(advisor._exemplars.interval + 0.1)
+        assert advisor._exemplars.current().version != version
+        assert advisor.find_exemplars("小狗在操場上玩耍。", "我的寵物")[0] == "放學後我在操場上和活潑的小狗一起玩耍。"
+        router.close()
+        advisor.close()
+    print("✅ 範例句索引成功：只收錄高分且通順的句子，增量更新後立即可查")
+
+def test_prefork_server():
+    """測試預先載入、多進程的Web API伺服器"""
+    print("\n🚀 正在測試多進程伺服器...")
+    import json
+    import signal
+    import socket
+    import urllib.request
+    import app
+    from db_init import init_database
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    def call(port, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=data,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "shared.db")
+        init_database(db_path)
+
+        # 建議與評分端點（Flask 測試客戶端）
+        app.app.config["ADVISOR"] = WritingAdvisor(StorageRouter(shared_db=db_path))
+        try:
+            client = app.app.test_client()
+            response = client.post("/api/suggestions", json={"sentence": "他跑的很快", "topic": "我的寵物"})
+            assert response.status_code == 200
+            assert any("他跑得很快" in suggestion for suggestion in response.get_json()["suggestions"])
+            response = client.post("/api/score", json={"text": "我家的小狗很可愛。牠每天陪我玩。"})
+            assert set(response.get_json()["scores"]) == {"基礎規範", "表達技巧", "結構邏輯", "內容充實"}
+            assert client.post("/api/suggestions", json={}).status_code == 400
+            # 選填欄位型別錯誤時回傳 400，而不是伺服器錯誤
+            for payload in ({"sentence": "小狗。", "prev_sentence": 3}, {"sentence": "小狗。", "grade": ["3-6年級"]},
+                            {"sentence": "小狗。", "topic": {"x": 1}}):
+                response = client.post("/api/suggestions", json=payload)
+                assert response.status_code == 400 and "必須是文字" in response.get_json()["error"], payload
+            assert client.post("/api/score", json={"text": "小狗。", "topic": ["x"]}).status_code == 400
+            assert client.post("/api/score", json=["小狗。"]).status_code == 400
+            assert client.post("/api/suggestions", json={"sentence": "小狗。", "topic": None}).status_code == 200
+        finally:
+            app.app.config["ADVISOR"].close()
+            app.app.config["ADVISOR"] = None
+
+        # 實際啟動伺服器：2 個工作進程，第一個請求就是熱的
+        config_path = os.path.join(tmp, "storage.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump({"shared_db": db_path}, f)
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        env = dict(os.environ, WRITING_STORAGE_CONFIG=config_path)
+        server = subprocess.Popen([sys.executable, os.path.abspath("server.py"), "--host", "127.0.0.1",
+                                   "--port", str(port), "--workers", "2", "--threads", "2"],
+                                  cwd=tmp, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            deadline = time.time() + 60
+            while True:
+                try:
+                    health = call(port, "/healthz")
+                    break
+                except OSError:
+                    assert server.poll() is None and time.time() < deadline, "伺服器未能啟動"
+                    time.sleep(0.2)
+            assert health["warm"] and health["pid"] != server.pid
+            old_pids = {call(port, "/healthz")["pid"] for _ in range(20)}
+            result = call(port, "/api/suggestions", {"sentence": "他跑的很快", "topic": "我的寵物"})
+            assert any("他跑得很快" in suggestion for suggestion in result["suggestions"])
+
+            # 輪替期間請求不中斷，輪替完成後換成新的工作進程
+            server.send_signal(signal.SIGHUP)
+            deadline = time.time() + 60
+            while True:
+                pids = {call(port, "/healthz")["pid"] for _ in range(10)}
+                if not pids & old_pids:
+                    break
+                assert time.time() < deadline, "工作進程未輪替"
+                time.sleep(0.1)
+            assert call(port, "/healthz")["warm"]
+
+            server.send_signal(signal.SIGTERM)
+            assert server.wait(timeout=30) == 0
+        finally:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+            server.stdout.close()
+    print("✅ 多進程伺服器成功：工作進程預先載入、輪替不中斷、正常關閉")
+
+def test_speech_batch():
+    """測試錄音作業批次轉寫"""
+    print("\n🎙️ 正在測試批次轉寫...")
+    import wave
+    from db_init import init_database
+    from storage_router import StorageRouter
+    from text_storage import TextCodec
+    from writing_advisor import WritingAdvisor, to_written_language
+    from speech_batch import transcribe_directory
+
+    assert to_written_language("後來呀我們就去公園玩啦") == "後來我們就去公園玩了"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "shared.db")
+        init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        clips = os.path.join(tmp, "clips")
+        os.makedirs(clips)
+        transcripts = {"S001": "週末我和媽媽去公園散步啦", "S002": "後來呀小狗開心地跑來跑去",
+                       "S003": "就是說我很喜歡我的學校喔", "S004": None}
+        for student, text in transcripts.items():
+            with wave.open(os.path.join(clips, f"{student}.wav"), "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(16000)
+                f.writeframes(b"\0\0" * 1600)
+            if text is not None:
+                with open(os.path.join(clips, f"{student}.txt"), "w", encoding="utf-8") as f:
+                    f.write(text)
+
+        # 第一次只處理兩個檔案（模擬中斷），之後從未完成的檔案繼續
+        progress = []
+        result = transcribe_directory(advisor, clips, "sidecar", workers=2, limit=2,
+                                      progress=lambda *args: progress.append(args))
+        assert result["processed"] == 2 and result["skipped"] == 0
+        assert [finished for finished, _, _, _ in progress] == [1, 2]
+        result = transcribe_directory(advisor, clips, "sidecar", workers=2)
+        assert result["processed"] == 1 and result["skipped"] == 2
+        assert list(result["failed"]) == [os.path.join(clips, "S004.wav")]
+
+        # 補上無法辨識的檔案後重新執行，只處理它
+        with open(os.path.join(clips, "S004.txt"), "w", encoding="utf-8") as f:
+            f.write("然後呢我們一起回家")
+        assert transcribe_directory(advisor, clips, "sidecar")["processed"] == 1
+        assert transcribe_directory(advisor, clips, "sidecar")["processed"] == 0
+
+        conn = sqlite3.connect(db_path)
+        codec = TextCodec(conn)
+        rows = {student: (codec.decode(input_text), codec.decode(suggested_text), score_basics) for
+                student, input_text, suggested_text, score_basics in conn.execute(
+                    "SELECT student_id, input_text, suggested_text, score_basics FROM practice_records "
+                    "WHERE practice_mode = '講話轉寫模式'")}
+        conn.close()
+        assert sorted(rows) == ["S001", "S002", "S003", "S004"]
+        # 建議文字：第一行為書面語版本，之後為建議生成器的建議
+        assert rows["S001"][0] == "週末我和媽媽去公園散步啦"
+        lines = rows["S001"][1].split("\n")
+        assert lines[0] == "週末我和媽媽去公園散步了" and len(lines) > 1
+        assert not any(line.startswith("書面語優化：") for line in lines)
+        assert rows["S003"][1].split("\n")[0] == "也就是我很喜歡我的學校哦" and rows["S003"][2] is not None
+        # 寫入都經由建議生成器唯一的寫入執行緒
+        assert advisor.writer.jobs >= 4
+        advisor.close()
+    print("✅ 批次轉寫成功：平行辨識、轉成書面語並評分，中斷後可從未完成的檔案繼續")
+
+def test_speculative_suggestions():
+    """測試打字暫停時預先分析句子"""
+    print("\n⚡ 正在測試預先分析...")
+    import jieba
+    import writing_advisor
+    from db_init import init_database
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "shared.db")
+        init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        session = advisor.new_session("我的寵物")
+
+        # 只分析尚未結束的句子
+        assert advisor.speculate("", session) is None
+        assert advisor.speculate("我家的小狗很可愛。", session) is None
+        assert advisor.speculate("我家的小狗很可愛。牠跑的很快", session) == "牠跑的很快"
+        assert len(session.recent) == 0
+
+        # 打出句號時不再分詞、檢查錯字
+        calls = []
+        original_lcut = jieba.lcut
+        original_check = advisor.typo_checker.check
+        writing_advisor.jieba.lcut = lambda *args, **kwargs: calls.append("lcut") or original_lcut(*args, **kwargs)
+        advisor.typo_checker.check = lambda text: calls.append("check") or original_check(text)
+        try:
+            result = advisor.check_finished_sentence("我家的小狗很可愛。牠跑的很快。", "我家的小狗很可愛", session=session)
+            assert calls == []
+            # 沒有預先分析過的句子照常分析
+            advisor.check_finished_sentence("我家的小狗很可愛。牠跑的很快。我們一起去公園。", "牠跑的很快", session=session)
+            assert "lcut" in calls and "check" in calls
+        finally:
+            writing_advisor.jieba.lcut = original_lcut
+            advisor.typo_checker.check = original_check
+        start, end, sentence, suggestions = result
+        assert sentence == "牠跑的很快" and len(session.recent) == 2
+        assert suggestions[0].startswith("這裡可以優化為：牠跑得很快")
+
+        # 預先分析的結果與直接分析相同
+        fresh = advisor.new_session("我的寵物")
+        advisor.speculate("暑假爸爸開車載我們去火車站搭火車", session)
+        assert session.prepare("暑假爸爸開車載我們去火車站搭火車") == fresh.prepare("暑假爸爸開車載我們去火車站搭火車")
+        assert session.prepare("暑假爸爸開車載我們去火車站搭火車")[1][0]
+        advisor.close()
+    print("✅ 預先分析成功：句子結束時直接使用已算好的分詞、錯字與切題結果")
+
+def test_record_export():
+    """測試練習記錄串流匯出"""
+    print("\n📤 正在測試記錄匯出...")
+    import csv
+    import json
+    import app
+    import record_export
+    import record_sync
+    from db_init import init_database
+    from storage_router import StorageRouter
+    from text_storage import TextCodec, train_from_records
+    from writing_advisor import insert_practice_record
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "shared.db")
+        init_database(db_path)
+        conn = sqlite3.connect(db_path)
+        codec = TextCodec(conn)
+        for i in range(250):
+            mode = "作文模式" if i % 2 else "造句模式"
+            insert_practice_record(conn.cursor(), codec, f"S{i % 5}", "", "", mode, "我的寵物", f"第{i}篇，我家的小狗很可愛。",
+                                   f"建議{i}", 80 + i % 20, f"2024-03-{1 + i % 28:02d} 10:00:00",
+                                   {"基礎規範": 20} if i % 3 else None)
+        conn.commit()
+        # 之後的記錄以字典壓縮儲存，匯出時要解壓縮
+        train_from_records(conn)
+        codec.reload()
+        insert_practice_record(conn.cursor(), codec, "S0", "", "", "作文模式", "我的寵物", "壓縮後的作文內容。" * 10,
+                               "", 95, "2024-04-01 10:00:00")
+        conn.commit()
+        conn.close()
+        router = StorageRouter(shared_db=db_path)
+
+        # 小的批次與分頁，確認跨頁時不重複也不遺漏
+        records = [(record.record_id, record.input_text)
+                   for record in record_export.iter_export(router, batch_size=7, page_size=30)]
+        assert [record_id for record_id, _ in records] == list(range(1, 252))
+        assert records[-1][1] == "壓縮後的作文內容。" * 10
+
+        path = os.path.join(tmp, "records.csv")
+        assert record_export.export_records(router, path, practice_mode="作文模式", student_id="S1") == 25
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 25 and {row["student_id"] for row in rows} == {"S1"}
+        assert rows[0]["input_text"] == "第1篇，我家的小狗很可愛。"
+
+        path = os.path.join(tmp, "records.jsonl")
+        count = record_export.export_records(router, path, since="2024-03-10", until="2024-03-11", batch_size=3, page_size=4)
+        with open(path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        assert count == len(lines) == 9
+        assert all(line["practice_time"].startswith("2024-03-10") for line in lines)
+        assert lines[0]["score_basics"] is None and lines[1]["score_basics"] == 20
+        assert set(lines[0]) == set(record_export.COLUMNS)
+
+        if "parquet" in record_export.available_formats():
+            path = os.path.join(tmp, "records.parquet")
+            assert record_export.export_records(router, path) == 251
+            assert record_export.pq.read_table(path).num_rows == 251
+        else:
+            try:
+                record_export.export_records(router, os.path.join(tmp, "records.parquet"))
+                assert False, "沒有 pyarrow 時應拒絕 Parquet 格式"
+            except ValueError:
+                pass
+        assert not any(name.endswith(".tmp") for name in os.listdir(tmp))
+
+        # 串流下載端點：含作文內容，伺服器沒有設定權杖時一律拒絕
+        app.app.config["STORAGE_ROUTER"] = router
+        saved_token = os.environ.pop(record_sync.SYNC_TOKEN_ENV, None)
+        client = app.app.test_client()
+        try:
+            assert client.get("/api/export/records?format=jsonl").status_code == 403
+            os.environ[record_sync.SYNC_TOKEN_ENV] = "export-secret"
+            assert client.get("/api/export/records?format=jsonl").status_code == 401
+            assert client.get("/api/export/records?format=jsonl",
+                              headers={"Authorization": "Bearer wrong"}).status_code == 401
+            headers = {"Authorization": "Bearer export-secret"}
+            response = client.get("/api/export/records?format=jsonl&mode=造句模式", headers=headers)
+            assert response.status_code == 200 and response.is_streamed
+            assert len(response.get_data(as_text=True).splitlines()) == 125
+            assert client.get("/api/export/records?format=xlsx", headers=headers).status_code == 400
+            # 靜態下載只提供程式檔，資料庫不會繞過權杖從 /files/ 取得
+            for path in ("student_writing.db", "student_writing.db-wal", "backups/x.db", "autosave/x.jsonl"):
+                assert client.get(f"/files/{path}", headers=headers).status_code == 404
+            response = client.get("/files/README.md")
+            assert response.status_code == 200
+            response.close()
+        finally:
+            app.app.config["STORAGE_ROUTER"] = None
+            if saved_token is None:
+                os.environ.pop(record_sync.SYNC_TOKEN_ENV, None)
+            else:
+                os.environ[record_sync.SYNC_TOKEN_ENV] = saved_token
+        router.close()
+    print("✅ 記錄匯出成功：分批讀取、篩選、解壓縮並串流寫出")
+
+def test_rule_packs():
+    """測試規則包匯入"""
+    print("\n📦 正在測試規則包匯入...")
+    import json
+    import rule_packs
+    from advisor_snapshot import read_rules_version
+    from db_init import init_database
+    from rule_packs import PackError, import_pack, installed_packs, remove_pack
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "shared.db")
+        # 舊版資料庫：內建規則不屬於任何規則包，第一次啟動時改由內建規則包管理
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE writing_rules (rule_id INTEGER PRIMARY KEY AUTOINCREMENT, rule_type TEXT NOT NULL, "
+                     "rule_desc TEXT NOT NULL, trigger_condition TEXT NOT NULL, suggestion_template TEXT NOT NULL, "
+                     "score_weight FLOAT NOT NULL, grade_range TEXT NOT NULL)")
+        conn.execute("INSERT INTO writing_rules (rule_type, rule_desc, trigger_condition, suggestion_template, "
+                     "score_weight, grade_range) VALUES ('基礎規範', '舊規則', '句子無謂語', '舊模板', 0.1, '3-6年級')")
+        conn.commit()
+        conn.close()
+        init_database(db_path)
+        conn = sqlite3.connect(db_path)
+        builtin = rule_packs.validate_pack(rule_packs.read_pack(rule_packs.BUILTIN_PACK))[0]
+        assert conn.execute("SELECT COUNT(*) FROM writing_rules").fetchone()[0] == len(builtin.rules)
+        assert installed_packs(conn) == {"builtin": (1, len(builtin.rules), len(builtin.resources))}
+
+        # 重複啟動不再清空重寫：規則版本號不變
+        version = read_rules_version(conn)
+        init_database(db_path)
+        assert read_rules_version(conn) == version
+
+        # CSV 規則包：重複的規則與詞語只保留一份，同類型資源與內建的合併
+        pack_path = os.path.join(tmp, "extra.csv")
+        with open(pack_path, "w", encoding="utf-8") as f:
+            f.write("#pack,課外補充,1\n#rules\n" + ",".join(rule_packs.RULE_COLUMNS) + "\n"
+                    "表達技巧,多用疊字,句子無形容詞,可以用疊字形容：【主語】的眼睛圓圓的～,0.05,3-6年級\n"
+                    "表達技巧,多用疊字,句子無形容詞,可以用疊字形容：【主語】的眼睛圓圓的～,0.05,3-6年級\n"
+                    "#resources\nres_type,content,grade_range\n比喻詞,如同、好比、像,3-6年級\n比喻詞,如同,3-6年級\n")
+        result = import_pack(conn, pack_path)
+        assert result["status"] == "imported" and result["rules"] == 1 and result["duplicates"] == 2
+        assert import_pack(conn, pack_path)["status"] == "unchanged"
+        assert read_rules_version(conn) > version
+
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        assert {"彷彿", "如同", "好比"} <= set(advisor.resources["比喻詞"])
+        assert advisor.resources["比喻詞"].count("像") == 1
+        advisor.close()
+
+        # 兩個規則包宣告同一條規則：各自擁有，移除其中一包後規則仍在；建議生成器只載入一條
+        shared_rule = {"rule_type": "內容充實", "rule_desc": "共用規則", "trigger_condition": "句子無細節",
+                       "suggestion_template": "共用模板：【主語】在哪裡？", "score_weight": 0.05, "grade_range": "3-6年級"}
+        for name in ("甲包", "乙包"):
+            result = import_pack(conn, rule_packs.Pack(name, 1, [shared_rule], []))
+            assert result["status"] == "imported" and result["rules"] == 1 and result["duplicates"] == 0
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        templates = [template for _, template in advisor.snapshot.rules[("3-6年級", "句子無細節")]]
+        assert templates.count("共用模板：【主語】在哪裡？") == 1
+        advisor.close()
+        assert remove_pack(conn, "甲包")
+        count_shared = "SELECT COUNT(*) FROM writing_rules WHERE rule_desc = '共用規則'"
+        assert conn.execute(count_shared).fetchone()[0] == 1
+        result = import_pack(conn, rule_packs.Pack("乙包", 1, [shared_rule], []))
+        assert result["status"] == "unchanged" and result["rules"] == 1
+        assert remove_pack(conn, "乙包")
+        assert conn.execute(count_shared).fetchone()[0] == 0
+
+        # 不合法的規則包整包拒絕；內容變更需要更大的版本號
+        bad = {"name": "壞掉的包", "version": 1,
+               "rules": [{"rule_type": "基礎規範", "rule_desc": "x", "trigger_condition": "句子無謂語",
+                          "suggestion_template": "【不存在】", "score_weight": 2, "grade_range": "三年級"}],
+               "resources": [{"res_type": "比喻詞", "content": "", "grade_range": "3-6年級"}]}
+        try:
+            import_pack(conn, rule_packs.Pack(bad["name"], bad["version"], bad["rules"], bad["resources"]))
+            assert False, "不合法的規則包應被拒絕"
+        except PackError as e:
+            assert "score_weight" in str(e) and "資源第 1 筆" in str(e)
+        changed = rule_packs.Pack("課外補充", 1, [], [{"res_type": "喻體", "content": "彩虹", "grade_range": "3-6年級"}])
+        try:
+            import_pack(conn, changed)
+            assert False, "版本號沒有增加應被拒絕"
+        except PackError:
+            pass
+
+        # 大型規則包：一次交易匯入；中途失敗時完全回復
+        rows = [{"rule_type": "內容充實", "rule_desc": f"規則{i}", "trigger_condition": f"條件{i % 50}",
+                 "suggestion_template": f"第{i}條建議：【主語】【謂語】", "score_weight": 0.01, "grade_range": "3-6年級"}
+                for i in range(30000)]
+        large_path = os.path.join(tmp, "large.json")
+        with open(large_path, "w", encoding="utf-8") as f:
+            json.dump({"name": "大型規則包", "version": 1, "rules": rows, "resources": []}, f, ensure_ascii=False)
+        before = conn.execute("SELECT COUNT(*) FROM writing_rules").fetchone()[0]
+        conn.execute("CREATE TEMP TRIGGER fail_import BEFORE INSERT ON writing_rules WHEN NEW.rule_desc = '規則29999' "
+                     "BEGIN SELECT RAISE(ABORT, '模擬中斷'); END")
+        try:
+            import_pack(conn, large_path)
+            assert False, "應在寫入途中失敗"
+        except sqlite3.IntegrityError:
+            pass
+        assert conn.execute("SELECT COUNT(*) FROM writing_rules").fetchone()[0] == before
+        assert "大型規則包" not in installed_packs(conn)
+        conn.execute("DROP TRIGGER fail_import")
+        started = time.perf_counter()
+        assert import_pack(conn, large_path)["rules"] == 30000
+        assert time.perf_counter() - started < 10
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_writing_rules_pack'").fetchone()[0] == 1
+
+        assert remove_pack(conn, "大型規則包") and not remove_pack(conn, "大型規則包")
+        assert conn.execute("SELECT COUNT(*) FROM writing_rules").fetchone()[0] == before
+        conn.close()
+    print("✅ 規則包匯入成功：檢查、去除重複、整批寫入，重複匯入不改變資料庫")
+
+def test_connection_pool():
+    """測試多執行緒同時使用建議生成器（唯讀連線池與單一寫入執行緒）"""
+    print("\n🧵 正在測試多執行緒連線池...")
+    import threading
+    from db_init import init_database
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "pool.db")
+        init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        essay = "週末我和媽媽去公園散步。公園裡的花開得像彩虹一樣美麗，我覺得很開心。"
+        expected = advisor.calculate_score(essay, topic="我的寵物")
+
+        # 分析用的連線是唯讀的，每個執行緒各一條
+        try:
+            advisor.conn.execute("DELETE FROM writing_rules")
+            assert False, "唯讀連線不應能寫入"
+        except sqlite3.OperationalError:
+            pass
+
+        thread_count, rounds = 8, 40
+        errors, connections = [], set()
+        start = threading.Barrier(thread_count + 1)
+
+        def worker(index):
+            try:
+                start.wait()
+                connections.add(id(advisor.conn))
+                for i in range(rounds):
+                    assert advisor.calculate_score(essay, topic="我的寵物") == expected
+                    assert advisor.generate_suggestions("小狗。", grade="3-6年級")
+                    if i % 4 == 0:
+                        advisor.save_practice_record("作文模式", "我的寵物", f"{essay}（{index}-{i}）", "", expected[0],
+                                                     student_id=f"S{index}", detail_scores=expected[1])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        # 執行期間修改規則：各執行緒在換快照時也不會互相干擾
+        conn = sqlite3.connect(db_path)
+        for i in range(5):
+            conn.execute("UPDATE student_resources SET content = content WHERE res_type = '比喻詞'")
+            conn.commit()
+            time.sleep(advisor._reloader.interval / 2)
+        conn.close()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        assert errors == [], errors
+        assert len(connections) == thread_count
+        writes = thread_count * rounds // 4
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("SELECT COUNT(*) FROM practice_records").fetchone()[0] == writes
+        assert conn.execute("SELECT COUNT(DISTINCT input_text) FROM practice_records").fetchone()[0] == writes
+        conn.close()
+        assert advisor.writer.jobs == writes
+        wait = advisor.writer.waited / advisor.writer.jobs * 1000
+        print(f"   {thread_count} 個執行緒 × {rounds} 輪：{elapsed:.2f} 秒，寫入平均排隊 {wait:.1f} 毫秒，"
+              f"開啟 {advisor.readers.opened} 條唯讀連線")
+
+        # 關閉後可以繼續使用（連線重新開啟）
+        advisor.close()
+        assert advisor.save_practice_record("作文模式", "我的寵物", essay, "", 80) == writes + 1
+        advisor.close()
+    print("✅ 多執行緒連線池成功：分析同時進行、寫入依序完成，沒有執行緒錯誤")
+
+def test_score_cache():
+    """測試作文評分結果快取"""
+    print("\n🗂️ 正在測試作文評分快取...")
+    from db_init import init_database
+    from score_cache import normalize_text
+    from typo_checker import TypoChecker
+    from storage_router import StorageRouter
+    from writing_advisor import WritingAdvisor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "cache.db")
+        init_database(db_path)
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        essay = "週末我和媽媽去公園散步。公園裡的花開得像彩虹一樣美麗，我覺得很開心。\n這是難忘的一天。" * 20
+
+        # 正規化只去掉不影響評分的差異
+        variant = "  " + essay.replace("\n", "\r\n") + "\n"
+        assert advisor._score_text(variant, None, "我的寵物") == advisor._score_text(normalize_text(variant), None, "我的寵物")
+        assert advisor.score_key(variant, "我的寵物") == advisor.score_key(essay, "我的寵物")
+        assert advisor.score_key(essay, "我的寵物") != advisor.score_key(essay, "中秋佳節")
+        # 錯字模型內容不同（即使 n-gram 筆數相同）快取鍵也不同
+        first, second = TypoChecker.from_texts(["他跑得很快"]), TypoChecker.from_texts(["她跑得很快"])
+        assert first.meta["entries"] == second.meta["entries"]
+        checker = advisor.typo_checker
+        advisor.typo_checker = first
+        key = advisor.score_key(essay)
+        advisor.typo_checker = second
+        assert advisor.score_key(essay) != key
+        advisor.typo_checker = checker
+
+        # 顯示評分後儲存：第二次直接使用記憶體中的結果
+        started = time.perf_counter()
+        total, scores = advisor.calculate_score(essay, topic="我的寵物")
+        computed = time.perf_counter() - started
+        started = time.perf_counter()
+        assert advisor.calculate_score(variant, topic="我的寵物") == (total, scores)
+        cached = time.perf_counter() - started
+        assert advisor.score_cache.hits == 1
+        scores["基礎規範"] = -1
+        assert advisor.calculate_score(essay, topic="我的寵物")[1]["基礎規範"] != -1
+        print(f"   評分 {computed * 1000:.2f} 毫秒，快取 {cached * 1000:.3f} 毫秒")
+
+        total, scores = advisor.calculate_score(essay, topic="我的寵物")
+        advisor.save_practice_record("作文模式", "我的寵物", essay, "", total, detail_scores=scores)
+        # 分數不是這份內容的評分結果時不存內容雜湊
+        advisor.save_practice_record("作文模式", "我的寵物", essay, "", 90, detail_scores={"基礎規範": 30})
+        advisor.save_practice_record("講話轉寫模式", "口語轉書面語練習", essay, "", 90)
+        conn = sqlite3.connect(db_path)
+        hashes = [row[0] for row in conn.execute("SELECT content_hash FROM practice_records ORDER BY record_id")]
+        assert hashes == [advisor.score_key(essay, "我的寵物"), None, None]
+        advisor.close()
+
+        # 重新開啟相同的作文：從練習記錄取回結果，不必重新評分
+        advisor = WritingAdvisor(StorageRouter(shared_db=db_path))
+        score_text = advisor._score_text
+        advisor._score_text = None
+        assert advisor.calculate_score(essay, topic="我的寵物") == (total, scores)
+
+        # 規則或資源更新後舊結果作廢，重新評分
+        advisor._score_text = score_text
+        key = advisor.score_key(essay, "我的寵物")
+        conn.execute("UPDATE student_resources SET content = content || '、好似' WHERE res_type = '比喻詞'")
+        conn.commit()
+        conn.close()
+        time.sleep(advisor._reloader.interval + 0.1)
+        assert advisor.score_key(essay, "我的寵物") != key
+        misses = advisor.score_cache.misses
+        assert advisor.calculate_score(essay, topic="我的寵物") == (total, scores)
+        assert advisor.score_cache.misses == misses + 1
+        advisor.close()
+    print("✅ 作文評分快取成功：相同內容直接沿用結果，規則更新後自動重新評分")
+
 def test_flask_app():
     """測試Web應用"""
     print("\n🔍 正在測試Web應用...")
@@ -148,12 +1543,36 @@ def main():
     test_requirements()
     test_database()
     test_writing_advisor()
+    test_storage_router()
+    test_autosave_journal()
+    test_shared_lexicon()
+    test_score_rollups()
+    test_session_replay()
+    test_analysis_session()
+    test_sentence_segmenter()
+    test_essay_search()
+    test_near_duplicates()
+    test_text_storage()
+    test_record_sync()
+    test_advisor_snapshot()
+    test_class_analytics()
+    test_typo_checker()
+    test_db_backup()
+    test_topic_relevance()
+    test_exemplar_index()
+    test_prefork_server()
+    test_speech_batch()
+    test_speculative_suggestions()
+    test_record_export()
+    test_rule_packs()
+    test_connection_pool()
+    test_score_cache()
     test_flask_app()
     
     print("\n" + "=" * 60)
     print("📋 測試完成！")
     print("💡 啟動應用：python main.py")
-    print("💡 啟動Web服務：python app.py")
+    print("💡 啟動Web服務：python server.py")
     print("=" * 60)
 
 if __name__ == "__main__":
@@ -0,0 +1,260 @@
+import argparse
+import struct
+import zlib
+from collections import Counter
+from functools import cached_property
+
+# 壓縮後的欄位值：1 位元組格式 + 2 位元組字典編號 + raw deflate 資料（BLOB）
+# 未壓縮的舊資料與太短、壓縮後沒有變小的文字仍以 TEXT 儲存，讀取時依型別判斷
+FORMAT_ZLIB = 1
+_HEADER = struct.Struct(">BH")
+NO_DICTIONARY = 0
+
+DICTIONARY_SIZE = 16 * 1024
+TRAINING_SAMPLES = 5000
+COMPRESSION_LEVEL = 6
+# 太短的文字壓縮效益有限，直接存原文
+MIN_COMPRESS_BYTES = 24
+
+
+def install_text_storage(cursor):
+    """建立壓縮字典表（每個資料庫檔案各自保存訓練出的字典）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS text_dictionaries (
+        dict_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dictionary BLOB NOT NULL,
+        sample_count INTEGER NOT NULL DEFAULT 0,
+        created_time DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def train_dictionary(texts, size=DICTIONARY_SIZE):
+    """從作文樣本挑出最常出現的字串組成 zlib 預設字典
+
+    統計 2~6 字的片段，依「出現次數 × 位元組數」挑選，已被選入片段包含的不重複放入；
+    最常用的片段放在字典尾端（deflate 回溯距離較短，編碼較省）。
+    """
+    counts = Counter()
+    for text in texts:
+        for n in range(2, 7):
+            counts.update(text[i:i + n] for i in range(len(text) - n + 1))
+    ranked = sorted(((count * len(gram.encode("utf-8")), gram) for gram, count in counts.items() if count > 1),
+                    reverse=True)
+    chosen, total, joined = [], 0, ""
+    for _, gram in ranked:
+        if gram in joined:
+            continue
+        length = len(gram.encode("utf-8"))
+        if total + length > size:
+            break
+        chosen.append(gram)
+        total += length
+        joined += gram
+    return "".join(reversed(chosen)).encode("utf-8")
+
+
+class TextCodec:
+    """練習記錄文字欄位的編碼器：寫入時以最新字典壓縮，讀取時依標頭的字典編號解壓縮"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._dictionaries = {NO_DICTIONARY: b""}
+        self._active_id = None
+
+    def _dictionary(self, dict_id):
+        dictionary = self._dictionaries.get(dict_id)
+        if dictionary is None:
+            row = self.conn.execute("SELECT dictionary FROM text_dictionaries WHERE dict_id = ?", (dict_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"找不到壓縮字典：{dict_id}")
+            dictionary = self._dictionaries[dict_id] = row[0]
+        return dictionary
+
+    @property
+    def active_id(self):
+        """寫入用的字典編號（尚未訓練時為 NO_DICTIONARY，只做一般壓縮）"""
+        if self._active_id is None:
+            row = self.conn.execute("SELECT MAX(dict_id) FROM text_dictionaries").fetchone()
+            self._active_id = row[0] or NO_DICTIONARY
+        return self._active_id
+
+    def reload(self):
+        """重新讀取最新字典編號（訓練新字典之後呼叫）"""
+        self._active_id = None
+
+    def encode(self, text):
+        """回傳要寫入資料庫的值：壓縮後較小時為 BLOB，否則原樣回傳"""
+        if not text:
+            return text
+        raw = text.encode("utf-8")
+        if len(raw) < MIN_COMPRESS_BYTES:
+            return text
+        dict_id = self.active_id
+        dictionary = self._dictionary(dict_id)
+        if dictionary:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+        packed = _HEADER.pack(FORMAT_ZLIB, dict_id) + compressor.compress(raw) + compressor.flush()
+        return packed if len(packed) < len(raw) else text
+
+    def decode(self, value):
+        """把資料庫讀出的值還原成文字（未壓縮的 TEXT 直接回傳）"""
+        if not isinstance(value, bytes):
+            return value
+        fmt, dict_id = _HEADER.unpack_from(value)
+        if fmt != FORMAT_ZLIB:
+            raise ValueError(f"無法辨識的壓縮格式：{fmt}")
+        dictionary = self._dictionary(dict_id)
+        if dictionary:
+            decompressor = zlib.decompressobj(-15, zdict=dictionary)
+        else:
+            decompressor = zlib.decompressobj(-15)
+        return (decompressor.decompress(value[_HEADER.size:]) + decompressor.flush()).decode("utf-8")
+
+
+class PracticeRecord:
+    """一筆練習記錄；input_text / suggested_text 第一次讀取時才解壓縮"""
+
+    COLUMNS = ("record_id", "student_id", "school_id", "class_id", "practice_mode", "topic",
+               "score", "practice_time", "score_basics", "score_expression", "score_structure", "score_content",
+               "input_text", "suggested_text")
+
+    def __init__(self, codec, row):
+        self._codec = codec
+        (self.record_id, self.student_id, self.school_id, self.class_id, self.practice_mode, self.topic,
+         self.score, self.practice_time, self.score_basics, self.score_expression, self.score_structure,
+         self.score_content, self._input_value, self._suggested_value) = row
+
+    @cached_property
+    def input_text(self):
+        return self._codec.decode(self._input_value)
+
+    @cached_property
+    def suggested_text(self):
+        return self._codec.decode(self._suggested_value)
+
+    def to_dict(self):
+        return {column: getattr(self, column) for column in self.COLUMNS}
+
+
+def get_record(conn, record_id, codec=None):
+    """讀取單筆練習記錄，找不到時回傳None"""
+    row = conn.execute(f"SELECT {', '.join(PracticeRecord.COLUMNS)} FROM practice_records WHERE record_id = ?",
+                       (record_id,)).fetchone()
+    return PracticeRecord(codec or TextCodec(conn), row) if row else None
+
+
+def iter_records(conn, after_id=0, batch_size=500, codec=None, where="", params=(), page_size=None):
+    """依 record_id 順序逐批讀取 after_id 之後的練習記錄（不一次載入全部）
+
+    where/params 為額外的篩選條件。指定 page_size 時依 record_id 分頁重新查詢（keyset 分頁），
+    每頁是一個短的讀取交易，長時間匯出不會一直占住同一個資料庫快照。
+    """
+    codec = codec or TextCodec(conn)
+    sql = f"SELECT {', '.join(PracticeRecord.COLUMNS)} FROM practice_records WHERE record_id > ?"
+    if where:
+        sql += f" AND {where}"
+    sql += " ORDER BY record_id"
+    if page_size:
+        sql += " LIMIT ?"
+    while True:
+        cursor = conn.execute(sql, (after_id, *params, page_size) if page_size else (after_id, *params))
+        count = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield PracticeRecord(codec, row)
+            count += len(rows)
+            after_id = rows[-1][0]
+        if not page_size or count < page_size:
+            return
+
+
+def train_from_records(conn, samples=TRAINING_SAMPLES, size=DICTIONARY_SIZE):
+    """以資料庫中的作文訓練新字典並保存，回傳字典編號（沒有樣本時回傳None）"""
+    codec = TextCodec(conn)
+    total = conn.execute("SELECT COUNT(*) FROM practice_records").fetchone()[0]
+    if not total:
+        return None
+    # 平均抽樣整個資料庫，避免只學到最早或最新的題目
+    step = max(1, total // samples)
+    texts = [codec.decode(value) for (value,) in conn.execute(
+        "SELECT input_text FROM practice_records WHERE record_id % ? = 0 LIMIT ?", (step, samples))]
+    dictionary = train_dictionary(texts, size)
+    if not dictionary:
+        return None
+    cursor = conn.execute("INSERT INTO text_dictionaries (dictionary, sample_count) VALUES (?, ?)",
+                          (dictionary, len(texts)))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def compress_existing(conn, batch_size=500, recompress=False):
+    """原地壓縮既有記錄，每批各自提交（中斷後重新執行會從未完成處繼續）
+
+    recompress=True 時連同以舊字典壓縮的記錄一併改用最新字典。
+    太短而刻意保留原文的欄位不會被選出；內容沒有改變的記錄不寫回也不計數，重複執行不會改動資料庫。
+    回傳（處理筆數, 處理前位元組數, 處理後位元組數）。
+    """
+    codec = TextCodec(conn)
+    active = _HEADER.pack(FORMAT_ZLIB, codec.active_id)
+    condition = ("(typeof(input_text) = 'text' AND length(CAST(input_text AS BLOB)) >= ?) OR "
+                 "(typeof(suggested_text) = 'text' AND length(CAST(suggested_text AS BLOB)) >= ?)")
+    params = (MIN_COMPRESS_BYTES, MIN_COMPRESS_BYTES)
+    if recompress:
+        condition += " OR substr(input_text, 1, 3) != ? OR substr(suggested_text, 1, 3) != ?"
+        params += (active, active)
+    last_id, count, before, after = 0, 0, 0, 0
+    while True:
+        rows = conn.execute(
+            f"SELECT record_id, input_text, suggested_text FROM practice_records "
+            f"WHERE record_id > ? AND ({condition}) ORDER BY record_id LIMIT ?",
+            (last_id, *params, batch_size)).fetchall()
+        if not rows:
+            return count, before, after
+        updates = []
+        for record_id, input_value, suggested_value in rows:
+            input_value, old_input = codec.encode(codec.decode(input_value)), input_value
+            suggested_value, old_suggested = codec.encode(codec.decode(suggested_value)), suggested_value
+            if input_value == old_input and suggested_value == old_suggested:
+                # 壓縮後沒有變小的文字維持原文
+                continue
+            before += _stored_size(old_input) + _stored_size(old_suggested)
+            after += _stored_size(input_value) + _stored_size(suggested_value)
+            updates.append((input_value, suggested_value, record_id))
+        conn.executemany("UPDATE practice_records SET input_text = ?, suggested_text = ? WHERE record_id = ?", updates)
+        conn.commit()
+        last_id = rows[-1][0]
+        count += len(updates)
+
+
+def _stored_size(value):
+    if value is None:
+        return 0
+    return len(value) if isinstance(value, bytes) else len(value.encode("utf-8"))
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="壓縮練習記錄的作文文字")
+    parser.add_argument("--train", action="store_true", help="以現有作文訓練新字典")
+    parser.add_argument("--recompress", action="store_true", help="以最新字典重新壓縮所有記錄")
+    parser.add_argument("--vacuum", action="store_true", help="壓縮後執行VACUUM釋放空間")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    for path in router.shard_paths():
+        conn = router.connection_for_path(path)
+        if args.train or conn.execute("SELECT COUNT(*) FROM text_dictionaries").fetchone()[0] == 0:
+            dict_id = train_from_records(conn)
+            print(f"📖 {path}：已訓練字典 #{dict_id}" if dict_id else f"📖 {path}：沒有記錄可訓練字典")
+        count, before, after = compress_existing(conn, recompress=args.recompress)
+        print(f"✅ {path}：壓縮 {count} 筆，{before} → {after} 位元組")
+        if args.vacuum:
+            conn.execute("VACUUM")
+    router.close()
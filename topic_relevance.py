@@ -0,0 +1,194 @@
+import argparse
+import math
+import os
+import re
+import struct
+from array import array
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+import jieba
+
+# 題目種子語料：「# 題目」開頭的行之後為該題目的範例句
+SEED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "topic_seeds.txt")
+
+# 每個題目保留權重最高的詞數，以及建議中提示的關鍵詞數
+MAX_TERMS = 400
+KEYWORD_COUNT = 3
+# 高分作文才納入語料（低分作文可能本身就離題）
+MIN_SCORE = 80
+# 句子切題分數低於此值、且有足夠的實詞時視為偏離主題
+OFF_TOPIC_THRESHOLD = 0.05
+MIN_CONTENT_WORDS = 3
+
+# 不帶主題意義的常用詞（代名詞、虛詞、泛用的動詞與副詞）
+STOPWORDS = set("""
+的 了 著 得 地 是 在 有 和 與 跟 也 都 就 還 又 很 太 最 更 非常 真 好 把 被 給 讓 使 向 從 對 為 因為 所以 但是 可是
+而且 然後 首先 接著 最後 此外 如果 雖然 一 一個 一起 一直 一點 一下 一樣 這 那 這個 那個 這些 那些 這樣 那樣 這麼 那麼
+我 你 他 她 它 牠 我們 你們 他們 她們 大家 自己 什麼 怎麼 為什麼 哪 誰 個 些 次 種 件 天 今天 每天 時候 的時候
+去 來 到 說 想 看 要 會 能 可以 覺得 知道 喜歡 開心 快樂 上 下 裡 中 後 前 再 才 已經 正在 嗎 呢 吧 啊 呀 哦 喔 極了
+""".split())
+
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+_HEADER = struct.Struct(">I")
+
+TopicProfile = namedtuple("TopicProfile", ["weights", "keywords"])
+TopicProfile.__doc__ = """題目的稀疏詞權重向量（詞 → 權重，已正規化為單位長度）與權重最高的幾個關鍵詞"""
+
+
+def content_words(words):
+    """保留有主題意義的詞（中文、非停用詞）"""
+    return [word for word in words if word not in STOPWORDS and _CJK_RE.search(word)]
+
+
+def install_topic_profiles(cursor):
+    """建立題目向量表（每個題目一列，詞與權重打包成 BLOB）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS topic_profiles (
+        topic TEXT PRIMARY KEY,
+        vector BLOB NOT NULL,
+        doc_count INTEGER NOT NULL DEFAULT 0,
+        built_time DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+def pack_vector(weights):
+    """詞數 + float32 權重陣列 + 以 \\0 分隔的詞（依權重由高到低）"""
+    terms = sorted(weights, key=weights.get, reverse=True)
+    return (_HEADER.pack(len(terms)) + array("f", [weights[term] for term in terms]).tobytes()
+            + "\0".join(terms).encode("utf-8"))
+
+
+def unpack_vector(blob):
+    (count,) = _HEADER.unpack_from(blob)
+    values = array("f")
+    values.frombytes(blob[_HEADER.size:_HEADER.size + 4 * count])
+    terms = blob[_HEADER.size + 4 * count:].decode("utf-8").split("\0") if count else []
+    return dict(zip(terms, values))
+
+
+def read_seeds(path=SEED_PATH):
+    """讀取題目種子語料，回傳 題目 → 範例句清單"""
+    seeds, topic = {}, None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#"):
+                topic = line.lstrip("#").strip()
+                seeds.setdefault(topic, [])
+            elif line and topic:
+                seeds[topic].append(line)
+    return seeds
+
+
+def compute_profiles(topic_texts, max_terms=MAX_TERMS):
+    """以「每個題目為一份文件」計算 TF-IDF：各題目都常用的詞權重低，只屬於某題目的詞權重高
+
+    topic_texts：題目 → 文字清單。回傳 題目 → 詞權重（單位長度，只保留前 max_terms 個）。
+    """
+    term_counts = {topic: Counter(word for text in texts for word in content_words(jieba.lcut(text)))
+                   for topic, texts in topic_texts.items()}
+    document_frequency = Counter(word for counts in term_counts.values() for word in counts)
+    total = len(term_counts)
+    profiles = {}
+    for topic, counts in term_counts.items():
+        weights = {word: (1 + math.log(count)) * (math.log((1 + total) / (1 + document_frequency[word])) + 1)
+                   for word, count in counts.items()}
+        top = sorted(weights, key=weights.get, reverse=True)[:max_terms]
+        norm = math.sqrt(sum(weights[word] ** 2 for word in top)) or 1.0
+        profiles[topic] = {word: weights[word] / norm for word in top}
+    return profiles
+
+
+def to_profile(weights):
+    keywords = [word for word in sorted(weights, key=weights.get, reverse=True) if len(word) >= 2]
+    return TopicProfile(weights, tuple(keywords[:KEYWORD_COUNT]))
+
+
+@lru_cache(maxsize=1)
+def seed_profiles():
+    """只以內建種子語料計算的題目向量（同一進程只算一次）"""
+    return {topic: to_profile(weights) for topic, weights in compute_profiles(read_seeds()).items()}
+
+
+def load_topic_profiles(conn):
+    """讀取資料庫中的題目向量；尚未建立時使用種子語料的向量"""
+    rows = conn.execute("SELECT topic, vector FROM topic_profiles").fetchall()
+    if rows:
+        return {topic: to_profile(unpack_vector(blob)) for topic, blob in rows}
+    return seed_profiles()
+
+
+def topic_score(profile, words):
+    """句子與題目的切題分數（0~1）：句子詞頻向量正規化後與題目向量做一次稀疏內積"""
+    counts = Counter(content_words(words))
+    if not counts:
+        return 0.0
+    norm = math.sqrt(sum(count * count for count in counts.values()))
+    weights = profile.weights
+    return sum(weights.get(word, 0.0) * count for word, count in counts.items()) / norm
+
+
+def is_off_topic(profile, words):
+    """句子有足夠的實詞、卻幾乎沒有與題目相關的詞"""
+    return len(content_words(words)) >= MIN_CONTENT_WORDS and topic_score(profile, words) < OFF_TOPIC_THRESHOLD
+
+
+def collect_essays(router, min_score=MIN_SCORE):
+    """從所有分庫讀取作文模式的高分作文，回傳 題目 → 作文清單"""
+    from text_storage import TextCodec
+
+    essays = {}
+    for _, conn in router.iter_shards():
+        codec = TextCodec(conn)
+        for topic, value in conn.execute(
+                "SELECT topic, input_text FROM practice_records WHERE practice_mode = '作文模式' AND score >= ?",
+                (min_score,)):
+            essays.setdefault(topic, []).append(codec.decode(value))
+    return essays
+
+
+def build_topic_profiles(router, seed_path=SEED_PATH, min_score=MIN_SCORE):
+    """以種子語料與高分作文計算所有題目的向量，整批寫入共用庫（執行中的建議生成器會自動重新載入）"""
+    topic_texts = read_seeds(seed_path)
+    essays = collect_essays(router, min_score)
+    for topic, texts in essays.items():
+        topic_texts.setdefault(topic, []).extend(texts)
+    profiles = compute_profiles(topic_texts)
+    conn = router.connect_shared(read_only=False)
+    try:
+        install_topic_profiles(conn.cursor())
+        conn.execute("DELETE FROM topic_profiles")
+        conn.executemany("INSERT INTO topic_profiles (topic, vector, doc_count) VALUES (?, ?, ?)",
+                         [(topic, pack_vector(weights), len(essays.get(topic, ())))
+                          for topic, weights in profiles.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    return {topic: len(essays.get(topic, ())) for topic in profiles}
+
+
+if __name__ == "__main__":
+    from storage_router import StorageRouter
+
+    parser = argparse.ArgumentParser(description="以種子語料與高分作文建立作文題目的切題向量")
+    parser.add_argument("--seeds", default=SEED_PATH, help="題目種子語料檔")
+    parser.add_argument("--min-score", type=float, default=MIN_SCORE, help="作文納入語料的最低分數")
+    parser.add_argument("--show", default=None, help="顯示某個題目權重最高的詞")
+    args = parser.parse_args()
+
+    router = StorageRouter.from_env()
+    if args.show:
+        conn = router.connect_shared()
+        profile = load_topic_profiles(conn).get(args.show)
+        conn.close()
+        if profile is None:
+            print(f"❌ 沒有題目：{args.show}")
+        else:
+            for word, weight in sorted(profile.weights.items(), key=lambda item: -item[1])[:30]:
+                print(f"{word}\t{weight:.3f}")
+    else:
+        for topic, count in build_topic_profiles(router, args.seeds, args.min_score).items():
+            print(f"✅ {topic}：{count} 篇高分作文")
+    router.close()
@@ -0,0 +1,232 @@
+import argparse
+import json
+import math
+import mmap
+import os
+import re
+import sqlite3
+from collections import Counter, namedtuple
+from functools import cached_property
+
+from shared_lexicon import MappedTable, buffer_checksum, pack_hash_table, pack_sections, read_sections, write_sections
+
+# 錯別字模型檔（設定後各進程映射同一份檔案；未設定且預設檔不存在時，以內建語料在記憶體中建立）
+MODEL_ENV = "WRITING_TYPO_MODEL"
+DEFAULT_MODEL_PATH = "typo_model.bin"
+SEED_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "typo_corpus.txt")
+
+MAGIC = b"WTYP\x00\x01\x00\x00"
+
+# 混淆集：同一組內的字常被寫錯成彼此
+CONFUSION_SETS = [
+    ("的", "得", "地"),
+    ("在", "再"),
+    ("做", "作"),
+    ("已", "以"),
+    ("那", "哪"),
+    ("像", "象"),
+    ("帶", "戴"),
+    ("坐", "座"),
+    ("到", "道"),
+]
+_GROUPS = {char: group for group in CONFUSION_SETS for char in group}
+
+# 非中文字（標點、空白、句首句尾）一律以此符號表示
+BOUNDARY = "#"
+_NON_CJK_RE = re.compile(r"[^㐀-鿿豈-﫿]")
+
+# 加法平滑值、估計的可能前後字數，以及改字所需的最低對數機率差（約 e^2 ≈ 7 倍）
+SMOOTHING = 0.5
+CONTEXT_VOCABULARY = 5000
+MIN_MARGIN = 2.0
+# 建議的字在此上下文至少要出現的次數（左右兩側都要出現過，只看一側容易誤判，如「我再也」）
+MIN_EVIDENCE = 2
+
+Typo = namedtuple("Typo", ["position", "wrong", "correct", "group"])
+Typo.__doc__ = """疑似錯別字：position 為在句子中的位置，group 為所屬混淆集（如「的/得/地」）"""
+
+
+def _normalize(text):
+    return BOUNDARY * 2 + _NON_CJK_RE.sub(BOUNDARY, text) + BOUNDARY * 2
+
+
+def _features(chars, i, candidate):
+    """候選字在位置 i 的上下文特徵：左右兩字、左右三字、置中三字"""
+    a, b, c, d = chars[i - 2], chars[i - 1], chars[i + 1], chars[i + 2]
+    return (b + candidate, candidate + c, a + b + candidate, b + candidate + c, candidate + c + d)
+
+
+# 各特徵是否含左側字、右側字（與 _features 的順序對應）
+_LEFT_FEATURES = (True, False, True, True, False)
+_RIGHT_FEATURES = (False, True, False, True, True)
+
+
+def count_ngrams(texts):
+    """統計含混淆字的 1~3 字片段（只保留判斷需要的片段，模型檔因此很小）"""
+    counts = Counter()
+    for text in texts:
+        chars = _normalize(text)
+        for i in range(2, len(chars) - 2):
+            if chars[i] in _GROUPS:
+                counts[chars[i]] += 1
+                counts.update(_features(chars, i, chars[i]))
+    return counts
+
+
+def _pack_model(counts):
+    meta = {"groups": ["/".join(group) for group in CONFUSION_SETS], "entries": len(counts)}
+    return [
+        ("meta", json.dumps(meta, ensure_ascii=False).encode("utf-8")),
+        ("ngrams", pack_hash_table(counts.items())),
+    ]
+
+
+class TypoChecker:
+    """以字元 n-gram 次數判斷混淆字是否用錯
+
+    對句中每個混淆字，比較同組每個候選字在此上下文出現的機率
+    （先驗次數 × 左右兩字、三字片段的條件機率，樸素貝氏合併），
+    其他候選字明顯較可能、且左右兩側的上下文在語料中都出現過時，才判定為錯字；
+    兩個以上的候選字不相上下時不建議（如「高興的跳起來」可改「得」也可改「地」）。
+    次數表為映射檔中的唯讀雜湊表，每個混淆字只需十幾次查表。
+    """
+
+    def __init__(self, buffer, path=""):
+        self._buffer = buffer
+        sections = read_sections(buffer, MAGIC, path)
+        offset, length = sections["meta"]
+        self.meta = json.loads(bytes(buffer[offset:offset + length]).decode("utf-8"))
+        self.counts = MappedTable(buffer, sections["ngrams"][0])
+        self._mmap = None
+
+    @classmethod
+    def open(cls, path):
+        """映射模型檔"""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        checker = cls(mapped, path)
+        checker._mmap = mapped
+        return checker
+
+    @cached_property
+    def checksum(self):
+        """模型內容的雜湊（評分快取鍵的一部分，重建模型後就不同）"""
+        return buffer_checksum(self._buffer)
+
+    @classmethod
+    def from_texts(cls, texts):
+        """直接以語料在記憶體中建立（不寫檔）"""
+        return cls(pack_sections(MAGIC, _pack_model(count_ngrams(texts))))
+
+    def _score(self, chars, i, candidate):
+        """回傳（對數機率, 上下文證據是否足夠）"""
+        get = self.counts.get
+        unigram = get(candidate, 0)
+        score = math.log(unigram + SMOOTHING)
+        denominator = math.log(unigram + SMOOTHING * CONTEXT_VOCABULARY)
+        evidence = left = right = 0
+        for feature, is_left, is_right in zip(_features(chars, i, candidate), _LEFT_FEATURES, _RIGHT_FEATURES):
+            count = get(feature, 0)
+            evidence += count
+            if is_left:
+                left += count
+            if is_right:
+                right += count
+            score += math.log(count + SMOOTHING) - denominator
+        return score, evidence >= MIN_EVIDENCE and left > 0 and right > 0
+
+    def check(self, text):
+        """回傳句子中疑似用錯的混淆字清單"""
+        typos = []
+        chars = None
+        for position, char in enumerate(text):
+            group = _GROUPS.get(char)
+            if group is None:
+                continue
+            if chars is None:
+                chars = _normalize(text)
+            i = position + 2
+            current, _ = self._score(chars, i, char)
+            scores = sorted((self._score(chars, i, candidate) + (candidate,)
+                             for candidate in group if candidate != char), reverse=True)
+            best_score, supported, best = scores[0]
+            runner_up = scores[1][0] if len(scores) > 1 else -math.inf
+            if supported and best_score >= current + MIN_MARGIN and best_score >= runner_up + MIN_MARGIN:
+                typos.append(Typo(position, char, best, "/".join(group)))
+        return typos
+
+    def correct(self, text, typos=None):
+        """把疑似錯字換成建議的字"""
+        typos = self.check(text) if typos is None else typos
+        chars = list(text)
+        for typo in typos:
+            chars[typo.position] = typo.correct
+        return "".join(chars)
+
+    def close(self):
+        self.counts.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+
+def read_corpus(paths):
+    """逐行讀取語料檔（每行一句或一篇）"""
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+
+
+def read_essays(db_path, min_score=80):
+    """讀取資料庫中的高分作文作為語料（低分作文可能本身就有錯字）"""
+    from text_storage import TextCodec
+
+    conn = sqlite3.connect(db_path)
+    codec = TextCodec(conn)
+    try:
+        for (value,) in conn.execute("SELECT input_text FROM practice_records WHERE score >= ?", (min_score,)):
+            yield codec.decode(value)
+    finally:
+        conn.close()
+
+
+def build_typo_model(output_path=DEFAULT_MODEL_PATH, corpus_paths=(SEED_CORPUS,), db_path=None, min_score=80):
+    """以語料檔（與選擇性的高分作文）統計次數，輸出模型檔"""
+    texts = list(read_corpus(corpus_paths))
+    if db_path:
+        texts.extend(read_essays(db_path, min_score))
+    counts = count_ngrams(texts)
+    write_sections(output_path, MAGIC, _pack_model(counts))
+    print(f"✅ 錯別字模型已建立：{output_path}（{len(texts)} 段語料，{len(counts)} 個片段）")
+    return output_path
+
+
+_loaded = {}
+
+def load_typo_checker(path=None):
+    """取得錯別字檢查器（同一進程共用）：優先使用環境變數或預設路徑的模型檔，都沒有時以內建語料建立"""
+    path = path or os.environ.get(MODEL_ENV) or (DEFAULT_MODEL_PATH if os.path.exists(DEFAULT_MODEL_PATH) else None)
+    key = os.path.abspath(path) if path else None
+    if key not in _loaded:
+        _loaded[key] = TypoChecker.open(path) if path else TypoChecker.from_texts(read_corpus([SEED_CORPUS]))
+    return _loaded[key]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="建立或測試的/得/地與常見同音字的錯別字模型")
+    parser.add_argument("--output", default=DEFAULT_MODEL_PATH, help="模型檔路徑")
+    parser.add_argument("--corpus", action="append", default=None, help="語料檔（每行一句，可重複指定；預設為內建語料）")
+    parser.add_argument("--db", default=None, help="加入此資料庫中的高分作文")
+    parser.add_argument("--min-score", type=float, default=80, help="作文納入語料的最低分數")
+    parser.add_argument("--check", default=None, help="檢查一個句子（使用 --output 指定的模型檔）")
+    args = parser.parse_args()
+
+    if args.check:
+        checker = load_typo_checker(args.output if os.path.exists(args.output) else None)
+        typos = checker.check(args.check)
+        for typo in typos:
+            print(f"❌ 第{typo.position + 1}字「{typo.wrong}」→「{typo.correct}」（{typo.group}）")
+        print(f"✅ {checker.correct(args.check, typos)}" if typos else "✅ 沒有發現常見錯別字")
+    else:
+        build_typo_model(args.output, args.corpus or [SEED_CORPUS], args.db, args.min_score)
@@ -1,62 +1,240 @@
 import jieba
 import sqlite3
+import os
 import random
+from storage_router import StorageRouter
+from connection_pool import ReadOnlyPool, WriterThread
+from score_cache import ScoreCache, content_hash, stored_score
+from db_init import SUB_SCORE_COLUMNS
+import shared_lexicon
+import essay_search
+import near_duplicates
+import typo_checker
+import topic_relevance
+import exemplar_index
+from text_storage import TextCodec
+from advisor_snapshot import AdvisorSnapshot, SnapshotReloader, index_rules
+from analysis_session import AnalysisSession, STREAK_LENGTH
+from sentence_segmenter import iter_sentences, last_sentence
+
+# 分析用資源的適用年級
+RESOURCE_GRADE = "3-6年級"
+
+# 定義關鍵詞庫（主語、賓語不在資源表中）
+SUBJECT_WORDS = ["我", "你", "他", "她", "它", "我們", "他們", "小明", "小紅", "寵物", "學校", "公園", "媽媽", "爸爸"]
+OBJECT_WORDS = ["書", "玩具", "朋友", "風景", "故事", "作業", "寵物", "公園", "禮物", "遊戲"]
+
+# 優先顯示的建議（依序排在其他建議前面）
+PRIORITY_TRIGGERS = ("出現常見錯別字", "句子偏離主題")
+
+# 口語轉書面語的替換規則（依序套用）
+COLLOQUIAL_REPLACEMENTS = [("啦", "了"), ("喔", "哦"), ("呢", ""),
+                           ("然後呢", "然後"), ("後來呀", "後來"), ("就是說", "也就是")]
+
+# 句子成分旗標，每個詞彙編譯成位元遮罩（第i個旗標對應第i位）
+ANALYSIS_FLAGS = ["has_subject", "has_predicate", "has_object", "has_rhetoric", "has_adj", "has_detail", "has_feeling",
+                  "has_metaphor", "has_personify", "has_connector"]
+
+def compile_word_flags(resources):
+    """把資源詞彙編譯成「詞彙→成分位元遮罩」對照表，分析時每個詞只查一次"""
+    sources = {
+        "has_subject": SUBJECT_WORDS,
+        "has_predicate": resources["謂語"],
+        "has_object": OBJECT_WORDS,
+        "has_rhetoric": resources["比喻詞"] + resources["擬人詞"],
+        "has_adj": resources["形容詞"],
+        "has_detail": resources["時間詞"] + resources["地點詞"],
+        "has_feeling": resources["感受詞"],
+        "has_metaphor": resources["比喻詞"],
+        "has_personify": resources["擬人詞"],
+        "has_connector": resources["銜接詞"],
+    }
+    word_flags = {}
+    for bit, flag in enumerate(ANALYSIS_FLAGS):
+        for word in sources[flag]:
+            word_flags[word] = word_flags.get(word, 0) | (1 << bit)
+    return word_flags
+
+def find_finished_sentence(text):
+    """若文末剛結束一個句子（句末標點或換行），回傳（起點, 終點, 句子），否則回傳None
+
+    只從文末往回找最後一句，不切分全文；編輯器與重播工具共用此判斷。
+    """
+    span = last_sentence(text)
+    if span is None:
+        return None
+    if text.endswith("\n") or (span.terminated and span.end == len(text)):
+        return span.start, span.end, span.body
+    return None
+
+def to_written_language(text):
+    """口語轉書面語：刪除或替換口語助詞"""
+    for colloquial, written in COLLOQUIAL_REPLACEMENTS:
+        text = text.replace(colloquial, written)
+    return text
+
+def resources_from_rows(rows):
+    """由（類型, 內容, 年級）資料列組成資源詞庫：以分析年級為主，其餘年級僅補上缺少的類型（如4-6年級的道理詞）
+
+    多個規則包提供同類型、同年級的資源時合併詞語。
+    """
+    resources, grades = {}, {}
+    for res_type, content, grade_range in rows:
+        words = content.split("、")
+        if res_type not in resources or (grade_range == RESOURCE_GRADE and grades[res_type] != RESOURCE_GRADE):
+            resources[res_type], grades[res_type] = words, grade_range
+        elif grade_range == grades[res_type]:
+            resources[res_type] = list(dict.fromkeys(resources[res_type] + words))
+    return resources
+
+def insert_practice_record(cursor, codec, student_id, school_id, class_id, practice_mode, topic,
+                           input_text, suggested_text, score, practice_time=None, detail_scores=None,
+                           content_hash=None):
+    """寫入一筆練習記錄並建立搜尋索引與相似度簽章（不提交交易），回傳記錄編號
+
+    detail_scores 為 calculate_score 回傳的分項得分，未提供的項目存為NULL；
+    content_hash 只在分數確實是這份內容的評分結果時提供（之後相同內容可直接沿用）。
+    """
+    detail_scores = detail_scores or {}
+    sub_scores = [detail_scores.get(name) for name, _, _ in SUB_SCORE_COLUMNS]
+    cursor.execute(f'''
+    INSERT INTO practice_records (student_id, school_id, class_id, practice_mode, topic, input_text, suggested_text, score,
+                                  practice_time, {", ".join(column for _, column, _ in SUB_SCORE_COLUMNS)}, content_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), {", ".join("?" * len(SUB_SCORE_COLUMNS))}, ?)
+    ''', (student_id, school_id, class_id, practice_mode, topic,
+          codec.encode(input_text), codec.encode(suggested_text), score, practice_time, *sub_scores, content_hash))
+    record_id = cursor.lastrowid
+    essay_search.index_record(cursor, record_id, input_text)
+    near_duplicates.index_record(cursor, record_id, input_text)
+    return record_id
 
 class WritingAdvisor:
-    def __init__(self):
-        self.conn = sqlite3.connect("student_writing.db")
-        self.cursor = self.conn.cursor()
-        self.resources = self._load_resources()
-
-    def _load_resources(self):
-        """加載國小生常用資源庫"""
-        resources = {}
-        self.cursor.execute("SELECT res_type, content FROM student_resources WHERE grade_range='3-6年級'")
-        for res_type, content in self.cursor.fetchall():
-            resources[res_type] = content.split("、")
-        return resources
+    def __init__(self, router=None, lexicon_path=None):
+        # 規則與資源從共用庫讀取，練習記錄由路由決定寫入哪個分庫
+        self.router = router or StorageRouter.from_env()
+        # 共用庫的唯讀連線池（每個執行緒各一條），只用於重新載入規則與範例句快照
+        self.readers = ReadOnlyPool(self.router.shared_path)
+        # 練習記錄一律交給唯一的寫入執行緒，以它自己的路由（連線只在該執行緒開啟）寫入
+        self.writer = WriterThread("advisor-writer")
+        self._write_router = self.router.clone()
+        # 各分庫連線的文字壓縮編碼器（字典存在各自的資料庫檔案裡，只在寫入執行緒使用）
+        self._codecs = {}
+        # 作文評分結果快取：記憶體中保留最近的結果，資料庫中查預設練習記錄庫（不分學校班級的分庫）
+        self.score_cache = ScoreCache()
+        self._record_readers = self.readers
+        if self.router.sharded:
+            self._record_readers = ReadOnlyPool(self.router.shard_path(self.router.shard_key()))
+        # 多進程伺服器可指定共用詞典檔：分詞詞典與資源詞庫直接映射，不必各自解析
+        lexicon_path = lexicon_path or os.environ.get(shared_lexicon.LEXICON_ENV)
+        self.lexicon = shared_lexicon.open_shared_lexicon(lexicon_path) if lexicon_path else None
+        if self.lexicon is not None:
+            self.lexicon.install_into_jieba()
+        # 的/得/地與常見同音字的錯字模型（同一進程共用）
+        self.typo_checker = typo_checker.load_typo_checker()
+        self._reloader = None
+        self._reloader = SnapshotReloader(self.readers.connection, self._load_snapshot)
+        # 高分作文範例句的倒排索引（離線工作更新後自動重新載入）
+        self._exemplars = SnapshotReloader(self.readers.connection, exemplar_index.ExemplarIndex.load,
+                                           name="exemplars")
+        self._vocabulary = None
 
-    def _analyze_sentence(self, sentence, prev_sentence=""):
-        """分析句子成分和觸發規則"""
-        words = jieba.lcut(sentence.strip())
-        analysis = {
-            "has_subject": False,
-            "has_predicate": False,
-            "has_object": False,
-            "has_rhetoric": False,
-            "has_adj": False,
-            "has_detail": False,
-            "has_feeling": False,
-            "sentence_length": len(words),
-            "prev_similarity": self._calc_similarity(words, jieba.lcut(prev_sentence.strip()))
-        }
+    def _load_snapshot(self, conn, version):
+        """從共用庫讀取規則與資源，建立新的快照（不同規則包宣告的相同規則只取一條）"""
+        rules, grade_rules = index_rules(conn.execute('''
+        SELECT grade_range, trigger_condition, rule_type, suggestion_template FROM writing_rules
+        GROUP BY grade_range, trigger_condition, rule_type, suggestion_template ORDER BY MIN(rule_id)
+        '''))
+        if self.lexicon is not None and self.lexicon.meta.get("config_version") == version:
+            # 詞典檔建立時的規則版本與資料庫相同時直接使用它的資源；建檔後資源有更新就改從資料庫讀取
+            resources = self.lexicon.resources()
+            # 舊版詞典檔的旗標定義不同時，改在本進程重新編譯
+            if self.lexicon.meta.get("flags") == ANALYSIS_FLAGS:
+                word_flags = self.lexicon.word_flags
+            else:
+                word_flags = compile_word_flags(resources)
+        else:
+            resources = resources_from_rows(conn.execute("SELECT res_type, content, grade_range FROM student_resources"))
+            word_flags = compile_word_flags(resources)
+        resources = {res_type: tuple(words) for res_type, words in resources.items()}
+        topics = topic_relevance.load_topic_profiles(conn)
+        return AdvisorSnapshot(version, rules, grade_rules, resources, word_flags, topics)
+
+    @property
+    def conn(self):
+        """目前執行緒的共用庫唯讀連線"""
+        return self.readers.connection()
+
+    @property
+    def snapshot(self):
+        """目前的規則資源快照（規則變更後最晚約半秒內換成新快照）"""
+        return self._reloader.current()
+
+    @property
+    def resources(self):
+        return self.snapshot.resources
+
+    @property
+    def word_flags(self):
+        return self.snapshot.word_flags
+
+    def find_exemplars(self, sentence, topic=None, limit=2, words=None):
+        """找出與句子用詞相關的高分作文範例句（不含句子本身）"""
+        snapshot = self.snapshot
+        if self._vocabulary is None or self._vocabulary[0] != snapshot.version:
+            words_in_resources = sorted({word for group in snapshot.resources.values() for word in group},
+                                        key=len, reverse=True)
+            self._vocabulary = (snapshot.version, tuple(words_in_resources))
+        terms = exemplar_index.sentence_terms(sentence, self._vocabulary[1], words)
+        return self._exemplars.current().find(terms, topic, limit, exclude=(sentence.strip(),))
+
+    @property
+    def exemplar_version(self):
+        return self._exemplars.current().version
+
+    def _sentence_context(self, sentence, topic, words):
+        """只看句子與題目的判斷（與上下句無關）：是否偏離主題、用詞相關的範例句"""
+        profile = self.snapshot.topics.get(topic)
+        off_topic = profile is not None and topic_relevance.is_off_topic(profile, words)
+        return off_topic, self.find_exemplars(sentence, topic, limit=1, words=words)
+
+    def speculate(self, text, session):
+        """編輯器閒置時呼叫：預先分析正在輸入、尚未結束的句子
 
-        # 定義關鍵詞庫
-        subjects = ["我", "你", "他", "她", "它", "我們", "他們", "小明", "小紅", "寵物", "學校", "公園", "媽媽", "爸爸"]
-        predicates = self.resources["謂語"]
-        objects = ["書", "玩具", "朋友", "風景", "故事", "作業", "寵物", "公園", "禮物", "遊戲"]
-        rhetoric_words = self.resources["比喻詞"] + self.resources["擬人詞"]
-        adjectives = self.resources["形容詞"]
-        detail_words = self.resources["時間詞"] + self.resources["地點詞"]
-        feeling_words = self.resources["感受詞"]
+        分詞、成分、錯別字、切題與範例句都先算好並存在 session；學生打出句號時，
+        只要比對規則並把句子填入模板。回傳預先分析的句子，沒有需要分析的句子時回傳None。
+        """
+        span = last_sentence(text)
+        if span is None or span.terminated or text.endswith("\n") or len(span.body) < 2:
+            return None
+        session.prepare(span.body)
+        return span.body
 
-        # 匹配關鍵詞
+    def new_session(self, topic=None):
+        """建立編輯器用的逐句分析狀態"""
+        return AnalysisSession(self, topic)
+
+    def _sentence_features(self, sentence):
+        """分詞並標記句子成分與疑似錯別字（不含上下句相似度）"""
+        words = jieba.lcut(sentence.strip())
+        features = {flag: False for flag in ANALYSIS_FLAGS}
+        features["sentence_length"] = len(words)
+        features["words"] = words
+        features["typos"] = self.typo_checker.check(sentence.strip())
+
+        # 匹配關鍵詞（合併每個詞的成分位元遮罩）
+        mask = 0
         for word in words:
-            if word in subjects:
-                analysis["has_subject"] = True
-            if word in predicates:
-                analysis["has_predicate"] = True
-            if word in objects:
-                analysis["has_object"] = True
-            if word in rhetoric_words:
-                analysis["has_rhetoric"] = True
-            if word in adjectives:
-                analysis["has_adj"] = True
-            if word in detail_words:
-                analysis["has_detail"] = True
-            if word in feeling_words:
-                analysis["has_feeling"] = True
+            mask |= self.word_flags.get(word, 0)
+        for bit, flag in enumerate(ANALYSIS_FLAGS):
+            if mask >> bit & 1:
+                features[flag] = True
+        return features
 
+    def _analyze_sentence(self, sentence, prev_sentence=""):
+        """分析句子成分和觸發規則"""
+        analysis = self._sentence_features(sentence)
+        words = analysis.pop("words")
+        analysis["prev_similarity"] = self._calc_similarity(words, jieba.lcut(prev_sentence.strip()))
         return analysis
 
     def _calc_similarity(self, words1, words2):
@@ -66,19 +244,53 @@ class WritingAdvisor:
         common = set(words1) & set(words2)
         return len(common) / len(set(words1 + words2)) if (words1 + words2) else 0.0
 
-    def generate_suggestions(self, sentence, prev_sentence="", grade="3-6年級"):
-        """生成3個個人化優化建議"""
-        analysis = self._analyze_sentence(sentence, prev_sentence)
+    def check_finished_sentence(self, text, prev_sentence="", grade="3-6年級", session=None):
+        """編輯器文字變更時呼叫：剛結束新的句子時回傳（起點, 終點, 句子, 建議），否則回傳None"""
+        finished = find_finished_sentence(text)
+        if finished is None:
+            return None
+        start, end, sentence = finished
+        if not sentence or sentence == prev_sentence or len(sentence) < 2:
+            return None
+        return start, end, sentence, self.generate_suggestions(sentence, prev_sentence, grade, session)
+
+    def generate_suggestions(self, sentence, prev_sentence="", grade="3-6年級", session=None, topic=None):
+        """生成3個個人化優化建議
+
+        傳入 session（編輯器的逐句分析狀態）時，連續規則依最近幾句判斷，
+        上下句相似度直接使用上一句已分好的詞；未傳入時只看本句（造句、轉寫模式）。
+        有作文題目（topic 或 session.topic）時另外檢查句子是否切題。
+        """
+        if session is not None:
+            analysis = session.observe(sentence)
+            no_metaphor = session.streak("has_metaphor") >= STREAK_LENGTH
+            no_personify = session.streak("has_personify") >= STREAK_LENGTH
+            topic = topic or session.topic
+            # 打字暫停時已預先分析過這句的話，直接取用
+            words, (off_topic, exemplars) = session.prepare(sentence, topic)
+        else:
+            analysis = self._analyze_sentence(sentence, prev_sentence)
+            no_metaphor = not analysis["has_rhetoric"]
+            no_personify = False
+            words = jieba.lcut(sentence)
+            off_topic, exemplars = self._sentence_context(sentence, topic, words)
         suggestions = []
+        snapshot = self.snapshot
+        profile = snapshot.topics.get(topic)
 
         # 匹配觸發規則
         trigger_conditions = []
+        typos = analysis["typos"]
+        if typos:
+            trigger_conditions.append("出現常見錯別字")
         if not analysis["has_predicate"]:
             trigger_conditions.append("句子無謂語")
         if not analysis["has_adj"]:
             trigger_conditions.append("句子無形容詞")
-        if not analysis["has_rhetoric"]:
+        if no_metaphor:
             trigger_conditions.append("連續3句無比喻詞")
+        if no_personify:
+            trigger_conditions.append("連續3句無擬人詞")
         if analysis["prev_similarity"] < 0.3:
             trigger_conditions.append("上下句關鍵詞相似度<30%")
         if analysis["sentence_length"] < 8:
@@ -87,50 +299,49 @@ class WritingAdvisor:
             trigger_conditions.append("句子無細節描寫")
         if not analysis["has_feeling"]:
             trigger_conditions.append("句子無感受詞")
+        if off_topic:
+            trigger_conditions.append("句子偏離主題")
 
-        # 查詢匹配規則
+        # 從快照取出匹配規則（不查詢資料庫）
         if trigger_conditions:
-            placeholders = ", ".join(["?"] * len(trigger_conditions))
-            self.cursor.execute(f'''
-            SELECT rule_type, suggestion_template FROM writing_rules 
-            WHERE grade_range=? AND trigger_condition IN ({placeholders})
-            ''', (grade,) + tuple(trigger_conditions))
-            matched_rules = self.cursor.fetchall()
+            matched_rules = [rule for trigger in trigger_conditions for rule in snapshot.rules.get((grade, trigger), ())]
             random.shuffle(matched_rules)
+            # 錯別字、偏離主題的建議固定排在最前面
+            priority = [rule for trigger in PRIORITY_TRIGGERS if trigger in trigger_conditions
+                        for rule in snapshot.rules.get((grade, trigger), ())]
+            if priority:
+                matched_rules.sort(key=lambda rule: priority.index(rule) if rule in priority else len(priority))
         else:
             # 無觸發規則時返回通用建議
-            self.cursor.execute('''
-            SELECT rule_type, suggestion_template FROM writing_rules 
-            WHERE grade_range=? LIMIT 3
-            ''', (grade,))
-            matched_rules = self.cursor.fetchall()
+            matched_rules = list(snapshot.grade_rules.get(grade, ())[:3])
 
         # 提取句子核心成分
-        words = jieba.lcut(sentence)
+        resources = snapshot.resources
         subject = next((w for w in words if w in ["我", "你", "他", "寵物", "學校"]), "我")
         object_word = next((w for w in words if w in ["玩具", "朋友", "風景", "寵物"]), "事情")
-        predicate = random.choice(self.resources["謂語"])
-        adj = random.choice(self.resources["形容詞"])
-        metaphor = random.choice(self.resources["比喻詞"])
-        connector = random.choice(self.resources["銜接詞"])
-        personify = random.choice(self.resources["擬人詞"])
-        time_word = random.choice(self.resources["時間詞"])
-        place_word = random.choice(self.resources["地點詞"])
-        feeling = random.choice(self.resources["感受詞"])
-        vehicle = random.choice(self.resources["喻體"])
-        truth = random.choice(self.resources["道理詞"])
+        predicate = random.choice(resources["謂語"])
+        adj = random.choice(resources["形容詞"])
+        metaphor = random.choice(resources["比喻詞"])
+        connector = random.choice(resources["銜接詞"])
+        personify = random.choice(resources["擬人詞"])
+        time_word = random.choice(resources["時間詞"])
+        place_word = random.choice(resources["地點詞"])
+        feeling = random.choice(resources["感受詞"])
+        vehicle = random.choice(resources["喻體"])
+        truth = random.choice(resources["道理詞"])
 
         # 填充建議模板
         for rule_type, template in matched_rules[:3]:
             suggested = template.replace("【主語】", subject)
             suggested = suggested.replace("【謂語】", predicate)
-            suggested = suggested.replace("【推薦謂語】", random.choice(self.resources["謂語"]))
+            suggested = suggested.replace("【推薦謂語】", random.choice(resources["謂語"]))
             suggested = suggested.replace("【形容詞】", adj)
             suggested = suggested.replace("【比喻詞】", metaphor)
             suggested = suggested.replace("【銜接詞】", connector)
             suggested = suggested.replace("【賓語】", object_word)
             suggested = suggested.replace("【擬人詞】", personify)
             suggested = suggested.replace("【時間】", time_word)
+            suggested = suggested.replace("【動作】", predicate)
             suggested = suggested.replace("【地點】", place_word)
             suggested = suggested.replace("【感受】", feeling)
             suggested = suggested.replace("【喻體】", vehicle)
@@ -139,7 +350,11 @@ class WritingAdvisor:
             suggested = suggested.replace("【主題】", subject + "的" + object_word)
             suggested = suggested.replace("【下句優化】", sentence.strip())
             suggested = suggested.replace("【優化後短句】", adj + "的" + subject + predicate + object_word)
-            suggested = suggested.replace("【正確表述】", sentence.strip().replace("的", "得") if "的" in sentence.strip()[-2:] else sentence.strip())
+            suggested = suggested.replace("【正確表述】", self.typo_checker.correct(sentence.strip(), typos).rstrip("。！？!?；;"))
+            if profile is not None:
+                suggested = suggested.replace("【題目】", topic)
+                suggested = suggested.replace("【題目關鍵詞】", "、".join(profile.keywords))
+            suggested = suggested.replace("【錯別字類型】", "、".join(dict.fromkeys(f"「{typo.group}」" for typo in typos)))
             suggestions.append(suggested)
 
         # 不足3個建議時補充通用建議
@@ -151,11 +366,47 @@ class WritingAdvisor:
                 f"加入銜接詞：{connector}，{adj}的{object_word}讓我{feeling}到難以忘懷～"
             ]))
 
+        # 有用詞相關的高分作文範例句時，以真實例句取代最後一個建議
+        if exemplars:
+            suggestions[-1] = f"參考高分作文的句子：{exemplars[0]}"
+
         return suggestions
 
-    def calculate_score(self, full_text):
-        """根據10本規則計算總分（100分制）"""
-        sentences = [s.strip() for s in full_text.split("。") if s.strip()]
+    def score_key(self, full_text, topic=None):
+        """作文評分結果的快取鍵（內容、題目、規則資源版本、錯字模型或共用詞典檔不同時就不同）"""
+        lexicon = self.lexicon.checksum if self.lexicon is not None else ""
+        version = f"{self.snapshot.version}:{self.typo_checker.checksum}:{lexicon}"
+        return content_hash(full_text, topic, version)
+
+    def calculate_score(self, full_text, session=None, topic=None):
+        """根據10本規則計算總分（100分制），回傳（總分, 分項得分）
+
+        相同內容（正規化後）在相同題目與規則版本下的結果會沿用：先查記憶體快取，
+        再查已儲存且帶有內容雜湊的練習記錄，都沒有才重新評分。規則更新後快取鍵不同，舊結果不再使用。
+        """
+        topic = topic or (session.topic if session is not None else None)
+        key = self.score_key(full_text, topic)
+        result = self.score_cache.get(key)
+        if result is None:
+            result = self._stored_score(key) or self._score_text(full_text, session, topic)
+            self.score_cache.put(key, *result)
+        return result
+
+    def _stored_score(self, key):
+        try:
+            return stored_score(self._record_readers.connection(), key)
+        except sqlite3.Error:
+            # 分庫還不存在，或舊資料庫尚未補上內容雜湊欄位
+            return None
+
+    def _score_text(self, full_text, session, topic):
+        """實際評分：以斷句器單次掃描全文，每句只分析一次
+
+        傳入編輯器的 session 時，寫作過程已分析過的句子直接重用特徵。有作文題目時，偏離主題的句子扣內容充實分。
+        """
+        features_for = session.features_for if session is not None else self._sentence_features
+        profile = self.snapshot.topics.get(topic)
+        off_topic = 0
         total_score = 0.0
 
         # 分項評分（對應規則權重）
@@ -165,46 +416,107 @@ class WritingAdvisor:
             "結構邏輯": 25,  # 權重25%
             "內容充實": 20   # 權重20%
         }
+        counts = {"has_rhetoric": 0, "has_adj": 0, "has_connector": 0, "has_detail": 0, "has_feeling": 0}
+        first_body = last_body = None
+
+        for span in iter_sentences(full_text):
+            analysis = features_for(span.body)
+            if first_body is None:
+                first_body = span.body
+            last_body = span.body
 
-        # 1. 基礎規範評分（句子完整性、標點、長度）
-        for sent in sentences:
-            analysis = self._analyze_sentence(sent)
+            # 1. 基礎規範評分（句子完整性、標點、長度）
             if not analysis["has_predicate"]:
                 scores["基礎規範"] -= 5
             if analysis["sentence_length"] < 8 or analysis["sentence_length"] > 20:
                 scores["基礎規範"] -= 3
-            if not sent.endswith(("。", "！", "？")):
+            if not span.terminated:
                 scores["基礎規範"] -= 2
+            scores["基礎規範"] -= 2 * len(analysis["typos"])
+            if profile is not None and topic_relevance.is_off_topic(profile, analysis["words"]):
+                off_topic += 1
+            for flag in counts:
+                if analysis[flag]:
+                    counts[flag] += 1
         scores["基礎規範"] = max(scores["基礎規範"], 0)
 
         # 2. 表達技巧評分（修辭、形容詞）
-        rhetoric_count = sum(1 for sent in sentences if self._analyze_sentence(sent)["has_rhetoric"])
-        adj_count = sum(1 for sent in sentences if self._analyze_sentence(sent)["has_adj"])
-        scores["表達技巧"] = min(25, rhetoric_count * 5 + adj_count * 3)
+        scores["表達技巧"] = min(25, counts["has_rhetoric"] * 5 + counts["has_adj"] * 3)
 
         # 3. 結構邏輯評分（銜接詞、總分總）
-        connector_count = sum(1 for sent in sentences if any(word in self.resources["銜接詞"] for word in jieba.lcut(sent)))
-        has_intro = any("是我" in sentences[0] or "讓我" in sentences[0] if sentences else False)
-        has_conclusion = any("明白了" in sentences[-1] or "難忘" in sentences[-1] if sentences else False)
-        scores["結構邏輯"] = min(25, connector_count * 4 + (5 if has_intro else 0) + (5 if has_conclusion else 0))
+        has_intro = first_body is not None and ("是我" in first_body or "讓我" in first_body)
+        has_conclusion = last_body is not None and ("明白了" in last_body or "難忘" in last_body)
+        scores["結構邏輯"] = min(25, counts["has_connector"] * 4 + (5 if has_intro else 0) + (5 if has_conclusion else 0))
 
         # 4. 內容充實評分（細節、感受）
-        detail_count = sum(1 for sent in sentences if self._analyze_sentence(sent)["has_detail"])
-        feeling_count = sum(1 for sent in sentences if self._analyze_sentence(sent)["has_feeling"])
-        scores["內容充實"] = min(20, detail_count * 3 + feeling_count * 2)
+        scores["內容充實"] = min(20, counts["has_detail"] * 3 + counts["has_feeling"] * 2)
+        # 5. 切題：每句偏離主題的句子扣2分
+        scores["內容充實"] = max(scores["內容充實"] - 2 * off_topic, 0)
 
         # 計算總分
         total_score = sum(scores.values())
         return total_score, scores
 
-    def save_practice_record(self, practice_mode, topic, input_text, suggested_text, score):
-        """儲存練習記錄到資料庫"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-        INSERT INTO practice_records (practice_mode, topic, input_text, suggested_text, score)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (practice_mode, topic, input_text, suggested_text, score))
-        self.conn.commit()
+    def speech_suggestions(self, text, grade="3-6年級"):
+        """講話轉寫的優化建議：先轉成書面語再產生建議，最後補上書面語版本
+
+        回傳（書面語文字, 建議清單）；介面與批次轉寫共用。
+        """
+        formal_text = to_written_language(text)
+        suggestions = self.generate_suggestions(formal_text, grade=grade)
+        suggestions.append(f"書面語優化：{formal_text}（刪除口語助詞，更符合作文要求）")
+        return formal_text, suggestions
+
+    def save_practice_record(self, practice_mode, topic, input_text, suggested_text, score,
+                             student_id="default_student", school_id="", class_id="", detail_scores=None):
+        """儲存練習記錄到資料庫（依學校/班級寫入對應分庫），回傳記錄編號
+
+        detail_scores 傳入 calculate_score 的分項得分，供班級分析使用；分數與這份內容的評分快取相同時
+        一併存入內容雜湊，之後重新開啟或重新評分相同內容時直接沿用。
+        可從任何執行緒呼叫：寫入在寫入執行緒中依序執行，呼叫端等待寫入完成。
+        """
+        key = None
+        if detail_scores is not None:
+            key = self.score_key(input_text, topic)
+            if not self.score_cache.matches(key, score, detail_scores):
+                key = None
+
+        def insert(conn, codec):
+            record_id = insert_practice_record(conn.cursor(), codec, student_id, school_id, class_id,
+                                               practice_mode, topic, input_text, suggested_text, score,
+                                               detail_scores=detail_scores, content_hash=key)
+            conn.commit()
+            return record_id
+
+        return self.write_records(insert, school_id=school_id, class_id=class_id)
+
+    def write_records(self, func, *args, school_id="", class_id=""):
+        """在寫入執行緒中，以學校/班級對應分庫的寫入連線執行 func(conn, codec, *args) 並回傳結果
+
+        可從任何執行緒呼叫；func 自行決定何時提交（如練習記錄與批次進度在同一個交易）。
+        """
+        return self.writer.call(self._write_records, func, school_id, class_id, args)
+
+    def _write_records(self, func, school_id, class_id, args):
+        conn = self._write_router.records_connection(school_id, class_id)
+        codec = self._codecs.get(id(conn))
+        if codec is None:
+            codec = self._codecs[id(conn)] = TextCodec(conn)
+        return func(conn, codec, *args)
+
+    def _close_writes(self):
+        self._write_router.close()
+        self._codecs = {}
+
+    def reconnect(self):
+        """重新開啟資料庫連線並沿用已載入的快照（多進程伺服器 fork 後使用，SQLite連線不能跨進程）"""
+        self.close()
+        self._write_router = self.router.clone()
+        self._reloader.reconnect()
+        self._exemplars.reconnect()
 
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        self.writer.close(self._close_writes)
+        self.readers.close()
+        self._record_readers.close()
+        self.router.close()
\ No newline at end of file